@@ -0,0 +1,125 @@
+"""
+购物车cookie编解码
+
+cookie格式(v1), urlsafe base64编码, 去掉末尾的'=':
+    版本号(1字节) + HMAC-SHA256签名前16字节 + N * 商品条目(6字节)
+    商品条目: sku_id(uint32) + count << 1 | selected(uint16), 大端
+
+旧版cookie为pickle+base64(utils.myjson), 读取时使用只允许基本类型的反序列化器兼容,
+写回时统一转为v1格式
+"""
+import base64
+import binascii
+import hashlib
+import hmac
+import io
+import pickle
+import struct
+from collections import OrderedDict
+from functools import lru_cache
+
+from django.conf import settings
+
+from carts import constants
+
+VERSION = 1
+_HEADER = struct.Struct('>B16s')
+_ITEM = struct.Struct('>IH')
+_MAX_PAYLOAD = _HEADER.size + _ITEM.size * constants.CART_COOKIE_MAX_ITEMS
+_MAX_COOKIE_LENGTH = 4096
+
+
+@lru_cache(maxsize=None)
+def _signing_key(secret_key):
+    """由SECRET_KEY派生签名密钥"""
+    return hashlib.sha256(b'carts.codec' + secret_key.encode()).digest()
+
+
+def _sign(body):
+    """对版本号与商品条目签名"""
+    return hmac.new(_signing_key(settings.SECRET_KEY), body, hashlib.sha256).digest()[:16]
+
+
+def dumps(cart_dict):
+    """
+    将购物车字典编码为cookie字符串
+    :param cart_dict: {sku_id: {'count': xxx, 'selected': True}, ...}
+    :return: 字符串, 超出条目上限的商品被丢弃, 数量超出上限的按上限保存
+    """
+    values = [VERSION]
+    for sku_id, value in list(cart_dict.items())[:constants.CART_COOKIE_MAX_ITEMS]:
+        count = min(int(value['count']), constants.CART_COOKIE_MAX_COUNT)
+        values.append(int(sku_id))
+        values.append(count << 1 | bool(value['selected']))
+
+    body = struct.pack('>B' + 'IH' * (len(values) // 2), *values)
+    payload = body[:1] + _sign(body) + body[1:]
+    return base64.urlsafe_b64encode(payload).rstrip(b'=').decode()
+
+
+def loads(cart_str):
+    """
+    将cookie字符串解码为购物车字典
+    签名错误, 格式错误或超出条目上限的cookie视为空购物车
+    :param cart_str: cookie中的购物车字符串
+    :return: OrderedDict {sku_id: {'count': xxx, 'selected': True}, ...}
+    """
+    if not cart_str:
+        return OrderedDict()
+
+    # 超出浏览器cookie长度上限的数据不做解码
+    if len(cart_str) > _MAX_COOKIE_LENGTH:
+        return OrderedDict()
+
+    try:
+        payload = base64.urlsafe_b64decode(cart_str + '=' * (-len(cart_str) % 4))
+    except (binascii.Error, ValueError):
+        return OrderedDict()
+
+    if payload[:1] != struct.pack('>B', VERSION):
+        return _loads_legacy(cart_str)
+
+    if not _HEADER.size <= len(payload) <= _MAX_PAYLOAD or (len(payload) - _HEADER.size) % _ITEM.size:
+        return OrderedDict()
+
+    version, signature = _HEADER.unpack_from(payload)
+    body = payload[:1] + payload[_HEADER.size:]
+    if not hmac.compare_digest(signature, _sign(body)):
+        return OrderedDict()
+
+    cart_dict = OrderedDict()
+    for sku_id, packed in _ITEM.iter_unpack(payload[_HEADER.size:]):
+        cart_dict[sku_id] = {
+            'count': packed >> 1,
+            'selected': bool(packed & 1)
+        }
+    return cart_dict
+
+
+class _LegacyUnpickler(pickle.Unpickler):
+    """旧版cookie反序列化器, 只允许dict/int/bool/str等基本类型, 禁止加载任何类"""
+
+    def find_class(self, module, name):
+        raise pickle.UnpicklingError('禁止加载%s.%s' % (module, name))
+
+
+def _loads_legacy(cart_str):
+    """读取旧版pickle+base64格式的cookie"""
+    try:
+        data = _LegacyUnpickler(io.BytesIO(base64.b64decode(cart_str))).load()
+    except Exception:
+        return OrderedDict()
+
+    cart_dict = OrderedDict()
+    if not isinstance(data, dict):
+        return cart_dict
+
+    try:
+        for sku_id, value in list(data.items())[:constants.CART_COOKIE_MAX_ITEMS]:
+            cart_dict[int(sku_id)] = {
+                'count': min(int(value['count']), constants.CART_COOKIE_MAX_COUNT),
+                'selected': bool(value['selected'])
+            }
+    except (KeyError, TypeError, ValueError):
+        return OrderedDict()
+    return cart_dict
@@ -1,2 +1,30 @@
 # 购物车cookie的有效期
 CART_COOKIE_EXPIRES = 365 * 24 * 60 * 60
+
+# 购物车cookie中最多保存的商品条目数
+CART_COOKIE_MAX_ITEMS = 200
+
+# 购物车cookie中单个商品的最大数量
+CART_COOKIE_MAX_COUNT = 0x7FFF
+
+# 购物车批量操作一次最多包含的操作数
+CART_BATCH_MAX_OPERATIONS = 100
+
+# 登录时合并cookie购物车的策略, 两边都有的商品如何处理
+# sum: 数量相加, max: 取较大的数量, cookie: 以cookie为准, redis: 以redis为准
+CART_MERGE_POLICY = 'cookie'
+
+# 登录时合并cookie购物车后, 购物车最多的条目数, 超出的新商品不再合并
+CART_REDIS_MAX_LINES = 200
+
+# 登录用户购物车在redis中的过期时间, 每次访问时刷新
+CART_REDIS_EXPIRES = 90 * 24 * 60 * 60
+
+# 购物车超过该时间未访问时归档到mysql, 需小于CART_REDIS_EXPIRES, 否则购物车会先过期丢失
+CART_ARCHIVE_IDLE = 30 * 24 * 60 * 60
+
+# 归档时每批处理的购物车数量
+CART_ARCHIVE_BATCH_SIZE = 500
+
+# 一次归档任务最多归档的购物车数量
+CART_ARCHIVE_MAX_PER_RUN = 50000
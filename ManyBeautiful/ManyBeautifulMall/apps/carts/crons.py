@@ -0,0 +1,78 @@
+import logging
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django_redis import get_redis_connection
+
+from carts import constants
+from carts.models import CartArchive
+from carts.store import CartStore, ACCESS_KEY
+
+logger = logging.getLogger('django')
+
+
+def archive_carts(user_ids):
+    """
+    归档一批购物车到mysql
+    先在管道中读取购物车与版本号, 写入归档表后再按版本号删除redis中的购物车,
+    期间被修改过的购物车不删除, 并删除其归档记录
+    :param user_ids: 用户id列表
+    :return: 归档的购物车数量
+    """
+    redis_conn = get_redis_connection('cart')
+    stores = [CartStore(int(user_id)) for user_id in user_ids]
+
+    pl = redis_conn.pipeline(transaction=False)
+    for store in stores:
+        store.export(pl)
+    exports = [CartStore.parse_export(result) for result in pl.execute()]
+
+    # 空购物车不需要归档记录, 直接删除
+    archives = [CartArchive(user_id=store.user_id, data=CartArchive.dumps(cart_dict))
+                for store, (version, cart_dict) in zip(stores, exports) if cart_dict]
+    with transaction.atomic():
+        CartArchive.objects.filter(user_id__in=[archive.user_id for archive in archives]).delete()
+        CartArchive.objects.bulk_create(archives)
+
+    pl = redis_conn.pipeline(transaction=False)
+    for store, (version, cart_dict) in zip(stores, exports):
+        store.evict(version, bool(cart_dict), pl)
+    evicted = pl.execute()
+
+    changed = [store.user_id for store, (version, cart_dict), result in zip(stores, exports, evicted)
+               if cart_dict and not result]
+    if changed:
+        CartArchive.objects.filter(user_id__in=changed).delete()
+
+    return sum(1 for (version, cart_dict), result in zip(exports, evicted) if cart_dict and result)
+
+
+def archive_idle_carts():
+    """归档超过CART_ARCHIVE_IDLE未访问的购物车, redis内存超出预算时继续归档最久未访问的购物车"""
+    redis_conn = get_redis_connection('cart')
+    batch_size = constants.CART_ARCHIVE_BATCH_SIZE
+    cutoff = int(time.time()) - constants.CART_ARCHIVE_IDLE
+    archived = 0
+    processed = 0
+
+    # 已处理(包括被修改而未删除)的用户会移出或更新访问时间, 每批都从头读取
+    while processed < constants.CART_ARCHIVE_MAX_PER_RUN:
+        user_ids = redis_conn.zrangebyscore(ACCESS_KEY, '-inf', cutoff, start=0, num=batch_size)
+        if not user_ids:
+            break
+        archived += archive_carts(user_ids)
+        processed += len(user_ids)
+
+    # 内存预算
+    max_memory = getattr(settings, 'CART_REDIS_MAX_MEMORY', None)
+    while max_memory and processed < constants.CART_ARCHIVE_MAX_PER_RUN:
+        if redis_conn.info('memory')['used_memory'] <= max_memory:
+            break
+        user_ids = redis_conn.zrange(ACCESS_KEY, 0, batch_size - 1)
+        if not user_ids:
+            break
+        archived += archive_carts(user_ids)
+        processed += len(user_ids)
+
+    logger.info('归档购物车 processed=%s archived=%s' % (processed, archived))
@@ -0,0 +1,63 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django_redis import get_redis_connection
+from redis.exceptions import ResponseError
+
+from carts.models import CartArchive
+from carts.store import CartStore, ACCESS_KEY
+
+DAY = 24 * 60 * 60
+
+# 按最后访问时间分组, (名称, 最小天数, 最大天数)
+AGE_BUCKETS = (
+    ('<1d', 0, 1),
+    ('1-7d', 1, 7),
+    ('7-30d', 7, 30),
+    ('30-90d', 30, 90),
+    ('>90d', 90, None),
+)
+
+
+class Command(BaseCommand):
+    help = '统计购物车redis库的键数量, 内存占用, 以及按最后访问时间分组的购物车数量与估算内存'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sample', type=int, default=20, help='每组抽样估算内存的购物车数量')
+
+    def handle(self, *args, **options):
+        redis_conn = get_redis_connection('cart')
+        now = int(time.time())
+        max_memory = getattr(settings, 'CART_REDIS_MAX_MEMORY', None)
+
+        self.stdout.write('keys: %s' % redis_conn.dbsize())
+        self.stdout.write('used_memory: %s / budget: %s' % (
+            redis_conn.info('memory')['used_memory'], max_memory or '-'))
+        self.stdout.write('archived carts: %s' % CartArchive.objects.count())
+
+        self.stdout.write('%8s %10s %14s' % ('age', 'carts', 'est. bytes'))
+        for name, min_days, max_days in AGE_BUCKETS:
+            # 访问时间在(now - max_days, now - min_days]之间
+            high = now - min_days * DAY
+            low = '(%s' % (now - max_days * DAY) if max_days else '-inf'
+            count = redis_conn.zcount(ACCESS_KEY, low, high)
+            user_ids = redis_conn.zrevrangebyscore(ACCESS_KEY, high, low, start=0, num=options['sample'])
+            average = self.average_memory(redis_conn, user_ids)
+            self.stdout.write('%8s %10s %14s' % (
+                name, count, '-' if average is None else int(average * count)))
+
+    @staticmethod
+    def average_memory(redis_conn, user_ids):
+        """抽样购物车的平均内存占用, 不支持MEMORY USAGE时返回None"""
+        if not user_ids:
+            return 0
+        total = 0
+        for user_id in user_ids:
+            # 不包括最后的访问时间, 归档标记两个公共键
+            for key in CartStore(int(user_id)).keys[:-2]:
+                try:
+                    total += redis_conn.execute_command('MEMORY', 'USAGE', key) or 0
+                except ResponseError:
+                    return None
+        return total / len(user_ids)
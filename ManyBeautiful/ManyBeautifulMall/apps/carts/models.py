@@ -1,3 +1,48 @@
+import json
+from collections import OrderedDict
+from decimal import Decimal
+
 from django.db import models
 
-# Create your models here.
+from users.models import User
+from utils.models import BaseModel
+
+
+class CartArchive(BaseModel):
+    """
+    归档的购物车
+    长期未访问的登录用户购物车从redis移到mysql, 用户再次访问时恢复到redis并删除归档记录
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='cart_archive', verbose_name='用户')
+    # [[sku_id, count, selected, 快照价格, 快照版本号], ...], 没有商品快照时只有前三项
+    data = models.TextField(verbose_name='购物车数据')
+
+    class Meta:
+        db_table = 'tb_cart_archive'
+        verbose_name = '归档购物车'
+        verbose_name_plural = verbose_name
+
+    @staticmethod
+    def dumps(cart_dict):
+        """
+        :param cart_dict: {sku_id: {'count': xxx, 'selected': True, 'snapshot': 商品快照或None}, ...}
+        :return: 保存到data字段的字符串
+        """
+        lines = []
+        for sku_id, value in cart_dict.items():
+            line = [sku_id, value['count'], int(bool(value['selected']))]
+            snapshot = value.get('snapshot')
+            if snapshot:
+                line.extend((str(snapshot['price']), snapshot['version']))
+            lines.append(line)
+        return json.dumps(lines, separators=(',', ':'))
+
+    def load(self):
+        """:return: OrderedDict {sku_id: {'count': xxx, 'selected': True, 'snapshot': 商品快照或None}, ...}"""
+        cart_dict = OrderedDict()
+        for line in json.loads(self.data):
+            snapshot = None
+            if len(line) > 3:
+                snapshot = {'price': Decimal(line[3]), 'version': line[4]}
+            cart_dict[line[0]] = {'count': line[1], 'selected': bool(line[2]), 'snapshot': snapshot}
+        return cart_dict
@@ -0,0 +1,106 @@
+from carts import codec
+from carts.store import CartStore
+from goods.sku_cache import sku_cache
+
+# 购物车商品的提示
+# 已下架
+WARNING_OFF_SHELF = 'off_shelf'
+# 无货
+WARNING_OUT_OF_STOCK = 'out_of_stock'
+# 库存不足购物车中的数量
+WARNING_LOW_STOCK = 'low_stock'
+# 加入购物车后涨价/降价
+WARNING_PRICE_UP = 'price_up'
+WARNING_PRICE_DOWN = 'price_down'
+
+
+def check_line(summary, value):
+    """
+    对比商品加入购物车时的快照与当前的SKU摘要
+    版本号未变化的商品不需要比较价格, 库存与上下架状态每次都检查(摘要中的库存为近似值)
+    :param summary: SKU摘要
+    :param value: {'count': xxx, 'selected': True, 'snapshot': 商品快照或None}, cookie购物车没有快照
+    :return: 提示列表
+    """
+    warnings = []
+    if not summary['is_launched']:
+        warnings.append(WARNING_OFF_SHELF)
+    elif summary['stock'] <= 0:
+        warnings.append(WARNING_OUT_OF_STOCK)
+    elif summary['stock'] < value['count']:
+        warnings.append(WARNING_LOW_STOCK)
+
+    snapshot = value.get('snapshot')
+    if snapshot and snapshot['version'] != summary['version'] and snapshot['price'] != summary['price']:
+        warnings.append(WARNING_PRICE_UP if summary['price'] > snapshot['price'] else WARNING_PRICE_DOWN)
+    return warnings
+
+
+class CartReader(object):
+    """
+    购物车读取器
+    一次往返读取redis购物车(数量+勾选+商品快照), 商品从SKU摘要缓存中批量读取(未命中时一次pk__in查询),
+    并按购物车中的顺序返回商品列表, 每个商品附带与加入时快照对比得到的提示
+    redis_calls/db_queries记录本次读取与redis和mysql的交互次数, 不随购物车条目数增长
+    """
+
+    def __init__(self):
+        self.redis_calls = 0
+        self.db_queries = 0
+
+    def read_redis_cart(self, user_id):
+        """
+        读取登录用户的购物车
+        :param user_id: 用户id
+        :return: OrderedDict {sku_id: {'count': xxx, 'selected': True, 'snapshot': 商品快照或None}, ...}
+        """
+        cart_dict = CartStore(user_id).snapshot()
+        self.redis_calls += 1
+        return cart_dict
+
+    def read_cookie_cart(self, cart_str):
+        """
+        读取未登录用户cookie中的购物车
+        :param cart_str: cookie中的购物车字符串
+        :return: {sku_id: {'count': xxx, 'selected': True}, ...}
+        """
+        return codec.loads(cart_str)
+
+    def load_skus(self, cart_dict):
+        """
+        从SKU摘要缓存中批量读取购物车中所有商品, 缓存未命中的商品一次查询
+        :param cart_dict: read_redis_cart/read_cookie_cart的返回值
+        :return: [{id, name, price, default_image_url, count, selected, added_price, warnings, ...}, ...]
+                 顺序与cart_dict一致, 已不存在的商品被忽略
+        """
+        if not cart_dict:
+            return []
+
+        summaries = sku_cache.get_many(cart_dict.keys(), counter=self)
+
+        skus = []
+        for sku_id, value in cart_dict.items():
+            summary = summaries.get(sku_id)
+            if summary is None:
+                continue
+            sku = dict(summary)
+            sku['count'] = value['count']
+            sku['selected'] = value['selected']
+            snapshot = value.get('snapshot')
+            sku['added_price'] = snapshot['price'] if snapshot else None
+            sku['warnings'] = check_line(summary, value)
+            skus.append(sku)
+        return skus
+
+    def read(self, request, user=None):
+        """
+        读取当前请求的购物车商品
+        :param request: 用于读取cookie
+        :param user: 当前用户, 未登录为None
+        :return: [{id, name, price, default_image_url, count, selected, added_price, warnings, ...}, ...]
+        """
+        if user is not None and user.is_authenticated:
+            cart_dict = self.read_redis_cart(user.id)
+        else:
+            cart_dict = self.read_cookie_cart(request.COOKIES.get('cart'))
+        return self.load_skus(cart_dict)
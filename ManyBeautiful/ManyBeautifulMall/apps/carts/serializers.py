@@ -1,6 +1,8 @@
 from rest_framework import serializers
 
+from carts import constants
 from goods.models import SKU
+from goods.sku_cache import sku_cache
 
 
 # 购物车数据添加序列化器
@@ -14,15 +16,10 @@ class AddCartSerializer(serializers.Serializer):
 
     # 验证
     def validate(self, attrs):
-        try:
-            sku = SKU.objects.get(id=attrs['sku_id'])
-        except:
-            raise serializers.ValidationError('查询商品SKU错误')
-
-        if sku is None:
+        # 从SKU摘要缓存中验证商品是否存在
+        if sku_cache.get(attrs['sku_id']) is None:
             raise serializers.ValidationError('未查询到数据')
-        else:
-            return attrs
+        return attrs
 
 
 # 购物车数据查询序列化器
@@ -31,10 +28,14 @@ class FindCartSerializer(serializers.ModelSerializer):
     # 定义属性
     count = serializers.IntegerField(label='数量')
     selected = serializers.BooleanField(label='是否勾选')
+    # 加入购物车时的价格, 没有快照时为null
+    added_price = serializers.DecimalField(label='加入时价格', max_digits=10, decimal_places=2, allow_null=True)
+    # off_shelf 已下架, out_of_stock 无货, low_stock 库存不足, price_up/price_down 加入后涨价/降价
+    warnings = serializers.ListField(label='提示', child=serializers.CharField())
 
     class Meta:
         model = SKU
-        fields = ('id', 'name', 'default_image_url', 'price', 'count', 'selected')
+        fields = ('id', 'name', 'default_image_url', 'price', 'count', 'selected', 'added_price', 'warnings')
 
 
 # 购物车数据修改序列化器
@@ -48,15 +49,10 @@ class UpDateCartSerializer(serializers.Serializer):
 
     # 验证
     def validate(self, attrs):
-        try:
-            sku = SKU.objects.get(id=attrs['sku_id'])
-        except:
-            raise serializers.ValidationError('查询商品SKU错误')
-
-        if sku is None:
+        # 从SKU摘要缓存中验证商品是否存在
+        if sku_cache.get(attrs['sku_id']) is None:
             raise serializers.ValidationError('未查询到数据')
-        else:
-            return attrs
+        return attrs
 
 
 # 购物车数据删除序列化器
@@ -68,9 +64,7 @@ class DeleteCartSerializer(serializers.Serializer):
     # 验证
     def validate_sku_id(self, value):
         # 获取商品信息,验证商品是否存在
-        try:
-            sku = SKU.objects.get(id=value)
-        except SKU.DoesNotExist:
+        if sku_cache.get(value) is None:
             raise serializers.ValidationError('商品不存在')
 
         return value
@@ -80,3 +74,42 @@ class DeleteCartSerializer(serializers.Serializer):
 class SelectAllCartSerializer(serializers.Serializer):
     """购物车数据全选序列化器"""
     selected = serializers.BooleanField(label='全选')
+
+
+# 购物车批量操作中单个操作的序列化器
+class CartOperationSerializer(serializers.Serializer):
+    """购物车批量操作中单个操作的序列化器"""
+    ACTION_CHOICES = ('add', 'update', 'remove', 'select')
+
+    action = serializers.ChoiceField(label='操作', choices=ACTION_CHOICES)
+    sku_id = serializers.IntegerField(label='sku_id', min_value=1, required=False)
+    count = serializers.IntegerField(label='数量', min_value=1, required=False)
+    selected = serializers.BooleanField(label='是否勾选', default=True)
+
+    # 验证
+    def validate(self, attrs):
+        action = attrs['action']
+        if action != 'select' and 'sku_id' not in attrs:
+            raise serializers.ValidationError('缺少sku_id')
+        if action in ('add', 'update') and 'count' not in attrs:
+            raise serializers.ValidationError('缺少数量')
+        return attrs
+
+
+# 购物车批量操作序列化器
+class BatchCartSerializer(serializers.Serializer):
+    """购物车批量操作序列化器"""
+    operations = CartOperationSerializer(label='操作列表', many=True)
+
+    # 验证
+    def validate_operations(self, value):
+        if not value:
+            raise serializers.ValidationError('操作列表为空')
+        if len(value) > constants.CART_BATCH_MAX_OPERATIONS:
+            raise serializers.ValidationError('操作数量超过上限')
+
+        # 一次验证所有商品是否存在
+        sku_ids = set(operation['sku_id'] for operation in value if operation['action'] in ('add', 'update'))
+        if len(sku_cache.get_many(sku_ids)) < len(sku_ids):
+            raise serializers.ValidationError('商品不存在')
+        return value
@@ -0,0 +1,682 @@
+"""
+登录用户的redis购物车存储
+
+所有修改操作都由注册的lua脚本(EVALSHA)完成, 每次修改只有一次往返且是原子的,
+snapshot()一次读出数量与勾选状态, 下单流程读取的是一致的购物车快照
+
+支持两种存储结构, 由配置项CART_REDIS_LAYOUT指定:
+    split(默认): cart_<user_id> hash保存数量, cart_selected_<user_id> set保存勾选的sku_id
+    packed: cart_items_<user_id> 一个hash同时保存数量与勾选状态, 勾选为正数, 未勾选为负数
+
+cart_snapshot_<user_id> hash保存每个商品加入购物车时的快照"价格:版本号", 用于展示时提示价格变化,
+删除商品时由修改脚本同时清理
+
+cart_meta_<user_id> hash保存条目数, 总数量, 勾选数量与版本号, 修改脚本按每个商品修改前后的数量与勾选状态
+在同一次执行中增量更新, 读取购物车角标与修改购物车时都不需要遍历购物车
+
+每次访问刷新购物车的过期时间(CART_REDIS_EXPIRES)并在cart_access中记录访问时间,
+长期未访问的购物车由carts.crons.archive_idle_carts归档到tb_cart_archive, 下次访问时自动恢复
+"""
+import time
+from collections import OrderedDict
+from decimal import Decimal
+
+from django.conf import settings
+from django_redis import get_redis_connection
+from redis.exceptions import ResponseError
+
+from carts import constants
+from carts.models import CartArchive
+
+LAYOUT_SPLIT = 'split'
+LAYOUT_PACKED = 'packed'
+
+# 登录时合并cookie购物车的策略
+MERGE_POLICIES = ('sum', 'max', 'cookie', 'redis')
+
+# 所有登录用户购物车的最后访问时间 zset {user_id: 时间戳}
+ACCESS_KEY = 'cart_access'
+# 购物车已归档到mysql的用户 bitmap, 第user_id位为1表示已归档
+ARCHIVED_KEY = 'cart_archived'
+
+# 读取整个购物车, 返回: sku_id, count, selected, snapshot, sku_id, count, selected, snapshot, ...
+# 没有快照的商品snapshot为空字符串
+_SPLIT_SNAPSHOT = """
+    local items = redis.call('HGETALL', KEYS[1])
+    local result = {}
+    for i = 1, #items, 2 do
+        result[#result + 1] = items[i]
+        result[#result + 1] = items[i + 1]
+        result[#result + 1] = redis.call('SISMEMBER', KEYS[2], items[i])
+        result[#result + 1] = redis.call('HGET', snapshot_key, items[i]) or ''
+    end
+    return result
+"""
+
+_PACKED_SNAPSHOT = """
+    local items = redis.call('HGETALL', KEYS[1])
+    local result = {}
+    for i = 1, #items, 2 do
+        local count = tonumber(items[i + 1])
+        result[#result + 1] = items[i]
+        result[#result + 1] = math.abs(count)
+        result[#result + 1] = count > 0 and 1 or 0
+        result[#result + 1] = redis.call('HGET', snapshot_key, items[i]) or ''
+    end
+    return result
+"""
+
+# 所有脚本的公共部分
+# ARGV前三个参数为当前时间, 过期时间, 用户id, 取出后从ARGV中移除, 脚本自身的参数从ARGV[1]开始
+# KEYS最后四个为商品快照, 统计信息, 访问时间有序集合cart_access, 归档标记位图cart_archived
+# touch(): 刷新购物车所有键的过期时间, 并记录访问时间
+_HEADER = """
+    local now, ttl, user_id = ARGV[1], tonumber(ARGV[2]), ARGV[3]
+    for i = 1, 3 do
+        table.remove(ARGV, 1)
+    end
+    local snapshot_key, meta_key = KEYS[#KEYS - 3], KEYS[#KEYS - 2]
+    local access_key, archived_key = KEYS[#KEYS - 1], KEYS[#KEYS]
+    local function touch()
+        for i = 1, #KEYS - 2 do
+            redis.call('EXPIRE', KEYS[i], ttl)
+        end
+        redis.call('ZADD', access_key, now, user_id)
+    end
+"""
+
+# 各存储结构读写单个商品的方法:
+#   get_line(sku_id): return 数量, 是否勾选; 商品不在购物车中时数量为nil
+#   write_line(sku_id, count, selected), del_line(sku_id)
+#   select_rows(selected): 全选/取消全选, return 条目数
+#   refresh_meta(): 遍历购物车重新统计cart_meta_<user_id>中的条目数, 总数量, 勾选数量, 并增加版本号
+_LAYOUT_PROLOGUES = {
+    LAYOUT_SPLIT: """
+        local function get_line(sku_id)
+            local count = tonumber(redis.call('HGET', KEYS[1], sku_id))
+            if count == nil then
+                return nil, false
+            end
+            return count, redis.call('SISMEMBER', KEYS[2], sku_id) == 1
+        end
+        local function write_line(sku_id, count, selected)
+            redis.call('HSET', KEYS[1], sku_id, count)
+            if selected then
+                redis.call('SADD', KEYS[2], sku_id)
+            else
+                redis.call('SREM', KEYS[2], sku_id)
+            end
+        end
+        local function del_line(sku_id)
+            redis.call('HDEL', KEYS[1], sku_id)
+            redis.call('SREM', KEYS[2], sku_id)
+        end
+        local function select_rows(selected)
+            local sku_ids = redis.call('HKEYS', KEYS[1])
+            if selected then
+                for i = 1, #sku_ids do
+                    redis.call('SADD', KEYS[2], sku_ids[i])
+                end
+            else
+                redis.call('DEL', KEYS[2])
+            end
+            return #sku_ids
+        end
+        local function refresh_meta()
+            local items = redis.call('HGETALL', KEYS[1])
+            local lines, quantity, selected_quantity = 0, 0, 0
+            for i = 1, #items, 2 do
+                local count = tonumber(items[i + 1])
+                lines = lines + 1
+                quantity = quantity + count
+                if redis.call('SISMEMBER', KEYS[2], items[i]) == 1 then
+                    selected_quantity = selected_quantity + count
+                end
+            end
+            redis.call('HMSET', meta_key, 'lines', lines, 'quantity', quantity, 'selected_quantity', selected_quantity)
+            redis.call('HINCRBY', meta_key, 'version', 1)
+        end
+    """,
+    LAYOUT_PACKED: """
+        local function get_line(sku_id)
+            local count = tonumber(redis.call('HGET', KEYS[1], sku_id))
+            if count == nil then
+                return nil, false
+            end
+            return math.abs(count), count > 0
+        end
+        local function write_line(sku_id, count, selected)
+            if not selected then
+                count = -count
+            end
+            redis.call('HSET', KEYS[1], sku_id, count)
+        end
+        local function del_line(sku_id)
+            redis.call('HDEL', KEYS[1], sku_id)
+        end
+        local function select_rows(selected)
+            local items = redis.call('HGETALL', KEYS[1])
+            for i = 1, #items, 2 do
+                write_line(items[i], math.abs(tonumber(items[i + 1])), selected)
+            end
+            return #items / 2
+        end
+        local function refresh_meta()
+            local items = redis.call('HGETALL', KEYS[1])
+            local lines, quantity, selected_quantity = 0, 0, 0
+            for i = 1, #items, 2 do
+                local count = tonumber(items[i + 1])
+                lines = lines + 1
+                quantity = quantity + math.abs(count)
+                if count > 0 then
+                    selected_quantity = selected_quantity + count
+                end
+            end
+            redis.call('HMSET', meta_key, 'lines', lines, 'quantity', quantity, 'selected_quantity', selected_quantity)
+            redis.call('HINCRBY', meta_key, 'version', 1)
+        end
+    """,
+}
+
+# 修改脚本使用的公共方法, 基于各存储结构的方法, 修改商品时按修改前后的数量与勾选状态记录统计信息的变化量,
+# 脚本最后由update_meta()一次写入, 统计信息的维护与购物车大小无关
+_LINES = """
+    local meta_deltas = {lines = 0, quantity = 0, selected_quantity = 0}
+    local function account(count, selected, sign)
+        if count == nil then
+            return
+        end
+        meta_deltas.lines = meta_deltas.lines + sign
+        meta_deltas.quantity = meta_deltas.quantity + sign * count
+        if selected then
+            meta_deltas.selected_quantity = meta_deltas.selected_quantity + sign * count
+        end
+    end
+    -- 写入商品数量与勾选状态, selected为nil时保持原来的勾选状态(新商品不勾选)
+    local function set_line(sku_id, count, selected)
+        local old_count, old_selected = get_line(sku_id)
+        if selected == nil then
+            selected = old_selected
+        end
+        count = tonumber(count)
+        write_line(sku_id, count, selected)
+        account(old_count, old_selected, -1)
+        account(count, selected, 1)
+    end
+    -- 删除商品及其快照, return: 删除的条目数
+    local function remove_line(sku_id)
+        local old_count, old_selected = get_line(sku_id)
+        del_line(sku_id)
+        redis.call('HDEL', snapshot_key, sku_id)
+        if old_count == nil then
+            return 0
+        end
+        account(old_count, old_selected, -1)
+        return 1
+    end
+    -- 修改购物车中已有商品的勾选状态
+    local function select_line(sku_id, selected)
+        local count, old_selected = get_line(sku_id)
+        if count ~= nil and old_selected ~= selected then
+            write_line(sku_id, count, selected)
+            account(count, old_selected, -1)
+            account(count, selected, 1)
+        end
+    end
+    -- 全选/取消全选, 勾选数量变为总数量或0, return: 条目数
+    local function select_all_lines(selected)
+        local meta = redis.call('HMGET', meta_key, 'quantity', 'selected_quantity')
+        local quantity = tonumber(meta[1] or 0) + meta_deltas.quantity
+        local selected_quantity = tonumber(meta[2] or 0) + meta_deltas.selected_quantity
+        meta_deltas.selected_quantity = meta_deltas.selected_quantity - selected_quantity
+        if selected then
+            meta_deltas.selected_quantity = meta_deltas.selected_quantity + quantity
+        end
+        return select_rows(selected)
+    end
+    -- 按变化量更新统计信息并增加版本号, 统计信息不存在时(旧数据)重新统计一次
+    local function update_meta()
+        if redis.call('EXISTS', meta_key) == 0 then
+            refresh_meta()
+            return
+        end
+        for field, delta in pairs(meta_deltas) do
+            if delta ~= 0 then
+                redis.call('HINCRBY', meta_key, field, delta)
+            end
+        end
+        redis.call('HINCRBY', meta_key, 'version', 1)
+    end
+"""
+
+_PROLOGUES = {layout: _HEADER + prologue + _LINES for layout, prologue in _LAYOUT_PROLOGUES.items()}
+
+# 修改购物车的脚本, 执行后在同一脚本中更新统计信息
+MUTATIONS = ('add', 'update', 'delete', 'select_all', 'merge', 'batch')
+
+# 用户访问购物车的脚本, 购物车已归档时返回CART_ARCHIVED错误, 执行后刷新过期时间与访问时间
+ACCESSES = MUTATIONS + ('snapshot', 'summary')
+
+# 归档相关脚本
+# export: 不刷新访问时间, 读取版本号与整个购物车, return: version, sku_id, count, selected, snapshot, ...
+_EXPORT = """
+    local version = redis.call('HGET', meta_key, 'version') or '0'
+    local function snapshot()
+        %s
+    end
+    local result = snapshot()
+    table.insert(result, 1, version)
+    return result
+"""
+
+# evict: 版本号未变化时删除购物车, ARGV: version, archived(是否已写入归档表)
+_EVICT = """
+    if (redis.call('HGET', meta_key, 'version') or '0') ~= ARGV[1] then
+        return 0
+    end
+    for i = 1, #KEYS - 2 do
+        redis.call('DEL', KEYS[i])
+    end
+    redis.call('ZREM', access_key, user_id)
+    if ARGV[2] == '1' then
+        redis.call('SETBIT', archived_key, user_id, 1)
+    end
+    return 1
+"""
+
+# 购物车统计信息, 不存在时(旧数据)先统计一次
+# return: lines, quantity, selected_quantity, version
+_SUMMARY = """
+    if redis.call('EXISTS', meta_key) == 0 then
+        refresh_meta()
+    end
+    return redis.call('HMGET', meta_key, 'lines', 'quantity', 'selected_quantity', 'version')
+"""
+
+# 修改购物车的脚本, 两种存储结构共用, 通过set_line/remove_line等方法读写商品
+_MUTATION_SCRIPTS = {
+    # ARGV: sku_id, count, selected
+    'add': """
+        set_line(ARGV[1], ARGV[2], ARGV[3] == '1' or nil)
+        return 1
+    """,
+    # ARGV: sku_id, count, selected
+    'update': """
+        set_line(ARGV[1], ARGV[2], ARGV[3] == '1')
+        return 1
+    """,
+    # ARGV: sku_id, sku_id, ...
+    'delete': """
+        local deleted = 0
+        for i = 1, #ARGV do
+            deleted = deleted + remove_line(ARGV[i])
+        end
+        return deleted
+    """,
+    # ARGV: selected
+    'select_all': """
+        return select_all_lines(ARGV[1] == '1')
+    """,
+    # ARGV: policy, max_lines, sku_id, count, selected, sku_id, count, selected, ...
+    # return: added, updated, dropped, lines
+    'merge': """
+        local policy, max_lines = ARGV[1], tonumber(ARGV[2])
+        local lines = redis.call('HLEN', KEYS[1])
+        local added, updated, dropped = 0, 0, 0
+        for i = 3, #ARGV, 3 do
+            local sku_id, count, selected = ARGV[i], tonumber(ARGV[i + 1]), ARGV[i + 2] == '1'
+            local old, old_selected = get_line(sku_id)
+            local write = false
+            if old == nil then
+                if lines < max_lines then
+                    write = true
+                    lines = lines + 1
+                    added = added + 1
+                else
+                    dropped = dropped + 1
+                end
+            elseif policy ~= 'redis' then
+                if policy == 'sum' then
+                    count = old + count
+                elseif policy == 'max' then
+                    count = math.max(old, count)
+                end
+                if policy ~= 'cookie' then
+                    selected = selected or old_selected
+                end
+                write = true
+                updated = updated + 1
+            end
+            if write then
+                set_line(sku_id, count, selected)
+            end
+        end
+        return {added, updated, dropped, lines}
+    """,
+}
+
+# ARGV: op, sku_id, count, selected, op, sku_id, count, selected, ...
+# op: add/update/remove/select, select时sku_id为0表示全部商品
+# 执行后读取整个购物车, 由各存储结构拼接读取部分
+_BATCH = """
+    for i = 1, #ARGV, 4 do
+        local op, sku_id, count, selected = ARGV[i], ARGV[i + 1], ARGV[i + 2], ARGV[i + 3] == '1'
+        if op == 'add' then
+            set_line(sku_id, count, selected or nil)
+        elseif op == 'update' then
+            set_line(sku_id, count, selected)
+        elseif op == 'remove' then
+            remove_line(sku_id)
+        elseif op == 'select' then
+            if sku_id == '0' then
+                select_all_lines(selected)
+            else
+                select_line(sku_id, selected)
+            end
+        end
+    end
+"""
+
+SCRIPTS = {
+    LAYOUT_SPLIT: dict(
+        _MUTATION_SCRIPTS,
+        batch=_BATCH + _SPLIT_SNAPSHOT,
+        # return: sku_id, count, selected, sku_id, count, selected, ...
+        snapshot=_SPLIT_SNAPSHOT,
+        summary=_SUMMARY,
+        export=_EXPORT % _SPLIT_SNAPSHOT,
+        evict=_EVICT,
+        # 从归档恢复购物车, ARGV: sku_id, count, selected, snapshot, ...
+        restore="""
+            if redis.call('GETBIT', archived_key, user_id) == 0 then
+                return 0
+            end
+            for i = 1, #ARGV, 4 do
+                redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+                if ARGV[i + 2] == '1' then
+                    redis.call('SADD', KEYS[2], ARGV[i])
+                end
+                if ARGV[i + 3] ~= '' then
+                    redis.call('HSET', snapshot_key, ARGV[i], ARGV[i + 3])
+                end
+            end
+            redis.call('SETBIT', archived_key, user_id, 0)
+            refresh_meta()
+            touch()
+            return 1
+        """,
+    ),
+    LAYOUT_PACKED: dict(
+        _MUTATION_SCRIPTS,
+        batch=_BATCH + _PACKED_SNAPSHOT,
+        snapshot=_PACKED_SNAPSHOT,
+        summary=_SUMMARY,
+        export=_EXPORT % _PACKED_SNAPSHOT,
+        evict=_EVICT,
+        restore="""
+            if redis.call('GETBIT', archived_key, user_id) == 0 then
+                return 0
+            end
+            for i = 1, #ARGV, 4 do
+                if ARGV[i + 2] == '1' then
+                    redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+                else
+                    redis.call('HSET', KEYS[1], ARGV[i], -ARGV[i + 1])
+                end
+                if ARGV[i + 3] ~= '' then
+                    redis.call('HSET', snapshot_key, ARGV[i], ARGV[i + 3])
+                end
+            end
+            redis.call('SETBIT', archived_key, user_id, 0)
+            refresh_meta()
+            touch()
+            return 1
+        """,
+    ),
+}
+
+# 已注册的脚本对象 {(layout, name): Script}
+_registered_scripts = {}
+
+
+def dumps_line_snapshot(snapshot):
+    """
+    :param snapshot: 商品快照 {'price': 价格, 'version': 版本号, ...}, SKU摘要可以直接传入
+    :return: 'price:version', snapshot为None时返回空字符串
+    """
+    if not snapshot:
+        return ''
+    return '%s:%s' % (snapshot['price'], snapshot['version'])
+
+
+def loads_line_snapshot(value):
+    """
+    :param value: dumps_line_snapshot的返回值
+    :return: {'price': Decimal, 'version': int}, 没有快照时返回None
+    """
+    if isinstance(value, bytes):
+        value = value.decode()
+    if not value:
+        return None
+    price, version = value.split(':')
+    return {'price': Decimal(price), 'version': int(version)}
+
+
+class CartStore(object):
+    """登录用户的redis购物车"""
+
+    def __init__(self, user_id, layout=None):
+        self.user_id = user_id
+        self.layout = layout or getattr(settings, 'CART_REDIS_LAYOUT', LAYOUT_SPLIT)
+        if self.layout not in SCRIPTS:
+            raise ValueError('未知的购物车存储结构: %s' % self.layout)
+        self.redis_conn = get_redis_connection('cart')
+
+    @property
+    def keys(self):
+        """当前存储结构使用的redis键, 最后四个为商品快照, 统计信息, 访问时间, 归档标记"""
+        if self.layout == LAYOUT_PACKED:
+            keys = ['cart_items_%s' % self.user_id]
+        else:
+            keys = ['cart_%s' % self.user_id, 'cart_selected_%s' % self.user_id]
+        keys.extend(('cart_snapshot_%s' % self.user_id, 'cart_meta_%s' % self.user_id, ACCESS_KEY, ARCHIVED_KEY))
+        return keys
+
+    def _script_source(self, name):
+        """
+        拼接脚本
+        用户访问购物车的脚本先检查是否已归档, 并从ARGV中取出商品快照: n, sku_id, snapshot, ...
+        修改购物车的脚本执行前写入商品快照(合并时不覆盖已有的快照), 执行后清理本次写入但未加入购物车的商品快照并更新统计信息,
+        执行完成后刷新过期时间与访问时间
+        """
+        body = SCRIPTS[self.layout][name]
+        if name not in ACCESSES:
+            return _PROLOGUES[self.layout] + body
+        return _PROLOGUES[self.layout] + """
+            if redis.call('GETBIT', archived_key, user_id) == 1 then
+                return redis.error_reply('CART_ARCHIVED')
+            end
+            local line_snapshots = {}
+            local skip = tonumber(ARGV[1]) * 2 + 1
+            for i = 2, skip do
+                line_snapshots[#line_snapshots + 1] = ARGV[i]
+            end
+            for i = 1, #ARGV do
+                ARGV[i] = ARGV[i + skip]
+            end
+        """ + ("""
+            for i = 1, #line_snapshots, 2 do
+                redis.call('%s', snapshot_key, line_snapshots[i], line_snapshots[i + 1])
+            end
+        """ % ('HSETNX' if name == 'merge' else 'HSET') if name in MUTATIONS else "") + """
+            local function run()
+        """ + body + """
+            end
+            local result = run()
+        """ + ("""
+            for i = 1, #line_snapshots, 2 do
+                if redis.call('HEXISTS', KEYS[1], line_snapshots[i]) == 0 then
+                    redis.call('HDEL', snapshot_key, line_snapshots[i])
+                end
+            end
+            update_meta()
+        """ if name in MUTATIONS else "") + """
+            touch()
+            return result
+        """
+
+    def _call(self, name, *args, client=None, snapshots=None):
+        """
+        执行脚本, 优先EVALSHA, 脚本不存在时自动加载
+        购物车已归档时先从归档表恢复再重新执行
+        :param client: 可选, 在管道中执行时传入管道对象
+        :param snapshots: 可选, 修改购物车时写入的商品快照 {sku_id: {'price': xxx, 'version': xxx}}
+        """
+        script = _registered_scripts.get((self.layout, name))
+        if script is None:
+            script = self.redis_conn.register_script(self._script_source(name))
+            _registered_scripts[(self.layout, name)] = script
+
+        if name in ACCESSES:
+            snapshots = snapshots or {}
+            line_snapshots = [len(snapshots)]
+            for sku_id, snapshot in snapshots.items():
+                line_snapshots.extend((sku_id, dumps_line_snapshot(snapshot)))
+            args = tuple(line_snapshots) + args
+        args = (int(time.time()), constants.CART_REDIS_EXPIRES, self.user_id) + args
+        try:
+            return script(keys=self.keys, args=args, client=client or self.redis_conn)
+        except ResponseError as e:
+            if 'CART_ARCHIVED' not in str(e):
+                raise
+        self.restore()
+        return script(keys=self.keys, args=args, client=client or self.redis_conn)
+
+    def add(self, sku_id, count, selected=True, snapshot=None):
+        """
+        添加商品, 覆盖数量; 已勾选的商品不会因selected=False而取消勾选
+        :param snapshot: 可选, 商品快照 {'price': xxx, 'version': xxx}, 可以直接传入SKU摘要
+        """
+        snapshots = {sku_id: snapshot} if snapshot else None
+        return self._call('add', sku_id, count, int(bool(selected)), snapshots=snapshots)
+
+    def update(self, sku_id, count, selected):
+        """修改商品数量与勾选状态"""
+        return self._call('update', sku_id, count, int(bool(selected)))
+
+    def delete(self, *sku_ids):
+        """删除商品, 返回删除的条目数"""
+        if not sku_ids:
+            return 0
+        return self._call('delete', *sku_ids)
+
+    def select_all(self, selected):
+        """全选/取消全选, 返回购物车条目数"""
+        return self._call('select_all', int(bool(selected)))
+
+    def merge(self, cart_dict, policy=None, max_lines=None, snapshots=None):
+        """
+        将cookie购物车合并到redis购物车, 一次原子执行
+        :param cart_dict: {sku_id: {'count': xxx, 'selected': True}, ...}
+        :param policy: 两边都有的商品如何合并, 默认constants.CART_MERGE_POLICY
+                       sum: 数量相加, max: 取较大的数量, cookie: 以cookie为准, redis: 以redis为准
+                       sum/max时两边任一勾选即为勾选
+        :param max_lines: 合并后购物车最多的条目数, 超出的新商品被丢弃, 默认constants.CART_REDIS_MAX_LINES
+        :param snapshots: 可选, 合并的商品快照 {sku_id: {'price': xxx, 'version': xxx}}
+        :return: {'added': 新增条目数, 'updated': 合并条目数, 'dropped': 丢弃条目数, 'lines': 合并后条目数}
+        """
+        policy = policy or constants.CART_MERGE_POLICY
+        if policy not in MERGE_POLICIES:
+            raise ValueError('未知的购物车合并策略: %s' % policy)
+        max_lines = max_lines or constants.CART_REDIS_MAX_LINES
+
+        args = [policy, max_lines]
+        for sku_id, value in cart_dict.items():
+            args.extend((sku_id, value['count'], int(bool(value['selected']))))
+        added, updated, dropped, lines = self._call('merge', *args, snapshots=snapshots)
+        return {
+            'added': added,
+            'updated': updated,
+            'dropped': dropped,
+            'lines': lines,
+        }
+
+    def batch(self, operations, snapshots=None):
+        """
+        一次原子执行多个购物车操作, 并返回执行后的购物车
+        :param operations: [{'action': 'add/update/remove/select', 'sku_id': xxx, 'count': xxx, 'selected': True}, ...]
+                           select不带sku_id时表示全选/取消全选
+        :param snapshots: 可选, 添加的商品快照 {sku_id: {'price': xxx, 'version': xxx}}
+        :return: OrderedDict {sku_id: {'count': xxx, 'selected': True, 'snapshot': 商品快照或None}, ...}
+        """
+        args = []
+        for operation in operations:
+            args.extend((
+                operation['action'],
+                operation.get('sku_id') or 0,
+                operation.get('count') or 0,
+                int(bool(operation.get('selected', True)))
+            ))
+        return self._parse_snapshot(self._call('batch', *args, snapshots=snapshots))
+
+    def snapshot(self):
+        """
+        原子地读取整个购物车
+        :return: OrderedDict {sku_id: {'count': xxx, 'selected': True, 'snapshot': 商品快照或None}, ...}
+        """
+        return self._parse_snapshot(self._call('snapshot'))
+
+    def summary(self):
+        """
+        读取购物车统计信息, O(1)
+        :return: {'lines': 条目数, 'quantity': 总数量, 'selected_quantity': 勾选数量, 'version': 版本号}
+        """
+        lines, quantity, selected_quantity, version = self._call('summary')
+        return {
+            'lines': int(lines or 0),
+            'quantity': int(quantity or 0),
+            'selected_quantity': int(selected_quantity or 0),
+            'version': int(version or 0),
+        }
+
+    def export(self, client):
+        """在管道中读取版本号与整个购物车, 不刷新访问时间, 结果由parse_export解析"""
+        return self._call('export', client=client)
+
+    @classmethod
+    def parse_export(cls, result):
+        """
+        解析export的结果
+        :return: (版本号, OrderedDict {sku_id: {'count': xxx, 'selected': True}, ...})
+        """
+        version = result[0]
+        if isinstance(version, bytes):
+            version = version.decode()
+        return version, cls._parse_snapshot(result[1:])
+
+    def evict(self, version, archived, client):
+        """在管道中删除购物车, 购物车在export之后被修改过(版本号变化)时不删除, 结果为1表示已删除"""
+        return self._call('evict', version, int(bool(archived)), client=client)
+
+    def restore(self):
+        """从归档表恢复购物车, 恢复后删除归档记录"""
+        archive = CartArchive.objects.filter(user_id=self.user_id).first()
+        args = []
+        if archive is not None:
+            for sku_id, value in archive.load().items():
+                args.extend((sku_id, value['count'], int(bool(value['selected'])),
+                             dumps_line_snapshot(value.get('snapshot'))))
+        self._call('restore', *args)
+        if archive is not None:
+            archive.delete()
+
+    @staticmethod
+    def _parse_snapshot(result):
+        cart_dict = OrderedDict()
+        for i in range(0, len(result), 4):
+            cart_dict[int(result[i])] = {
+                'count': int(result[i + 1]),
+                'selected': bool(int(result[i + 2])),
+                'snapshot': loads_line_snapshot(result[i + 3])
+            }
+        return cart_dict
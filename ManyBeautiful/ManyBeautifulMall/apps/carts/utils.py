@@ -1,13 +1,17 @@
-from django_redis import get_redis_connection
+import logging
 
-from utils import myjson
+from carts import codec, constants
+from carts.store import CartStore
+from goods.sku_cache import sku_cache
+
+logger = logging.getLogger('django')
 
 
 def merge_cart_cookie_to_redis(request, user_id, response):
     """
     合并购物车数据到redis中
     :param request: 用于读取cookie信息
-    :param user: 当前登陆用户
+    :param user_id: 当前登陆用户id
     :param response: 响应对象,清除cookie数据
     :return:
     """
@@ -18,50 +22,26 @@ def merge_cart_cookie_to_redis(request, user_id, response):
         return response
 
     # 拿到字典类型的cookie中购物车数据
-    cookie_cart_dict = myjson.loads(cart_str)
-
-    # 定义字典,用于向redis中保存数据
-    redis_cart_dict = {}
-
-    # 记录redis勾选状态的sku_id
-    redis_cart_selected_add = []  # 添加sku_id列表
-    redis_cart_selected_remove = []  # 删除sku_id列表
-
-    # 获取redis连接
-    redis_conn = get_redis_connection("cart")
-    redis_pip = redis_conn.pipeline()
-
-    # 合并cookie购物车与redis购物车，保存到redis_cart_dict字典中
-    for sku_id, count_select_dict in cookie_cart_dict.items():
-        """
-        cookie中数据保存格式
-        {
-            sku_id: {
-                "count": xxx,  // 数量
-                "selected": True  // 是否勾选
-            },
-            ...
-        }
-        """
-        # 处理商品数量
-        redis_cart_dict[sku_id] = count_select_dict['count']
-
-        # 处理勾选状态,若勾选,则向添加列表中添加sku_id,反之则向删除列表中添加sku_id
-        if count_select_dict['selected']:
-            redis_cart_selected_add.append(sku_id)
-        else:
-            redis_cart_selected_remove.append(sku_id)
-
-    # 如果添加完以后redis_cart_dict中有数据,则向redis中存储
-    if redis_cart_dict:
-        redis_pip.hmset('cart_%s' % user_id, redis_cart_dict)
-
-        if redis_cart_selected_add:
-            redis_pip.sadd('cart_selected_%s' % user_id, *redis_cart_selected_add)
-        if redis_cart_selected_remove:
-            redis_pip.srem('cart_selected_%s' % user_id, *redis_cart_selected_remove)
+    """
+    cookie中数据保存格式
+    {
+        sku_id: {
+            "count": xxx,  // 数量
+            "selected": True  // 是否勾选
+        },
+        ...
+    }
+    """
+    cookie_cart_dict = codec.loads(cart_str)
+    if not cookie_cart_dict:
+        response.set_cookie('cart', 0, max_age=0)
+        return response
 
-    redis_pip.execute()
+    # 按配置的合并策略与条目上限, 一次原子写入redis, 同时记录商品快照
+    snapshots = sku_cache.get_many(cookie_cart_dict.keys())
+    stats = CartStore(user_id).merge(cookie_cart_dict, snapshots=snapshots)
+    logger.info('合并购物车 user_id=%s added=%s updated=%s dropped=%s lines=%s' % (
+        user_id, stats['added'], stats['updated'], stats['dropped'], stats['lines']))
 
     # 删除cookie中存储的信息
     # response.delete_cookie('cart')
@@ -70,9 +50,36 @@ def merge_cart_cookie_to_redis(request, user_id, response):
     return response
 
 
-
-
-
-
-
-
+def apply_cart_operations(cart_dict, operations):
+    """
+    在cookie购物车上执行批量操作, 语义与CartStore.batch一致
+    :param cart_dict: {sku_id: {'count': xxx, 'selected': True}, ...}, 原地修改
+    :param operations: [{'action': 'add/update/remove/select', 'sku_id': xxx, 'count': xxx, 'selected': True}, ...]
+    :return: 超出cookie条目上限而未添加的sku_id列表
+    """
+    rejected = []
+    for operation in operations:
+        action = operation['action']
+        sku_id = operation.get('sku_id')
+        selected = operation.get('selected', True)
+
+        if action in ('add', 'update'):
+            if sku_id not in cart_dict and len(cart_dict) >= constants.CART_COOKIE_MAX_ITEMS:
+                rejected.append(sku_id)
+                continue
+            # 添加时已勾选的商品保持勾选
+            if action == 'add' and sku_id in cart_dict:
+                selected = selected or cart_dict[sku_id]['selected']
+            cart_dict[sku_id] = {
+                'count': operation['count'],
+                'selected': selected
+            }
+        elif action == 'remove':
+            cart_dict.pop(sku_id, None)
+        elif action == 'select':
+            sku_ids = list(cart_dict.keys()) if sku_id is None else [sku_id]
+            for sku_id in sku_ids:
+                if sku_id in cart_dict:
+                    cart_dict[sku_id]['selected'] = selected
+
+    return rejected
@@ -1,12 +1,15 @@
-from django_redis import get_redis_connection
+import hashlib
+
 from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from carts import constants
+from carts import constants, codec
+from carts.reader import CartReader
+from carts.store import CartStore
 from carts.serializers import AddCartSerializer, FindCartSerializer, UpDateCartSerializer, DeleteCartSerializer, \
-    SelectAllCartSerializer
-from goods.models import SKU
-from utils import myjson
+    SelectAllCartSerializer, BatchCartSerializer
+from carts.utils import apply_cart_operations
+from goods.sku_cache import sku_cache
 
 
 # 购物车视图集
@@ -33,39 +36,8 @@ class CartView(APIView):
         except Exception:
             user = None
 
-        if user is not None and user.is_authenticated:
-            # 用户登录,数据从redis中取出
-            redis_conn = get_redis_connection('cart')
-            # 获取redis中存储的信息
-            redis_cart_id = redis_conn.hkeys('cart_%s' % user.id)
-            redis_cart_selected = redis_conn.smembers('cart_selected_%s' % user.id)
-            print(redis_cart_selected)
-            redis_cart_selected = [int(sku_id) for sku_id in redis_cart_selected]
-            print(redis_cart_selected)
-
-            # 查询商品
-            skus = SKU.objects.filter(pk__in=redis_cart_id)
-            # 为商品添加额外两个属性
-            for sku in skus:
-                sku.count = redis_conn.hget('cart_%s' % user.id, sku.id)
-                sku.selected = sku.id in redis_cart_selected  # 在,则为True,不在则为False
-
-        else:
-            # 用户未登录，从cookie中读取
-            cart_str = request.COOKIES.get('cart')
-            if cart_str is not None:
-                cart_dict = myjson.loads(cart_str)
-            else:
-                cart_dict = {}
-
-            # 遍历处理购物车数据
-            # 根据键,查询商品信息
-            skus = []
-            for key, value in cart_dict.items():
-                sku = SKU.objects.get(pk=key)
-                sku.count = value['count']
-                sku.selected = value['selected']
-                skus.append(sku)
+        # 登录用户从redis中一次管道读取, 未登录用户从cookie中读取, 商品一次查询
+        skus = CartReader().read(request, user)
 
         # 序列化数据并返回
         find_serializer = FindCartSerializer(skus, many=True)
@@ -101,15 +73,9 @@ class CartView(APIView):
 
         # 若用户不为空且已登录
         if user is not None and user.is_authenticated:
-            # 用户登录,将数据保存到redis中
-
-            redis_conn = get_redis_connection('cart')
-            # 使用hash记录购物车商品数量
-            redis_conn.hset('cart_%s' % user.id, sku_id, count)
-            # 使用set记录是否勾选
-            if selected:
-                # 默认勾选
-                redis_conn.sadd('cart_selected_%s' % user.id, sku_id)
+            # 用户登录,将数据保存到redis中, 数量, 勾选状态与商品快照一次原子写入
+            # 验证时已读取SKU摘要, 这里命中进程内缓存
+            CartStore(user.id).add(sku_id, count, selected, snapshot=sku_cache.get(sku_id))
 
         # 用户未登录,将数据保存到cookie中
         else:
@@ -127,11 +93,15 @@ class CartView(APIView):
             cart_str = request.COOKIES.get('cart')
             if cart_str is not None:
                 # 不为空,将其解码并反序列化为python类型
-                cart_dict = myjson.loads(cart_str)
+                cart_dict = codec.loads(cart_str)
             else:
                 # 为空,返回空字典
                 cart_dict = {}
 
+            # cookie中保存的商品条目数有上限
+            if sku_id not in cart_dict and len(cart_dict) >= constants.CART_COOKIE_MAX_ITEMS:
+                return Response({'message': '购物车商品数量已达上限'}, status=status.HTTP_400_BAD_REQUEST)
+
             # 将数据以正确的格式添加
             cart_dict[sku_id] = {
                 'count': count,
@@ -139,7 +109,7 @@ class CartView(APIView):
             }
 
             # 将cookie数据序列化为bytes类型并编码
-            cookie_cart = myjson.dumps(cart_dict)
+            cookie_cart = codec.dumps(cart_dict)
 
             # 设置购物车的cookie
             # 需要设置有效期，否则是临时cookie
@@ -173,17 +143,8 @@ class CartView(APIView):
 
         # 用户已登录，数据在redis中
         if user is not None and user.is_authenticated:
-
-            redis_conn = get_redis_connection('cart')
-            # 修改商品数量信息
-            redis_conn.hset('cart_%s' % user.id, sku_id, count)
-            # 修改商品是否勾选
-            if selected is True:
-                # 未勾选, 修改为勾选
-                redis_conn.sadd('cart_selected_%s' % user.id, sku_id)
-            else:
-                # 已勾选, 修改为未勾选
-                redis_conn.srem('cart_selected_%s' % user.id, sku_id)
+            # 修改商品数量与是否勾选
+            CartStore(user.id).update(sku_id, count, selected)
 
         # 用户未登录,数据在cookie中
         else:
@@ -192,7 +153,7 @@ class CartView(APIView):
             cart_str = request.COOKIES.get('cart')
             if cart_str is not None:
                 # 不为空,将其解码并反序列化为python类型
-                cart_dict = myjson.loads(cart_str)
+                cart_dict = codec.loads(cart_str)
             else:
                 # 为空,返回空字典
                 cart_dict = {}
@@ -203,7 +164,7 @@ class CartView(APIView):
             }
 
             # 将cookie数据序列化为bytes类型并编码
-            cookie_cart = myjson.dumps(cart_dict)
+            cookie_cart = codec.dumps(cart_dict)
 
             # 设置购物车的cookie
             # 需要设置有效期，否则是临时cookie
@@ -233,14 +194,10 @@ class CartView(APIView):
 
         # 用户已登录，从redis中删除
         if user is not None and user.is_authenticated:
+            # 删除商品数量与勾选信息
+            CartStore(user.id).delete(sku_id)
 
-            redis_conn = get_redis_connection('cart')
-            # 删除商品数量信息
-            redis_conn.hdel('cart_%s' % user.id, sku_id)
-            # 删除商品勾选信息
-            redis_conn.srem('cart_selected_%s' % user.id, sku_id)
-
-            response =  Response(status=status.HTTP_204_NO_CONTENT)
+            response = Response(status=status.HTTP_204_NO_CONTENT)
             return response
 
         # 用户未登录，从cookie中删除
@@ -250,13 +207,13 @@ class CartView(APIView):
             cart_str = request.COOKIES.get('cart')
             if cart_str is not None:
                 # 不为空,将其解码并反序列化为python类型
-                cart_dict = myjson.loads(cart_str)
+                cart_dict = codec.loads(cart_str)
 
                 # 判断购物车数据列表中是否有该商品id,有则删除该键
                 if sku_id in cart_dict:
                     del cart_dict[sku_id]
                     # 将cookie数据序列化为bytes类型并编码
-                    cookie_cart = myjson.dumps(cart_dict)
+                    cookie_cart = codec.dumps(cart_dict)
 
                     # 设置响应数据
                     response = Response(status=status.HTTP_204_NO_CONTENT)
@@ -304,19 +261,8 @@ class CartSelectAllView(APIView):
 
         if user is not None and user.is_authenticated:
             # 用户已登陆, 数据在redis中
-
-            redis_conn = get_redis_connection('cart')
-
-            # 获取所有商品sku_id
-            sku_ids = redis_conn.hkeys('cart_%d' % request.user.id)
-
-            # 判断是否全选
-            if selected:
-                # 全选
-                redis_conn.sadd('cart_selected_%s' % user.id, *sku_ids)
-            else:
-                # 取消全选
-                redis_conn.srem('cart_selected_%s' % user.id, *sku_ids)
+            # 全选/取消全选在redis中完成, 不需要取回所有sku_id
+            CartStore(user.id).select_all(selected)
             response = Response({'message': 'ok'})
             return response
 
@@ -327,14 +273,14 @@ class CartSelectAllView(APIView):
             cart_str = request.COOKIES.get('cart')
             if cart_str is not None:
                 # 不为空,将其解码并反序列化为python类型
-                cart_dict = myjson.loads(cart_str)
+                cart_dict = codec.loads(cart_str)
 
                 # 获取商品id sku_id,修改勾选属性值为请求中的值
                 for sku_id in cart_dict:
                     cart_dict[sku_id]['selected'] = selected
 
                 # 将cookie数据序列化为bytes类型并编码
-                cookie_cart = myjson.dumps(cart_dict)
+                cookie_cart = codec.dumps(cart_dict)
 
                 # 设置响应数据
                 response = Response({'message': 'OK'})
@@ -347,4 +293,102 @@ class CartSelectAllView(APIView):
             else:
                 # 购物车数据为空,则无数据可删除,直接返回
                 response = Response({'message': 'OK'})
-                return response
\ No newline at end of file
+                return response
+
+
+# 购物车批量操作视图
+class CartBatchView(APIView):
+    """购物车批量操作视图"""
+
+    def perform_authentication(self, request):
+        # 与CartView相同, 不在进入视图前检查JWT
+        pass
+
+    def patch(self, request):
+        """
+        购物车批量操作
+        请求方式: PATCH /cart/batch/
+        :param request: request.data中有operations操作列表
+                        [{"action": "add/update/remove/select", "sku_id": xxx, "count": xxx, "selected": true}, ...]
+                        select不带sku_id时表示全选/取消全选
+        :return: 操作后的购物车, 格式与GET /cart/一致
+        """
+        # 获取当前用户信息(并验证登陆)
+        try:
+            user = request.user
+        except Exception:
+            # 验证失败,用户数据为空
+            user = None
+
+        batch_serializer = BatchCartSerializer(data=request.data)
+        batch_serializer.is_valid(raise_exception=True)
+        operations = batch_serializer.validated_data['operations']
+
+        reader = CartReader()
+        if user is not None and user.is_authenticated:
+            # 用户已登录, 所有操作在redis中一次原子执行, 并返回操作后的购物车
+            # 添加的商品记录快照, SKU摘要在验证时已读取
+            snapshots = sku_cache.get_many(
+                operation['sku_id'] for operation in operations if operation['action'] == 'add')
+            cart_dict = CartStore(user.id).batch(operations, snapshots=snapshots)
+            response = Response()
+        else:
+            # 用户未登录, cookie只解码与编码一次
+            cart_dict = reader.read_cookie_cart(request.COOKIES.get('cart'))
+            if apply_cart_operations(cart_dict, operations):
+                return Response({'message': '购物车商品数量已达上限'}, status=status.HTTP_400_BAD_REQUEST)
+            response = Response()
+            response.set_cookie('cart', codec.dumps(cart_dict), max_age=constants.CART_COOKIE_EXPIRES)
+
+        response.data = FindCartSerializer(reader.load_skus(cart_dict), many=True).data
+        return response
+
+
+# 购物车角标统计视图
+class CartSummaryView(APIView):
+    """购物车角标统计视图"""
+
+    def perform_authentication(self, request):
+        # 与CartView相同, 不在进入视图前检查JWT
+        pass
+
+    def get(self, request):
+        """
+        购物车角标统计, 支持If-None-Match条件请求
+        请求方式: GET /cart/summary/
+        :return: {"lines": 条目数, "quantity": 总数量, "selected_quantity": 勾选数量}
+        """
+        # 获取当前用户信息(并验证登陆)
+        try:
+            user = request.user
+        except Exception:
+            # 验证失败,用户数据为空
+            user = None
+
+        if user is not None and user.is_authenticated:
+            # 用户已登录, 统计信息由修改购物车时维护在redis中
+            summary = CartStore(user.id).summary()
+            version = '%s-%s' % (user.id, summary.pop('version'))
+        else:
+            # 用户未登录, 直接统计cookie中的数据, 不查询数据库
+            cart_str = request.COOKIES.get('cart') or ''
+            cart_dict = codec.loads(cart_str)
+            summary = {
+                'lines': len(cart_dict),
+                'quantity': sum(value['count'] for value in cart_dict.values()),
+                'selected_quantity': sum(value['count'] for value in cart_dict.values() if value['selected']),
+            }
+            version = cart_str
+
+        etag = '"%s"' % hashlib.md5(('%s-%s-%s-%s' % (
+            version, summary['lines'], summary['quantity'], summary['selected_quantity'])).encode()).hexdigest()
+
+        # 数据未变化, 返回304
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH', '')
+        if etag in [tag.strip().replace('W/', '', 1) for tag in if_none_match.split(',')]:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(summary)
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
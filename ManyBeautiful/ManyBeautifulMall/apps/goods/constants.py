@@ -0,0 +1,35 @@
+# SKU摘要在redis中的缓存时间
+SKU_CACHE_EXPIRES = 60 * 60
+
+# 不存在的sku_id在redis中的缓存时间
+SKU_CACHE_MISSING_EXPIRES = 5 * 60
+
+# SKU摘要在进程内的缓存时间, 其他进程修改商品后最多延迟这么久生效
+SKU_CACHE_LOCAL_EXPIRES = 10
+
+# 进程内最多缓存的SKU摘要条数
+SKU_CACHE_LOCAL_MAX_SIZE = 10000
+
+# 商品计数器(SPU销量)每批写入mysql的条目数
+GOODS_COUNTER_FLUSH_BATCH = 500
+
+# 类别SKU列表接口的响应缓存时间(秒)
+SKU_LIST_CACHE_EXPIRES = 10 * 60
+
+# 列表缓存的重建锁有效期(秒)
+SKU_LIST_CACHE_LOCK_EXPIRES = 5
+
+# 其他进程重建缓存时等待的最长时间与轮询间隔(秒), 超时后自行查询
+SKU_LIST_CACHE_WAIT = 1
+SKU_LIST_CACHE_POLL_INTERVAL = 0.02
+
+# 类别规格选项筛选索引在redis中的缓存时间(秒), 索引按版本号失效
+SKU_FACETS_EXPIRES = 24 * 60 * 60
+
+# 类别规格筛选索引的重建锁有效期(秒), 其他进程重建索引时等待的最长时间与轮询间隔(秒)
+SKU_FACETS_LOCK_EXPIRES = 10
+SKU_FACETS_WAIT = 2
+SKU_FACETS_POLL_INTERVAL = 0.02
+
+# 规格筛选结果不超过这么多个SKU时按id列表查询, 超过时按规格选项连接查询, 不生成很长的IN列表
+SKU_FACETS_MAX_ID_FILTER = 500
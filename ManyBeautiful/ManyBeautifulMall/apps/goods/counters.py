@@ -0,0 +1,141 @@
+"""
+商品计数器(SPU销量)的延迟写入
+
+下单等热点操作不直接更新tb_goods/tb_sku中的计数, 而是把增量累加到redis的hash中,
+由任务(celery_tasks.counters.tasks.flush_counters)定期按批用一条CASE语句写入mysql,
+畅销SPU的行不再成为下单事务中所有订单排队更新的热点行
+
+SPU销量不在页面上展示, 列表与搜索不合并未写入的增量; 需要近实时的值时数据库中的值加上get_pending的结果
+SKU的销量在扣减库存的同一条语句中更新, 不经过计数器
+
+redis中的数据(default库):
+    counter_<表>_<字段> hash {id: 增量}: 未写入的增量
+    counter_<表>_<字段>_flushing hash {id: 增量}: 正在写入的增量, 写入mysql提交后删除
+写入mysql提交后, 删除flushing前进程退出时下次会重复写入
+"""
+import logging
+
+from django.db import transaction
+from django.db.models import Case, When, Value, F, IntegerField
+from django_redis import get_redis_connection
+
+from goods import constants
+from goods.models import Goods
+
+logger = logging.getLogger('django')
+
+# 支持的计数器 {表: (模型类, 字段...)}
+COUNTERS = {
+    'goods': (Goods, ('sales',)),
+}
+
+# 取出未写入的增量, 上次写入未完成时返回上次的数据
+# KEYS: pending, flushing
+_TAKE_PENDING = """
+    if redis.call('EXISTS', KEYS[2]) == 0 then
+        if redis.call('EXISTS', KEYS[1]) == 0 then
+            return {}
+        end
+        redis.call('RENAME', KEYS[1], KEYS[2])
+    end
+    return redis.call('HGETALL', KEYS[2])
+"""
+
+_scripts = {}
+
+
+def counter_key(table, field):
+    if table not in COUNTERS or field not in COUNTERS[table][1]:
+        raise ValueError('不支持的计数器 %s.%s' % (table, field))
+    return 'counter_%s_%s' % (table, field)
+
+
+def incr(table, field, deltas, client=None):
+    """
+    累加计数增量
+    :param table: goods
+    :param field: sales
+    :param deltas: {id: 增量}
+    :param client: redis连接或管道, 默认使用default库的连接
+    """
+    key = counter_key(table, field)
+    pl = client or get_redis_connection('default').pipeline(transaction=False)
+    for object_id, delta in deltas.items():
+        if delta:
+            pl.hincrby(key, object_id, delta)
+    if client is None:
+        pl.execute()
+
+
+def incr_on_commit(table, field, deltas):
+    """当前事务提交后累加计数增量, 事务回滚时不累加"""
+    def _incr():
+        try:
+            incr(table, field, deltas)
+        except Exception as e:
+            logger.error('累加计数失败 %s.%s %s: %s' % (table, field, deltas, e))
+
+    transaction.on_commit(_incr)
+
+
+def get_pending(table, field, object_ids):
+    """
+    读取未写入mysql的增量
+    :return: {id: 增量}
+    """
+    object_ids = list(object_ids)
+    if not object_ids:
+        return {}
+    key = counter_key(table, field)
+    pl = get_redis_connection('default').pipeline(transaction=False)
+    pl.hmget(key, object_ids)
+    pl.hmget(key + '_flushing', object_ids)
+    pending, flushing = pl.execute()
+    return {
+        object_id: int(pending[i] or 0) + int(flushing[i] or 0)
+        for i, object_id in enumerate(object_ids)
+    }
+
+
+def _take(table, field):
+    """
+    :return: {id: 增量}
+    """
+    redis_conn = get_redis_connection('default')
+    script = _scripts.get('take')
+    if script is None:
+        script = _scripts['take'] = redis_conn.register_script(_TAKE_PENDING)
+    key = counter_key(table, field)
+    items = script(keys=[key, key + '_flushing'], client=redis_conn)
+    deltas = {}
+    for i in range(0, len(items), 2):
+        delta = int(items[i + 1])
+        if delta:
+            deltas[int(items[i])] = delta
+    return deltas
+
+
+def flush():
+    """
+    把所有计数器的增量写入mysql, 每个计数器每批一条CASE更新语句
+    :return: {'表.字段': 更新的条目数}
+    """
+    redis_conn = get_redis_connection('default')
+    batch_size = constants.GOODS_COUNTER_FLUSH_BATCH
+    result = {}
+
+    for table, (model, fields) in sorted(COUNTERS.items()):
+        for field in fields:
+            deltas = _take(table, field)
+            if deltas:
+                object_ids = sorted(deltas)
+                with transaction.atomic():
+                    for start in range(0, len(object_ids), batch_size):
+                        batch = object_ids[start:start + batch_size]
+                        cases = Case(*[When(id=object_id, then=Value(deltas[object_id])) for object_id in batch],
+                                     output_field=IntegerField())
+                        model.objects.filter(id__in=batch).update(**{field: F(field) + cases})
+                result['%s.%s' % (table, field)] = len(object_ids)
+            redis_conn.delete(counter_key(table, field) + '_flushing')
+
+    return result
@@ -0,0 +1,270 @@
+"""
+类别SKU的规格选项筛选(分面)
+
+每个类别一份索引: 有规格的SKU按id排序编号, 每个规格选项一个位图(python int, 第n位为1表示第n个SKU有该选项),
+位图只有类别中SKU数量的位数, 不同SPU的同名规格下同值的选项合并为一个选项
+筛选时同一规格的选项按位或, 不同规格之间按位与, 在内存中计算, 不查询规格表
+每个选项的数量为 其他规格的筛选结果 & 该选项的位图 中1的个数, 选择该选项后能得到的SKU数
+
+索引在redis中保存一份, 各进程在内存中缓存, 每次读取时比较类别的版本号:
+SKU, SKU规格, 规格, 选项修改的事务提交后增加所在类别的版本号(goods.signals), 下次读取时只重建该类别的索引,
+同一版本只有取得重建锁的进程查询数据库, 其他进程等待其结果, 等待超时后自行重建
+
+redis中的数据(sku库):
+    sku_facets_version_<category_id>: 类别的版本号
+    sku_facets_<category_id>_<版本号>: 序列化后的索引
+    sku_facets_<category_id>_<版本号>_lock: 重建锁
+"""
+import json
+import logging
+import threading
+import time
+
+from django.db import transaction
+from django_redis import get_redis_connection
+
+from goods import constants
+from goods.models import SKUSpecification
+
+logger = logging.getLogger('django')
+
+
+def version_key(category_id):
+    return 'sku_facets_version_%s' % category_id
+
+
+def index_key(category_id, version):
+    return 'sku_facets_%s_%s' % (category_id, version)
+
+
+def popcount(bitmap):
+    """位图中1的个数"""
+    return bin(bitmap).count('1')
+
+
+# python3.10以上使用int.bit_count
+if hasattr(int, 'bit_count'):
+    popcount = int.bit_count  # noqa: F811
+
+
+class FacetIndex(object):
+    """一个类别的规格选项位图索引"""
+
+    def __init__(self, sku_ids, specs):
+        """
+        :param sku_ids: 有规格的SKU id, 按id排序, 下标即位图中的位置
+        :param specs: [{'name': 规格名称, 'options': [{'ids': [选项id...], 'value': 选项值, 'bitmap': 位图}]}]
+        """
+        self.sku_ids = sku_ids
+        self.specs = specs
+        # {选项id: (规格下标, 选项下标)}, 合并的选项都指向同一个选项
+        self.option_map = {}
+        for spec_index, spec in enumerate(specs):
+            for option_index, option in enumerate(spec['options']):
+                for option_id in option['ids']:
+                    self.option_map[option_id] = (spec_index, option_index)
+
+    @classmethod
+    def build(cls, category_id):
+        """查询类别中所有SKU的规格选项建立索引, 一条查询"""
+        rows = list(SKUSpecification.objects.filter(sku__category_id=category_id).values_list(
+            'sku_id', 'spec_id', 'spec__name', 'option_id', 'option__value'))
+
+        sku_ids = sorted(set(row[0] for row in rows))
+        positions = {sku_id: position for position, sku_id in enumerate(sku_ids)}
+
+        # 规格按名称合并, 选项按值合并, 按最小的规格id/选项id排序
+        specs = {}  # {规格名称: {'spec_id': 最小规格id, 'options': {选项值: {'ids': set, 'bitmap': 位图}}}}
+        for sku_id, spec_id, spec_name, option_id, option_value in rows:
+            spec = specs.setdefault(spec_name, {'spec_id': spec_id, 'options': {}})
+            spec['spec_id'] = min(spec['spec_id'], spec_id)
+            option = spec['options'].setdefault(option_value, {'ids': set(), 'bitmap': 0})
+            option['ids'].add(option_id)
+            option['bitmap'] |= 1 << positions[sku_id]
+
+        return cls(sku_ids, [
+            {
+                'name': name,
+                'options': sorted([
+                    {'ids': sorted(option['ids']), 'value': value, 'bitmap': option['bitmap']}
+                    for value, option in spec['options'].items()
+                ], key=lambda option: option['ids'][0]),
+            }
+            for name, spec in sorted(specs.items(), key=lambda item: item[1]['spec_id'])
+        ])
+
+    def dumps(self):
+        specs = [
+            {'name': spec['name'], 'options': [
+                {'ids': option['ids'], 'value': option['value'], 'bitmap': '%x' % option['bitmap']}
+                for option in spec['options']
+            ]}
+            for spec in self.specs
+        ]
+        return json.dumps({'sku_ids': self.sku_ids, 'specs': specs}, separators=(',', ':'))
+
+    @classmethod
+    def loads(cls, value):
+        data = json.loads(value)
+        for spec in data['specs']:
+            for option in spec['options']:
+                option['bitmap'] = int(option['bitmap'], 16)
+        return cls(data['sku_ids'], data['specs'])
+
+    def positions_to_ids(self, bitmap):
+        """位图中为1的位置对应的sku_id, 转为二进制字符串后查找, 不对大整数做逐位运算"""
+        bits = bin(bitmap)[:1:-1]
+        sku_ids = []
+        position = bits.find('1')
+        while position != -1:
+            sku_ids.append(self.sku_ids[position])
+            position = bits.find('1', position + 1)
+        return sku_ids
+
+    def select(self, option_ids):
+        """
+        :param option_ids: 选择的选项id, 不属于该类别的忽略
+        :return: {规格下标: {选项下标}}
+        """
+        selected = {}
+        for option_id in option_ids:
+            if option_id in self.option_map:
+                spec_index, option_index = self.option_map[option_id]
+                selected.setdefault(spec_index, set()).add(option_index)
+        return selected
+
+    def option_groups(self, option_ids):
+        """
+        按规格分组的选项id, 包括合并的同名规格下同值的选项, 用于在数据库中按规格选项连接查询
+        :return: [[选项id, ...], ...], 每个规格一组, 没有选择任何选项时为空列表
+        """
+        groups = []
+        for spec_index, option_indexes in sorted(self.select(option_ids).items()):
+            options = self.specs[spec_index]['options']
+            groups.append(sorted(option_id for option_index in option_indexes
+                                 for option_id in options[option_index]['ids']))
+        return groups
+
+    def search(self, option_ids):
+        """
+        按选项筛选
+        :param option_ids: 选择的选项id, 不属于该类别的忽略
+        :return: (符合条件的sku_id列表, 没有选择任何选项时为None,
+                  [{'name': 规格名称, 'options': [{'id', 'value', 'count', 'selected'}]}])
+        """
+        selected = self.select(option_ids)
+
+        # 每个规格选择的选项按位或
+        masks = {}
+        for spec_index, option_indexes in selected.items():
+            mask = 0
+            for option_index in option_indexes:
+                mask |= self.specs[spec_index]['options'][option_index]['bitmap']
+            masks[spec_index] = mask
+
+        everything = (1 << len(self.sku_ids)) - 1
+        matched = everything
+        for mask in masks.values():
+            matched &= mask
+
+        facets = []
+        for spec_index, spec in enumerate(self.specs):
+            # 其他规格的筛选结果
+            others = everything
+            for other_index, mask in masks.items():
+                if other_index != spec_index:
+                    others &= mask
+            facets.append({
+                'name': spec['name'],
+                'options': [
+                    {
+                        'id': option['ids'][0],
+                        'value': option['value'],
+                        'count': popcount(others & option['bitmap']),
+                        'selected': option_index in selected.get(spec_index, ()),
+                    }
+                    for option_index, option in enumerate(spec['options'])
+                ],
+            })
+
+        return (self.positions_to_ids(matched) if masks else None), facets
+
+
+_local = {}  # {category_id: (版本号, FacetIndex)}
+_lock = threading.Lock()
+
+
+def get_index(category_id):
+    """读取类别的索引, 本进程缓存的版本号未变化时只有一次redis往返"""
+    redis_conn = get_redis_connection('sku')
+    version = (redis_conn.get(version_key(category_id)) or b'0').decode()
+
+    with _lock:
+        item = _local.get(category_id)
+    if item is not None and item[0] == version:
+        return item[1]
+
+    key = index_key(category_id, version)
+    value = redis_conn.get(key)
+    if value is not None:
+        index = FacetIndex.loads(value.decode())
+    else:
+        index = _rebuild(redis_conn, category_id, key)
+
+    with _lock:
+        _local[category_id] = (version, index)
+    return index
+
+
+def _rebuild(redis_conn, category_id, key):
+    """重建索引, 取得重建锁时查询数据库并写入redis, 否则等待其他进程的结果, 等待超时后自行重建"""
+    if not redis_conn.set(key + '_lock', 1, nx=True, ex=constants.SKU_FACETS_LOCK_EXPIRES):
+        deadline = time.monotonic() + constants.SKU_FACETS_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(constants.SKU_FACETS_POLL_INTERVAL)
+            value = redis_conn.get(key)
+            if value is not None:
+                return FacetIndex.loads(value.decode())
+        logger.warning('等待重建类别规格筛选索引超时 category_id=%s' % category_id)
+        return _build_and_store(redis_conn, category_id, key)
+
+    try:
+        return _build_and_store(redis_conn, category_id, key)
+    finally:
+        redis_conn.delete(key + '_lock')
+
+
+def _build_and_store(redis_conn, category_id, key):
+    index = FacetIndex.build(category_id)
+    redis_conn.setex(key, constants.SKU_FACETS_EXPIRES, index.dumps())
+    return index
+
+
+def search(category_id, option_ids):
+    """
+    :return: (符合条件的sku_id列表或None, 各规格选项的数量), 见FacetIndex.search
+    """
+    return get_index(category_id).search(option_ids)
+
+
+def bump(*category_ids):
+    """类别中SKU的规格变化后增加版本号, 下次读取时重建索引"""
+    category_ids = set(category_id for category_id in category_ids if category_id is not None)
+    if not category_ids:
+        return
+    pl = get_redis_connection('sku').pipeline(transaction=False)
+    for category_id in sorted(category_ids):
+        pl.incr(version_key(category_id))
+    pl.execute()
+
+
+def bump_on_commit(*category_ids):
+    """在当前事务提交后增加版本号, 避免其他进程在提交前按旧的规格重建索引"""
+    def _bump():
+        try:
+            bump(*category_ids)
+        except Exception as e:
+            logger.error('清除类别规格筛选索引失败 %s: %s' % (category_ids, e))
+
+    if category_ids:
+        transaction.on_commit(_bump)
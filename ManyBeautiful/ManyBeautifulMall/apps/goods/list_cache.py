@@ -0,0 +1,135 @@
+"""
+类别SKU列表接口的响应缓存
+
+缓存键包含类别的版本号: sku_list_<category_id>_<版本号>_<排序, 页码/游标, 每页数量, 域名的摘要>
+SKU/SPU保存, 删除(所在事务提交后)以及计数器写入数据库后增加类别的版本号(INCR), 旧版本的缓存不再被读取, 由有效期清除, 不需要扫描键
+先读取版本号, 再读取缓存并记录查询次数, 命中时两次redis往返, 不查询数据库;
+访问的键都作为命令的参数, 可以在redis集群或按键分片的代理上使用
+缓存未命中时只有取得重建锁的进程查询数据库, 其他进程等待缓存生成, 等待超时后自行查询并写入缓存
+
+redis中的数据(sku库):
+    sku_list_version_<category_id>: 类别的版本号
+    sku_list_<category_id>_<版本号>_<参数摘要>: 序列化后的响应数据
+    sku_list_<category_id>_<版本号>_<参数摘要>_lock: 重建锁
+    sku_list_cache_stats hash {lookup, miss, wait, wait_hit, wait_timeout}: 命中统计, 命中次数为lookup - miss
+"""
+import hashlib
+import json
+import logging
+import time
+
+from django.db import transaction
+from django_redis import get_redis_connection
+
+from goods import constants
+
+logger = logging.getLogger('django')
+
+STATS_KEY = 'sku_list_cache_stats'
+
+
+def version_key(category_id):
+    return 'sku_list_version_%s' % category_id
+
+
+def cache_key(category_id, version, digest):
+    return 'sku_list_%s_%s_%s' % (category_id, version, digest)
+
+
+def params_digest(host, *params):
+    """缓存的参数摘要(排序, 页码, 每页数量, 游标...), 响应中的上一页/下一页地址与域名有关"""
+    return hashlib.md5('|'.join(str(value) for value in (host,) + params).encode()).hexdigest()
+
+
+def _lookup(redis_conn, category_id, digest):
+    """
+    读取版本号与缓存, 记录查询次数
+    :return: (缓存键, 缓存或None)
+    """
+    version = redis_conn.get(version_key(category_id))
+    key = cache_key(category_id, version.decode() if version is not None else '0', digest)
+    pl = redis_conn.pipeline(transaction=False)
+    pl.get(key)
+    pl.hincrby(STATS_KEY, 'lookup', 1)
+    value, lookups = pl.execute()
+    return key, value
+
+
+def get_or_build(category_id, digest, build):
+    """
+    读取缓存的响应数据, 未命中时调用build生成
+    :param build: 生成响应数据的函数, 返回(可缓存的数据或None, 响应)
+    :return: (缓存的数据, None) 或 (None, build返回的响应)
+    """
+    redis_conn = get_redis_connection('sku')
+    key, value = _lookup(redis_conn, category_id, digest)
+    if value is not None:
+        return json.loads(value.decode()), None
+
+    pl = redis_conn.pipeline(transaction=False)
+    pl.hincrby(STATS_KEY, 'miss', 1)
+    pl.set(key + '_lock', 1, nx=True, ex=constants.SKU_LIST_CACHE_LOCK_EXPIRES)
+    misses, locked = pl.execute()
+    if not locked:
+        # 其他进程正在生成, 等待其结果
+        redis_conn.hincrby(STATS_KEY, 'wait', 1)
+        deadline = time.monotonic() + constants.SKU_LIST_CACHE_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(constants.SKU_LIST_CACHE_POLL_INTERVAL)
+            value = redis_conn.get(key)
+            if value is not None:
+                redis_conn.hincrby(STATS_KEY, 'wait_hit', 1)
+                return json.loads(value.decode()), None
+        # 生成缓存的进程过慢或已退出, 自行生成并写入缓存, 之后的请求不再等待
+        redis_conn.hincrby(STATS_KEY, 'wait_timeout', 1)
+        return None, _build_and_store(redis_conn, key, build)
+
+    try:
+        return None, _build_and_store(redis_conn, key, build)
+    finally:
+        redis_conn.delete(key + '_lock')
+
+
+def _build_and_store(redis_conn, key, build):
+    """调用build生成响应, 可缓存的数据写入缓存"""
+    data, response = build()
+    if data is not None:
+        redis_conn.setex(key, constants.SKU_LIST_CACHE_EXPIRES, json.dumps(data))
+    return response
+
+
+def bump(*category_ids):
+    """类别的商品变化后增加版本号, 旧的缓存不再被读取"""
+    category_ids = set(category_id for category_id in category_ids if category_id is not None)
+    if not category_ids:
+        return
+    pl = get_redis_connection('sku').pipeline(transaction=False)
+    for category_id in sorted(category_ids):
+        pl.incr(version_key(category_id))
+    pl.execute()
+
+
+def get_stats():
+    stats = get_redis_connection('sku').hgetall(STATS_KEY)
+    stats = {name.decode(): int(count) for name, count in stats.items()}
+    stats['hit'] = max(stats.pop('lookup', 0) - stats.get('miss', 0), 0)
+    return stats
+
+
+def reset_stats():
+    get_redis_connection('sku').delete(STATS_KEY)
+
+
+def bump_on_commit(*category_ids):
+    """
+    当前事务提交后增加版本号, 事务回滚时不增加
+    提交前增加时, 其他请求可能在提交前用旧数据重建并缓存到新版本号下
+    """
+    def _bump():
+        try:
+            bump(*category_ids)
+        except Exception as e:
+            logger.error('清除类别列表缓存失败 %s: %s' % (category_ids, e))
+
+    if category_ids:
+        transaction.on_commit(_bump)
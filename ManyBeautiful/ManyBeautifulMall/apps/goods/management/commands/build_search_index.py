@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from utils.embedded_search.backend import build_search_indexes
+
+
+class Command(BaseCommand):
+    help = '重新建立进程内搜索引擎(EmbeddedSearchEngine)的索引文件'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='不论文档变化多少都重新建立')
+
+    def handle(self, *args, **options):
+        result = build_search_indexes(force=options['force'])
+        if not result:
+            self.stdout.write('没有使用EmbeddedSearchEngine的连接')
+        for alias, built in result.items():
+            self.stdout.write('%-12s %s' % (alias, '已建立' if built else '未建立'))
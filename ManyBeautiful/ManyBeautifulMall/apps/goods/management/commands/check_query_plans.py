@@ -0,0 +1,122 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+
+from goods.models import SKU, GoodsSpecification, SpecificationOption, SKUSpecification
+from utils.pagination import SKUCursorPagination
+
+# SKU列表的排序, 与SKUCursorPagination.orderings一致
+LIST_ORDERINGS = ('-sales', 'sales', '-price', 'price', '-create_time', 'create_time')
+
+
+def sample_ids():
+    """
+    从数据库中取查询使用的参数, 没有数据时使用1
+    :return: {category_id, sku_id, goods_id, spec_id, option_id}
+    """
+    ids = {'category_id': 1, 'sku_id': 1, 'goods_id': 1, 'spec_id': 1, 'option_id': 1}
+    # SKU最多的类别
+    category = SKU.objects.values('category_id').annotate(count=Count('id')).order_by('-count').first()
+    if category:
+        ids['category_id'] = category['category_id']
+    sku_spec = SKUSpecification.objects.values('sku_id', 'sku__goods_id', 'spec_id', 'option_id').first()
+    if sku_spec:
+        ids.update(sku_id=sku_spec['sku_id'], goods_id=sku_spec['sku__goods_id'], spec_id=sku_spec['spec_id'],
+                   option_id=sku_spec['option_id'])
+    return ids
+
+
+def hot_queries(ids):
+    """
+    商品相关接口与任务的高频查询
+    :return: [(名称, 查询集), ...]
+    """
+    queries = []
+    for ordering in LIST_ORDERINGS:
+        # 与SKUCursorPagination生成相同的查询, 第一页与翻页后的 (排序字段, id) 条件
+        paginator = SKUCursorPagination()
+        paginator.ordering = (ordering, '-id' if ordering.startswith('-') else 'id')
+        queryset = SKU.objects.filter(category_id=ids['category_id']).order_by(*paginator.ordering)
+        last = queryset.values_list(ordering.lstrip('-'), 'id').first() or (0, 0)
+        queries.append(('sku_list %s' % ordering, queryset[:6]))
+        queries.append(('sku_list %s cursor' % ordering, queryset.filter(paginator.keyset_filter(list(last)))[:6]))
+
+    # 搜索引擎按主键分批建立索引(SKUIndex.index_queryset)
+    queries.append(('search_index', SKU.objects.filter(is_launched=True).order_by('id')[:1000]))
+
+    # 详情页
+    queries.append(('sku_specs', SKUSpecification.objects.filter(sku_id=ids['sku_id']).order_by('spec_id')))
+    queries.append(('goods_specs', GoodsSpecification.objects.filter(goods_id=ids['goods_id']).order_by('id')))
+    queries.append(('spec_options', SpecificationOption.objects.filter(spec_id=ids['spec_id'])))
+    queries.append(('option_skus', SKUSpecification.objects.filter(option_id=ids['option_id']).values_list(
+        'sku_id', flat=True)))
+    return queries
+
+
+def explain(queryset):
+    """
+    :return: 执行计划的行, [{列名: 值}, ...]
+    """
+    sql, params = queryset.query.get_compiler(using=queryset.db).as_sql()
+    prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+    with connection.cursor() as cursor:
+        cursor.execute(prefix + sql, params)
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def find_problems(plan):
+    """
+    检查执行计划中的全表扫描与额外排序
+    mysql: type为ALL, Extra中有Using filesort / Using temporary
+    sqlite(开发环境): SCAN 表 且未使用索引, USE TEMP B-TREE
+    :return: 问题描述列表
+    """
+    problems = []
+    for row in plan:
+        if connection.vendor == 'sqlite':
+            detail = row['detail']
+            if detail.startswith('SCAN') and 'INDEX' not in detail:
+                problems.append('full scan: %s' % detail)
+            if 'TEMP B-TREE' in detail:
+                problems.append('filesort: %s' % detail)
+        else:
+            extra = row.get('Extra') or ''
+            if row.get('type') == 'ALL':
+                problems.append('full scan: table=%s rows=%s' % (row.get('table'), row.get('rows')))
+            if 'Using filesort' in extra or 'Using temporary' in extra:
+                problems.append('filesort: table=%s %s' % (row.get('table'), extra))
+    return problems
+
+
+class Command(BaseCommand):
+    help = '对商品的高频查询执行EXPLAIN, 出现全表扫描或额外排序(filesort)时以状态码1退出, ' \
+           '表中数据太少时mysql可能选择全表扫描, 应在导入商品数据(goods_data.sql)的库上执行'
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help='只检查指定名称的查询')
+        parser.add_argument('--sql', action='store_true', help='显示查询语句')
+
+    def handle(self, *args, **options):
+        queries = hot_queries(sample_ids())
+        if options['names']:
+            queries = [(name, queryset) for name, queryset in queries if name in options['names']]
+
+        failed = []
+        for name, queryset in queries:
+            plan = explain(queryset)
+            problems = find_problems(plan)
+            self.stdout.write('%s %s' % ('FAIL' if problems else 'ok  ', name))
+            if options['sql']:
+                self.stdout.write('    %s' % queryset.query)
+            if problems or options['verbosity'] > 1:
+                for row in plan:
+                    self.stdout.write('    %s' % ' '.join('%s=%s' % item for item in row.items()))
+            for problem in problems:
+                self.stdout.write('    %s' % problem)
+            if problems:
+                failed.append(name)
+
+        if failed:
+            raise CommandError('执行计划回归: %s' % ', '.join(failed))
+        self.stdout.write('checked=%s' % len(queries))
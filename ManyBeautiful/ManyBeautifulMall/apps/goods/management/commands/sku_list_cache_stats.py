@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from goods import list_cache
+
+EVENTS = ('hit', 'miss', 'wait', 'wait_hit', 'wait_timeout')
+
+
+class Command(BaseCommand):
+    help = '查看类别SKU列表缓存的命中统计'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='显示后清空统计')
+
+    def handle(self, *args, **options):
+        stats = list_cache.get_stats()
+        for event in EVENTS:
+            self.stdout.write('%-12s %s' % (event, stats.get(event, 0)))
+        lookups = stats.get('hit', 0) + stats.get('miss', 0)
+        if lookups:
+            self.stdout.write('%-12s %.2f%%' % ('hit_rate', stats.get('hit', 0) * 100.0 / lookups))
+
+        if options['reset']:
+            list_cache.reset_stats()
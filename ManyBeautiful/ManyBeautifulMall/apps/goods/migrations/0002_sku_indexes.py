@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.11 on 2026-10-18 11:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('goods', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='sku',
+            index=models.Index(fields=['category', 'sales', 'id'], name='sku_category_sales_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sku',
+            index=models.Index(fields=['category', 'price', 'id'], name='sku_category_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sku',
+            index=models.Index(fields=['category', 'create_time', 'id'], name='sku_category_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sku',
+            index=models.Index(fields=['is_launched', 'id'], name='sku_launched_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='skuspecification',
+            index=models.Index(fields=['sku', 'spec', 'option'], name='sku_spec_sku_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='skuspecification',
+            index=models.Index(fields=['option', 'sku'], name='sku_spec_option_idx'),
+        ),
+    ]
@@ -140,6 +140,14 @@ class SKU(BaseModel):
         db_table = 'tb_sku'
         verbose_name = '商品SKU'
         verbose_name_plural = verbose_name
+        indexes = [
+            # 类别SKU列表按 (排序字段, id) 翻页(SKUCursorPagination)
+            models.Index(fields=['category', 'sales', 'id'], name='sku_category_sales_idx'),
+            models.Index(fields=['category', 'price', 'id'], name='sku_category_price_idx'),
+            models.Index(fields=['category', 'create_time', 'id'], name='sku_category_time_idx'),
+            # 搜索引擎建立索引时按id分批读取上架的SKU
+            models.Index(fields=['is_launched', 'id'], name='sku_launched_idx'),
+        ]
 
     def __str__(self):
         return '%s: %s' % (self.id, self.name)
@@ -172,6 +180,12 @@ class SKUSpecification(BaseModel):
         db_table = 'tb_sku_specification'
         verbose_name = 'SKU规格'
         verbose_name_plural = verbose_name
+        indexes = [
+            # 详情页按规格顺序读取SKU的规格选项
+            models.Index(fields=['sku', 'spec', 'option'], name='sku_spec_sku_idx'),
+            # 按规格选项查找SKU
+            models.Index(fields=['option', 'sku'], name='sku_spec_option_idx'),
+        ]
 
     def __str__(self):
         return '%s: %s - %s' % (self.sku, self.spec.name, self.option.value)
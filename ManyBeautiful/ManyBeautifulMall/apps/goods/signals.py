@@ -0,0 +1,49 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from goods import facets, list_cache
+from goods.models import SKU, Goods, GoodsSpecification, SpecificationOption, SKUSpecification
+from goods.sku_cache import sku_cache
+
+# 缓存都在数据库事务提交后失效, 提交前失效时其他请求可能读到旧数据并重新写入缓存
+
+
+@receiver(post_save, sender=SKU)
+@receiver(post_delete, sender=SKU)
+def invalidate_sku_cache(sender, instance, **kwargs):
+    """SKU新增/修改/删除后清除SKU摘要缓存"""
+    sku_cache.invalidate_on_commit(instance.id)
+
+
+@receiver(post_save, sender=SKU)
+@receiver(post_delete, sender=SKU)
+def bump_sku_list_cache(sender, instance, **kwargs):
+    """SKU新增/修改/删除后类别SKU列表的缓存与规格筛选索引失效"""
+    list_cache.bump_on_commit(instance.category_id)
+    facets.bump_on_commit(instance.category_id)
+
+
+@receiver(post_save, sender=Goods)
+@receiver(post_delete, sender=Goods)
+def bump_goods_list_cache(sender, instance, **kwargs):
+    """SPU修改/删除后其SKU所在类别的列表缓存失效"""
+    category_ids = set(SKU.objects.filter(goods_id=instance.id).values_list('category_id', flat=True))
+    category_ids.add(instance.category3_id)
+    list_cache.bump_on_commit(*category_ids)
+
+
+@receiver(post_save, sender=SKUSpecification)
+@receiver(post_delete, sender=SKUSpecification)
+def bump_sku_spec_facets(sender, instance, **kwargs):
+    """SKU规格修改后所在类别的规格筛选索引与列表缓存失效"""
+    category_ids = set(SKU.objects.filter(id=instance.sku_id).values_list('category_id', flat=True))
+    facets.bump_on_commit(*category_ids)
+    list_cache.bump_on_commit(*category_ids)
+
+
+@receiver(post_save, sender=GoodsSpecification)
+@receiver(post_save, sender=SpecificationOption)
+def bump_spec_facets(sender, instance, **kwargs):
+    """规格名称/选项值修改后使用该SPU的类别的规格筛选索引失效"""
+    goods_id = instance.goods_id if sender is GoodsSpecification else instance.spec.goods_id
+    facets.bump_on_commit(*set(SKU.objects.filter(goods_id=goods_id).values_list('category_id', flat=True)))
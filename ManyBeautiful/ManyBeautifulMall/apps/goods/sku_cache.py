@@ -0,0 +1,174 @@
+"""
+SKU摘要缓存
+
+进程内LRU -> redis -> mysql 三级读取, 缓存 id, name, price, default_image_url, stock, is_launched,
+以及由update_time得到的版本号version(毫秒时间戳), SKU通过save()修改后版本号变化
+不存在的sku_id同样缓存(负缓存), 避免反复查询数据库
+SKU保存/删除时由goods.signals清除redis中的缓存, 其他进程的LRU在SKU_CACHE_LOCAL_EXPIRES秒内过期
+下单扣减, 取消归还, 库存账本同步等通过QuerySet.update()修改库存时不触发信号, 由调用方在事务提交后清除(invalidate_on_commit)
+库存只用于展示提示, 是近似值, 下单时以数据库为准
+"""
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from decimal import Decimal
+
+from django.db import transaction
+from django_redis import get_redis_connection
+
+from goods import constants
+from goods.models import SKU
+
+logger = logging.getLogger('django')
+
+SUMMARY_FIELDS = ('id', 'name', 'price', 'default_image_url', 'stock', 'is_launched', 'update_time')
+
+# 负缓存标记
+_MISSING = ''
+
+
+class SKUSummaryCache(object):
+    """SKU摘要缓存"""
+
+    def __init__(self, max_size=constants.SKU_CACHE_LOCAL_MAX_SIZE):
+        self.max_size = max_size
+        self._local = OrderedDict()  # {sku_id: (过期时间, 摘要或_MISSING)}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def redis_key(sku_id):
+        return 'sku_summary_%s' % sku_id
+
+    def _get_local(self, sku_id, now):
+        with self._lock:
+            item = self._local.get(sku_id)
+            if item is None:
+                return None
+            if item[0] < now:
+                del self._local[sku_id]
+                return None
+            self._local.move_to_end(sku_id)
+            return item[1]
+
+    def _set_local(self, sku_id, value, now):
+        with self._lock:
+            self._local[sku_id] = (now + constants.SKU_CACHE_LOCAL_EXPIRES, value)
+            self._local.move_to_end(sku_id)
+            while len(self._local) > self.max_size:
+                self._local.popitem(last=False)
+
+    @staticmethod
+    def _dumps(sku):
+        return json.dumps({
+            'id': sku.id,
+            'name': sku.name,
+            'price': str(sku.price),
+            'default_image_url': sku.default_image_url,
+            'stock': sku.stock,
+            'is_launched': sku.is_launched,
+            'version': int(sku.update_time.timestamp() * 1000),
+        })
+
+    @staticmethod
+    def _loads(value):
+        summary = json.loads(value)
+        summary['price'] = Decimal(summary['price'])
+        # 兼容没有版本号的旧缓存
+        summary.setdefault('version', 0)
+        return summary
+
+    def get_many(self, sku_ids, counter=None):
+        """
+        批量获取SKU摘要
+        :param sku_ids: sku_id列表
+        :param counter: 可选, 有redis_calls/db_queries属性的对象, 用于累计交互次数
+        :return: {sku_id: 摘要字典}, 不存在的商品不在结果中, 摘要字典为共享对象, 不要修改
+        """
+        now = time.time()
+        result = {}
+        missed = []
+        for sku_id in sku_ids:
+            sku_id = int(sku_id)
+            value = self._get_local(sku_id, now)
+            if value is None:
+                missed.append(sku_id)
+            elif value != _MISSING:
+                result[sku_id] = value
+
+        if not missed:
+            return result
+
+        # 一次mget读取redis
+        redis_conn = get_redis_connection('sku')
+        values = redis_conn.mget([self.redis_key(sku_id) for sku_id in missed])
+        if counter is not None:
+            counter.redis_calls += 1
+
+        db_missed = []
+        for sku_id, value in zip(missed, values):
+            if value is None:
+                db_missed.append(sku_id)
+                continue
+            value = value.decode()
+            if value == _MISSING:
+                self._set_local(sku_id, _MISSING, now)
+            else:
+                result[sku_id] = self._loads(value)
+                self._set_local(sku_id, result[sku_id], now)
+
+        if not db_missed:
+            return result
+
+        # 一次查询数据库, 并回填redis(包括不存在的sku_id)
+        skus = SKU.objects.only(*SUMMARY_FIELDS).in_bulk(db_missed)
+        if counter is not None:
+            counter.db_queries += 1
+            counter.redis_calls += 1
+
+        pl = redis_conn.pipeline(transaction=False)
+        for sku_id in db_missed:
+            sku = skus.get(sku_id)
+            if sku is None:
+                pl.setex(self.redis_key(sku_id), constants.SKU_CACHE_MISSING_EXPIRES, _MISSING)
+                self._set_local(sku_id, _MISSING, now)
+            else:
+                value = self._dumps(sku)
+                pl.setex(self.redis_key(sku_id), constants.SKU_CACHE_EXPIRES, value)
+                result[sku_id] = self._loads(value)
+                self._set_local(sku_id, result[sku_id], now)
+        pl.execute()
+
+        return result
+
+    def get(self, sku_id):
+        """获取单个SKU摘要, 不存在返回None"""
+        return self.get_many([sku_id]).get(int(sku_id))
+
+    def invalidate(self, *sku_ids):
+        """清除SKU摘要缓存"""
+        with self._lock:
+            for sku_id in sku_ids:
+                self._local.pop(int(sku_id), None)
+        if sku_ids:
+            get_redis_connection('sku').delete(*[self.redis_key(sku_id) for sku_id in sku_ids])
+
+    def invalidate_on_commit(self, *sku_ids):
+        """当前事务提交后清除SKU摘要缓存, 事务回滚时不清除, 用于不触发信号的批量更新"""
+        def _invalidate():
+            try:
+                self.invalidate(*sku_ids)
+            except Exception as e:
+                logger.error('清除SKU摘要缓存失败 %s: %s' % (sku_ids, e))
+
+        if sku_ids:
+            transaction.on_commit(_invalidate)
+
+    def clear_local(self):
+        """清空进程内缓存"""
+        with self._lock:
+            self._local.clear()
+
+
+sku_cache = SKUSummaryCache()
@@ -1,7 +1,10 @@
 from drf_haystack.viewsets import HaystackViewSet
+from rest_framework.exceptions import ValidationError
 from rest_framework.generics import ListAPIView
 from rest_framework.filters import OrderingFilter
-from utils.pagination import SKUListPagination
+from rest_framework.response import Response
+from utils.pagination import SKUListPagination, SKUCursorPagination
+from . import constants, facets, list_cache
 from .serializers import SKUSerializer, SKUIndexSerializer
 from .models import SKU
 
@@ -12,23 +15,72 @@ class SKUListView(ListAPIView):
     商品详情页
     访问路径: /categories/(?P<category_id>\d+)/skus/?page=xxx&page_size=xxx&ordering=xxx
     :return: count, next, previous, results, id, name, price, default_iamge,-url, comments
+    不传page时为游标分页: ?cursor=xxx&page_size=xxx&ordering=xxx&count=1
+    :return: count(count=1时返回, 近似值), next, results
+    按规格选项筛选: ?options=选项id,选项id&facets=1, 同一规格的选项为或, 不同规格为与
+    :return: facets(facets=1时返回): [{"name": 规格名称, "options": [{"id", "value", "count", "selected"}]}]
     """
 
     # queryset = SKU.objects.all()
     # 因为获取的是每个对象的详细数据,所以不能用原本的查询集方法
     # 重写获取查询集方法  self.kwargs===>是字典,用来获取获取路径中的参数
     def get_queryset(self):
-        return SKU.objects.filter(category_id=self.kwargs['category_id'])
+        queryset = SKU.objects.filter(category_id=self.kwargs['category_id'])
+
+        # 规格选项筛选, 在内存中的位图索引上计算(goods.facets)
+        option_ids = self.get_option_ids()
+        if option_ids or self.request.query_params.get('facets') in ('1', 'true'):
+            index = facets.get_index(self.kwargs['category_id'])
+            sku_ids, self.facets = index.search(option_ids)
+            if sku_ids is not None and len(sku_ids) <= constants.SKU_FACETS_MAX_ID_FILTER:
+                queryset = queryset.filter(id__in=sku_ids)
+            elif sku_ids is not None:
+                # 结果较多时每个规格连接一次SKU规格表, 同一规格的选项为或, 不同规格为与
+                for option_group in index.option_groups(option_ids):
+                    queryset = queryset.filter(skuspecification__option_id__in=option_group)
+        return queryset
+
+    def get_option_ids(self):
+        """
+        :return: 请求中的规格选项id, 排序去重
+        """
+        options = self.request.query_params.get('options', '')
+        option_ids = [option_id for option_id in options.split(',') if option_id]
+        if not all(option_id.isdigit() for option_id in option_ids):
+            raise ValidationError({'message': '无效的规格选项'})
+        return sorted(set(int(option_id) for option_id in option_ids))
 
     serializer_class = SKUSerializer
 
     # 分页
-    pagination_class = SKUListPagination
+    pagination_class = SKUCursorPagination
 
     # 排序
     filter_backends = [OrderingFilter]
     ordering_fields = ['create_time', 'price', 'sales']
 
+    def list(self, request, *args, **kwargs):
+        """
+        按(类别, 排序, 页码/游标, 每页数量, 规格选项)缓存响应, 类别的商品变化后缓存失效(goods.list_cache)
+        """
+        category_id = self.kwargs['category_id']
+        params = request.query_params
+        digest = list_cache.params_digest(request.get_host(), params.get('ordering', ''), params.get('page', ''),
+                                          params.get('page_size', ''), params.get('cursor', ''), params.get('count', ''),
+                                          self.get_option_ids(), params.get('facets', ''))
+
+        def build():
+            self.facets = None
+            response = super(SKUListView, self).list(request, *args, **kwargs)
+            if response.status_code == 200 and self.facets is not None:
+                response.data['facets'] = self.facets
+            return (response.data if response.status_code == 200 else None), response
+
+        data, response = list_cache.get_or_build(category_id, digest, build)
+        if response is None:
+            response = Response(data)
+        return response
+
 
 # SKU搜索视图集
 class SKUSearchViewSet(HaystackViewSet):
@@ -42,7 +94,6 @@ class SKUSearchViewSet(HaystackViewSet):
     # 分页
     pagination_class = SKUListPagination
 
-
     """
     返回结果实例:
     {
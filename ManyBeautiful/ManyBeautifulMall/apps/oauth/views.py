@@ -80,7 +80,7 @@ class QQAuthUserView(APIView):
             })
 
             # 合并购物车
-            response = merge_cart_cookie_to_redis(request, user, response)
+            response = merge_cart_cookie_to_redis(request, user.id, response)
 
             return response
 
@@ -113,5 +113,5 @@ class QQAuthUserView(APIView):
         })
 
         # 合并购物车
-        response = merge_cart_cookie_to_redis(request, user, response)
+        response = merge_cart_cookie_to_redis(request, user.id, response)
         return response
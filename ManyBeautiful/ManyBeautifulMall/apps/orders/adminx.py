@@ -0,0 +1,4 @@
+import xadmin
+from . import models
+
+xadmin.site.register(models.FreightRule)
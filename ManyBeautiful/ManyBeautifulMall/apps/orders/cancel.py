@@ -0,0 +1,122 @@
+"""
+自动取消超时未支付的订单
+
+下单后未支付的订单按支付期限加入redis有序集合 order_pay_deadline {order_id: 期限时间戳},
+任务(celery_tasks.orders.tasks.cancel_expired_orders)每次取出一批到期的订单, 在一个事务中:
+    锁定仍为待支付的订单, 改为已取消, 按商品汇总归还库存, 减少SKU与SPU销量
+不需要扫描订单表
+
+取出时不删除, 而是把期限推迟ORDER_CANCEL_RETRY秒, 事务提交后才删除, 进程中途退出时这批订单会再次被取出
+只更新仍为待支付的订单, 重复处理或已支付(PaymentStatusView)的订单不会被取消或重复归还库存
+"""
+import logging
+import time
+
+from django.db import transaction
+from django.db.models import Sum
+from django_redis import get_redis_connection
+
+from orders import constants
+from orders.ledger import StockLedger
+from orders.models import OrderInfo, OrderGoods
+from orders.stock import restore_stock
+
+logger = logging.getLogger('django')
+
+DEADLINE_KEY = 'order_pay_deadline'
+
+# 取出到期的订单并推迟其期限
+# KEYS: deadline  ARGV: 当前时间, 推迟到的时间, 数量
+_TAKE_DUE = """
+    local order_ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[3])
+    for i = 1, #order_ids do
+        redis.call('ZADD', KEYS[1], ARGV[2], order_ids[i])
+    end
+    return order_ids
+"""
+
+_scripts = {}
+
+
+def schedule_cancel(order_id, deadline=None):
+    """
+    未支付的订单在支付期限后自动取消
+    :param deadline: 期限时间戳, 默认为当前时间加ORDER_PAY_EXPIRES
+    """
+    if deadline is None:
+        deadline = time.time() + constants.ORDER_PAY_EXPIRES
+    get_redis_connection('default').zadd(DEADLINE_KEY, {order_id: deadline})
+
+
+def unschedule_cancel(order_id):
+    """订单已支付, 不再自动取消"""
+    get_redis_connection('default').zrem(DEADLINE_KEY, order_id)
+
+
+def take_due_orders(limit):
+    """
+    取出到期的订单
+    :return: 订单号列表
+    """
+    redis_conn = get_redis_connection('default')
+    script = _scripts.get('take_due')
+    if script is None:
+        script = _scripts['take_due'] = redis_conn.register_script(_TAKE_DUE)
+    now = time.time()
+    order_ids = script(keys=[DEADLINE_KEY], args=[now, now + constants.ORDER_CANCEL_RETRY, limit],
+                       client=redis_conn)
+    return [order_id.decode() for order_id in order_ids]
+
+
+def cancel_orders(order_ids):
+    """
+    在一个事务中取消仍为待支付的订单, 归还库存并减少销量
+    :return: 取消的订单数
+    """
+    unpaid = OrderInfo.ORDER_STATUS_ENUM['UNPAID']
+    canceled = OrderInfo.ORDER_STATUS_ENUM['CANCELED']
+
+    with transaction.atomic():
+        # 锁定订单, 与支付结果回调互斥
+        locked = list(OrderInfo.objects.select_for_update().filter(
+            order_id__in=order_ids, status=unpaid).order_by('order_id').values_list('order_id', flat=True))
+        if not locked:
+            return 0
+
+        OrderInfo.objects.filter(order_id__in=locked, status=unpaid).update(status=canceled)
+
+        sku_counts = dict(OrderGoods.objects.filter(order_id__in=locked).values_list('sku_id').annotate(
+            count=Sum('count')).order_by('sku_id'))
+        restore_stock(sku_counts)
+
+        if constants.ORDER_STOCK_ENGINE == 'redis':
+            # redis中的可售库存按mysql重新加载
+            transaction.on_commit(lambda: StockLedger().invalidate(*sku_counts))
+
+    return len(locked)
+
+
+def cancel_expired_orders(max_orders=None):
+    """
+    分批取消到期未支付的订单
+    :param max_orders: 本次最多处理的订单数, 默认不限
+    :return: 取消的订单数
+    """
+    redis_conn = get_redis_connection('default')
+    batch_size = constants.ORDER_CANCEL_BATCH
+    processed = 0
+    canceled = 0
+
+    while max_orders is None or processed < max_orders:
+        order_ids = take_due_orders(batch_size)
+        if not order_ids:
+            break
+        canceled += cancel_orders(order_ids)
+        redis_conn.zrem(DEADLINE_KEY, *order_ids)
+        processed += len(order_ids)
+        if len(order_ids) < batch_size:
+            break
+
+    if processed:
+        logger.info('自动取消订单 processed=%s canceled=%s' % (processed, canceled))
+    return canceled
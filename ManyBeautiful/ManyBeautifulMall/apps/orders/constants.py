@@ -0,0 +1,78 @@
+# 下单扣减库存的检查方式
+# exact: 乐观锁, 条件为库存等于读取时的值, 库存被其他订单修改即冲突, 加锁读取最新值后重试
+# gte: 条件为库存不少于购买数量, 直接在数据库中减少, 只有库存真正不足时才失败
+ORDER_STOCK_CHECK = 'exact'
+
+# 库存冲突时的最大重试次数
+ORDER_STOCK_RETRIES = 5
+
+# 一个订单扣减库存的最长时间(秒), 超过后不再重试
+ORDER_STOCK_DEADLINE = 1.5
+
+# 扣减库存的方式
+# db: 在mysql中扣减(deduct_stock)
+# redis: 在redis中预占(orders.ledger), 由celery任务批量写入mysql
+ORDER_STOCK_ENGINE = 'db'
+
+# redis预占库存的有效期(秒), 过期未确认的预占由任务释放
+ORDER_STOCK_RESERVATION_EXPIRES = 60
+
+# redis库存账本每批写入mysql/处理过期预占的数量
+ORDER_STOCK_FLUSH_BATCH = 500
+
+# redis库存账本读取mysql库存时遇到同步正在进行的最大读取次数, 检查库存时两次读取之间的等待时间(秒)
+ORDER_STOCK_LOAD_RETRIES = 3
+ORDER_STOCK_FLUSH_WAIT = 0.1
+
+# 下单方式
+# sync: 在web进程中保存订单
+# async: 校验后放入celery下单队列, 立即返回订单号, 由下单任务保存, 客户端轮询下单状态
+ORDER_INTAKE_MODE = 'sync'
+
+# 下单队列的分片数, 每个分片队列由一个单并发的worker消费
+ORDER_INTAKE_SHARDS = 8
+
+# 热门商品的sku_id, 包含热门商品的订单按商品分片, 在同一队列中依次处理, 库存冲突不再需要重试
+# 其他订单按商品id的哈希分片; 可以参考order_stock_stats命令显示的冲突最多的商品配置
+ORDER_INTAKE_HOT_SKUS = frozenset()
+
+# 下单队列名称前缀, 队列名为 前缀_分片号
+ORDER_INTAKE_QUEUE_PREFIX = 'orders'
+
+# 下单状态在redis中的有效期(秒)
+ORDER_JOB_EXPIRES = 3600
+
+# 订单号生成器的进程编号(0 ~ 9999), 为None时从redis租用, 每个进程必须不同
+ORDER_ID_WORKER_ID = None
+
+# 从redis租用的进程编号的有效期(秒), 生成订单号时距上次续租超过1/3即续租
+ORDER_ID_WORKER_LEASE_EXPIRES = 60
+
+# 运费计算器, orders.freight.BaseFreightCalculator的子类
+ORDER_FREIGHT_CALCULATOR = 'orders.freight.AreaFreightCalculator'
+
+# 没有运费规则时的运费
+ORDER_DEFAULT_FREIGHT = '10.00'
+
+# 进程内缓存的运费规则的有效期(秒), 规则修改后其他进程最多延迟这么久生效
+ORDER_FREIGHT_RULES_LOCAL_EXPIRES = 60
+
+# redis中缓存的运费规则的有效期(秒)
+ORDER_FREIGHT_RULES_REDIS_EXPIRES = 3600
+
+# 未支付订单的支付期限(秒), 超过后自动取消并归还库存
+ORDER_PAY_EXPIRES = 30 * 60
+
+# 自动取消订单每批处理的订单数
+ORDER_CANCEL_BATCH = 200
+
+# 取出的到期订单在这么多秒内未处理完(进程退出)时重新处理
+ORDER_CANCEL_RETRY = 60
+
+# 下单幂等键: 处理中的占用时间(秒), 应大于一次下单的最长时间; 成功响应的保存时间(秒)
+ORDER_IDEMPOTENCY_LOCK_EXPIRES = 30
+ORDER_IDEMPOTENCY_EXPIRES = 24 * 60 * 60
+
+# 重复的请求等待第一个请求完成的最长时间与轮询间隔(秒)
+ORDER_IDEMPOTENCY_WAIT = 5
+ORDER_IDEMPOTENCY_POLL_INTERVAL = 0.05
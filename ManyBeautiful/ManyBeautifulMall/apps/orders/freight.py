@@ -0,0 +1,135 @@
+"""
+运费计算
+
+结算页与下单使用同一个计算器(ORDER_FREIGHT_CALCULATOR), 两者的运费不会不一致
+AreaFreightCalculator按运费规则表(tb_freight_rule)计算, 规则表缓存在进程内与redis中,
+规则保存/删除时由orders.signals清除redis与当前进程的缓存, 其他进程在ORDER_FREIGHT_RULES_LOCAL_EXPIRES秒内重新读取
+"""
+import json
+import threading
+import time
+from decimal import Decimal
+
+from django.utils.module_loading import import_string
+from django_redis import get_redis_connection
+
+from orders import constants
+from orders.models import FreightRule
+
+RULES_KEY = 'freight_rules'
+
+
+class BaseFreightCalculator(object):
+    """运费计算器"""
+
+    def calculate(self, address, total_count, total_amount):
+        """
+        计算运费
+        :param address: 收货地址(Address对象), 没有地址时为None
+        :param total_count: 商品总数
+        :param total_amount: 商品总金额
+        :return: 运费 Decimal
+        """
+        raise NotImplementedError
+
+    def invalidate(self):
+        """运费规则修改后清除缓存"""
+
+
+class FixedFreightCalculator(BaseFreightCalculator):
+    """固定运费"""
+
+    def calculate(self, address, total_count, total_amount):
+        return Decimal(constants.ORDER_DEFAULT_FREIGHT)
+
+
+class AreaFreightCalculator(BaseFreightCalculator):
+    """按地区运费规则计算"""
+
+    def __init__(self):
+        self._local = (0, None)  # (过期时间, {area_id: (首件运费, 续件运费, 包邮金额)})
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _load():
+        """从mysql读取运费规则, 同一地区有多条规则时使用最后添加的"""
+        rules = {}
+        for rule in FreightRule.objects.order_by('id'):
+            rules[rule.area_id] = (
+                str(rule.first_fee), str(rule.extra_fee),
+                None if rule.free_amount is None else str(rule.free_amount),
+            )
+        return rules
+
+    def get_rules(self):
+        """
+        读取运费规则, 进程内 -> redis -> mysql
+        :return: {area_id(全国默认为None): (首件运费, 续件运费, 包邮金额或None)}
+        """
+        now = time.time()
+        expires, rules = self._local
+        if rules is not None and expires >= now:
+            return rules
+
+        redis_conn = get_redis_connection('default')
+        value = redis_conn.get(RULES_KEY)
+        if value is None:
+            items = [[area_id, rule] for area_id, rule in self._load().items()]
+            redis_conn.setex(RULES_KEY, constants.ORDER_FREIGHT_RULES_REDIS_EXPIRES, json.dumps(items))
+        else:
+            items = json.loads(value)
+
+        rules = {}
+        for area_id, (first_fee, extra_fee, free_amount) in items:
+            rules[area_id] = (Decimal(first_fee), Decimal(extra_fee),
+                              None if free_amount is None else Decimal(free_amount))
+        with self._lock:
+            self._local = (now + constants.ORDER_FREIGHT_RULES_LOCAL_EXPIRES, rules)
+        return rules
+
+    def invalidate(self):
+        """运费规则修改后清除redis与当前进程的缓存"""
+        get_redis_connection('default').delete(RULES_KEY)
+        with self._lock:
+            self._local = (0, None)
+
+    def calculate(self, address, total_count, total_amount):
+        rules = self.get_rules()
+
+        area_ids = (address.district_id, address.city_id, address.province_id) if address is not None else ()
+        rule = None
+        for area_id in area_ids + (None,):
+            rule = rules.get(area_id)
+            if rule is not None:
+                break
+        if rule is None:
+            return Decimal(constants.ORDER_DEFAULT_FREIGHT)
+
+        first_fee, extra_fee, free_amount = rule
+        if free_amount is not None and total_amount >= free_amount:
+            return Decimal('0.00')
+        return first_fee + extra_fee * max(total_count - 1, 0)
+
+
+_calculators = {}
+
+
+def get_freight_calculator():
+    """获取ORDER_FREIGHT_CALCULATOR配置的运费计算器, 每个进程一个实例"""
+    path = constants.ORDER_FREIGHT_CALCULATOR
+    calculator = _calculators.get(path)
+    if calculator is None:
+        calculator = _calculators[path] = import_string(path)()
+    return calculator
+
+
+def calculate_freight(address, skus):
+    """
+    计算订单运费
+    :param address: 收货地址, 可以为None
+    :param skus: SKU对象列表, count属性为购买数量
+    :return: 运费 Decimal
+    """
+    total_count = sum(sku.count for sku in skus)
+    total_amount = sum(sku.price * sku.count for sku in skus)
+    return get_freight_calculator().calculate(address, total_count, total_amount).quantize(Decimal('0.01'))
@@ -0,0 +1,82 @@
+"""
+下单请求的幂等键
+
+客户端在请求头 Idempotency-Key 中为一次下单生成唯一的键, 重复点击或重试时使用同一个键:
+    第一个请求在redis中占用该键(SET NX), 处理成功后保存响应, 之后相同键的请求直接返回保存的响应
+    第一个请求处理中时, 重复的请求等待其结果, 超时返回409
+    第一个请求失败时删除该键, 客户端可以用同一个键重试
+重复的请求不会进入下单事务
+
+redis中的数据(default库):
+    order_idempotency_<user_id>_<键> json {state, fingerprint, status, data}
+"""
+import hashlib
+import json
+import re
+import time
+
+from django_redis import get_redis_connection
+
+from orders import constants
+
+STATE_PROCESSING = 'processing'
+STATE_DONE = 'done'
+
+KEY_PATTERN = re.compile(r'^[A-Za-z0-9_\-]{1,64}$')
+
+
+def is_valid_key(key):
+    return bool(KEY_PATTERN.match(key))
+
+
+def redis_key(user_id, key):
+    return 'order_idempotency_%s_%s' % (user_id, key)
+
+
+def fingerprint(data):
+    """请求数据的摘要, 同一个键用于不同的请求数据时拒绝"""
+    return hashlib.sha1(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def acquire(user_id, key, request_fingerprint):
+    """
+    占用幂等键
+    :return: (是否占用成功, 已有的记录 {state, fingerprint, status, data} 或None)
+    """
+    redis_conn = get_redis_connection('default')
+    record = json.dumps({'state': STATE_PROCESSING, 'fingerprint': request_fingerprint})
+    if redis_conn.set(redis_key(user_id, key), record, nx=True, ex=constants.ORDER_IDEMPOTENCY_LOCK_EXPIRES):
+        return True, None
+    return False, get(user_id, key)
+
+
+def get(user_id, key):
+    value = get_redis_connection('default').get(redis_key(user_id, key))
+    return json.loads(value.decode()) if value is not None else None
+
+
+def wait(user_id, key, deadline=None):
+    """
+    等待处理中的请求完成
+    :param deadline: 等待截止的time.monotonic(), 默认等待ORDER_IDEMPOTENCY_WAIT秒
+    :return: 完成的记录; 第一个请求失败(键已删除)时返回None; 超时返回处理中的记录
+    """
+    if deadline is None:
+        deadline = time.monotonic() + constants.ORDER_IDEMPOTENCY_WAIT
+    while True:
+        record = get(user_id, key)
+        if record is None or record['state'] == STATE_DONE or time.monotonic() >= deadline:
+            return record
+        time.sleep(constants.ORDER_IDEMPOTENCY_POLL_INTERVAL)
+
+
+def complete(user_id, key, request_fingerprint, status, data):
+    """保存成功的响应"""
+    record = json.dumps({'state': STATE_DONE, 'fingerprint': request_fingerprint, 'status': status, 'data': data},
+                        default=str)
+    get_redis_connection('default').set(redis_key(user_id, key), record, ex=constants.ORDER_IDEMPOTENCY_EXPIRES)
+
+
+def release(user_id, key):
+    """请求失败, 删除幂等键, 允许使用同一个键重试"""
+    get_redis_connection('default').delete(redis_key(user_id, key))
@@ -0,0 +1,218 @@
+"""
+订单号生成器
+
+订单号为25位数字: 14位UTC时间(年月日时分秒) + 3位毫秒 + 4位进程编号 + 4位毫秒内序号
+    - 与原来的 时间+用户id 格式一样以时间开头, 按字符串排序即按下单时间排序
+    - 进程编号在进程第一次生成订单号时从redis中租用, 之后生成订单号只在续租时访问redis, 不访问数据库
+    - 同一进程同一毫秒内最多生成10000个订单号, 用完后借用下一毫秒; 系统时间回拨时沿用上次的时间, 订单号保持递增
+
+进程编号的租约:
+    redis中 order_id_worker_<编号> 保存持有进程的随机令牌, 有效期ORDER_ID_WORKER_LEASE_EXPIRES秒,
+    分配时从INCR order_id_worker 的位置开始依次尝试 SET NX, 已被其他存活进程持有的编号被跳过;
+    生成订单号前距上次续租超过有效期的1/3时先续租, 续租失败(租约过期后已被其他进程取得)时重新分配,
+    因此同一编号同一时刻只被一个进程使用, 进程重启的总次数不影响唯一性
+同时持有租约的进程不超过10000个, 超过时分配失败; 进程编号也可以由ORDER_ID_WORKER_ID配置固定, 由部署保证不重复
+"""
+import atexit
+import datetime
+import os
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.utils import timezone
+from django_redis import get_redis_connection
+
+from orders import constants
+
+WORKER_KEY = 'order_id_worker'
+
+WORKER_ID_COUNT = 10000
+SEQUENCE_COUNT = 10000
+
+# 续租: 租约仍属于自己或已过期未被取得时延长有效期
+# KEYS: 租约; ARGV: 令牌, 有效期
+_RENEW = """
+    local holder = redis.call('GET', KEYS[1])
+    if holder == ARGV[1] then
+        redis.call('EXPIRE', KEYS[1], ARGV[2])
+        return 1
+    end
+    if not holder then
+        redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+        return 1
+    end
+    return 0
+"""
+
+# 释放: 租约属于自己时删除
+# KEYS: 租约; ARGV: 令牌
+_RELEASE = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('DEL', KEYS[1])
+    end
+    return 0
+"""
+
+_scripts = {}
+
+
+class WorkerIdExhausted(Exception):
+    """所有进程编号都被存活的进程持有"""
+    pass
+
+
+def _script(redis_conn, name, source):
+    script = _scripts.get(name)
+    if script is None:
+        script = _scripts[name] = redis_conn.register_script(source)
+    return script
+
+
+def worker_key(worker_id):
+    return '%s_%d' % (WORKER_KEY, worker_id)
+
+
+def allocate_worker_id(token, expires=None):
+    """
+    从redis中租用进程编号, 从INCR的位置开始依次尝试, 跳过仍被持有的编号
+    :param token: 持有者的令牌
+    :param expires: 租约有效期(秒), 默认constants.ORDER_ID_WORKER_LEASE_EXPIRES
+    :return: 0 ~ WORKER_ID_COUNT - 1
+    :raise WorkerIdExhausted: 没有空闲的编号
+    """
+    expires = expires or constants.ORDER_ID_WORKER_LEASE_EXPIRES
+    redis_conn = get_redis_connection('default')
+    start = redis_conn.incr(WORKER_KEY) - 1
+    for i in range(WORKER_ID_COUNT):
+        worker_id = (start + i) % WORKER_ID_COUNT
+        if redis_conn.set(worker_key(worker_id), token, nx=True, ex=expires):
+            return worker_id
+    raise WorkerIdExhausted()
+
+
+def renew_worker_id(worker_id, token, expires=None):
+    """
+    续租进程编号
+    :return: 是否仍持有
+    """
+    expires = expires or constants.ORDER_ID_WORKER_LEASE_EXPIRES
+    redis_conn = get_redis_connection('default')
+    return bool(_script(redis_conn, 'renew', _RENEW)(keys=[worker_key(worker_id)], args=[token, expires],
+                                                     client=redis_conn))
+
+
+def release_worker_id(worker_id, token):
+    """释放进程编号, 其他进程可以立即使用"""
+    redis_conn = get_redis_connection('default')
+    _script(redis_conn, 'release', _RELEASE)(keys=[worker_key(worker_id)], args=[token], client=redis_conn)
+
+
+class OrderIdGenerator(object):
+    """订单号生成器, 线程安全, fork出的子进程会重新分配进程编号"""
+
+    def __init__(self, worker_id=None):
+        """
+        :param worker_id: 固定的进程编号, 为None时使用ORDER_ID_WORKER_ID配置或从redis租用
+        """
+        self.fixed_worker_id = worker_id
+        self.worker_id = None
+        self.pid = None
+        self.last_ms = 0
+        self.sequence = 0
+        self.lock = threading.Lock()
+        # 租约的令牌, 上次续租的time.monotonic(), 固定编号时为None
+        self.token = None
+        self.renewed = 0
+        # (秒级时间戳, 格式化的时间)
+        self.formatted = (None, '')
+
+    def _lease(self):
+        """租用新的进程编号, 在锁内调用, 分配失败时不修改当前状态"""
+        token = uuid.uuid4().hex
+        renewed = time.monotonic()
+        self.worker_id = allocate_worker_id(token)
+        self.token = token
+        self.renewed = renewed
+        self.pid = os.getpid()
+        self.last_ms = 0
+        self.sequence = 0
+
+    def _get_worker_id(self):
+        if self.pid != os.getpid():
+            # 第一次使用或在fork出的子进程中, 不能沿用父进程的编号
+            worker_id = self.fixed_worker_id
+            if worker_id is None:
+                worker_id = constants.ORDER_ID_WORKER_ID
+            if worker_id is None:
+                self._lease()
+                atexit.register(self.release)
+            else:
+                self.worker_id = worker_id % WORKER_ID_COUNT
+                self.token = None
+                self.pid = os.getpid()
+                self.last_ms = 0
+                self.sequence = 0
+        elif self.token is not None:
+            # 租约有效期过去1/3后续租, 续租前记录时间, 保证使用编号时租约一定未过期
+            now = time.monotonic()
+            if now - self.renewed > constants.ORDER_ID_WORKER_LEASE_EXPIRES / 3:
+                if renew_worker_id(self.worker_id, self.token):
+                    self.renewed = now
+                else:
+                    # 租约已过期并被其他进程取得, 换用新的编号
+                    self._lease()
+        return self.worker_id
+
+    def release(self):
+        """进程退出时释放租用的编号"""
+        with self.lock:
+            if self.token is not None and self.pid == os.getpid():
+                try:
+                    release_worker_id(self.worker_id, self.token)
+                except Exception:
+                    pass
+                self.token = None
+                self.pid = None
+
+    def _next(self):
+        """
+        :return: (毫秒时间戳, 进程编号, 序号)
+        """
+        with self.lock:
+            worker_id = self._get_worker_id()
+            now_ms = int(time.time() * 1000)
+            if now_ms > self.last_ms:
+                self.last_ms = now_ms
+                self.sequence = 0
+            else:
+                # 同一毫秒或系统时间回拨, 沿用上次的时间
+                self.sequence += 1
+                if self.sequence >= SEQUENCE_COUNT:
+                    self.last_ms += 1
+                    self.sequence = 0
+            return self.last_ms, worker_id, self.sequence
+
+    def generate(self):
+        """
+        生成订单号
+        :return: 25位数字字符串
+        """
+        ms, worker_id, sequence = self._next()
+        seconds, millis = divmod(ms, 1000)
+        return '%s%03d%04d%04d' % (self._format_seconds(seconds), millis, worker_id, sequence)
+
+    def _format_seconds(self, seconds):
+        """格式化秒级时间, 缓存上一次的结果"""
+        cached = self.formatted
+        if cached[0] == seconds:
+            return cached[1]
+        # 与timezone.now()一致, 启用时区时使用UTC时间
+        tz = timezone.utc if settings.USE_TZ else None
+        text = datetime.datetime.fromtimestamp(seconds, tz).strftime('%Y%m%d%H%M%S')
+        self.formatted = (seconds, text)
+        return text
+
+
+order_id_generator = OrderIdGenerator()
@@ -0,0 +1,121 @@
+"""
+异步下单
+
+ORDER_INTAKE_MODE为async时, 下单接口只校验请求并读取购物车, 把下单任务放入celery下单队列后立即返回订单号,
+订单由下单任务(celery_tasks.orders.tasks.place_order)保存, 客户端通过下单状态接口轮询结果
+
+redis中的数据(default库):
+    order_job_<order_id> hash {user_id, status, message}: 下单状态, ORDER_JOB_EXPIRES后过期
+    order_intake_<分片号> set {order_id}: 分片队列中等待处理的订单, 任务重复投递时不会重复计数
+
+分片: 只由订单中的商品决定, 不读取redis中变化的统计, 同样的商品总是进入同一分片
+    - 包含配置的热门商品(ORDER_INTAKE_HOT_SKUS)时按其中id最小的分片, 包含同一热门商品的订单在同一队列中依次处理
+    - 否则按排序后的商品id的哈希分片, 订单均匀分布
+扣减库存冲突最多的商品由order_stock_stats命令查看(order_stock_conflict_skus), 只用于确定热门商品的配置
+"""
+import zlib
+
+from django_redis import get_redis_connection
+
+from celery_tasks.main import app
+from orders import constants
+
+# 下单状态
+JOB_PROCESSING = 'processing'
+JOB_SUCCESS = 'success'
+JOB_FAILED = 'failed'
+
+
+def job_key(order_id):
+    return 'order_job_%s' % order_id
+
+
+def intake_key(shard):
+    return 'order_intake_%s' % shard
+
+
+def shard_for(cart_count):
+    """
+    下单任务的分片号, 不访问redis
+    一个订单只能进入一个分片, 同时包含两个热门商品时, 与另一个商品的冲突仍由扣减库存的重试处理
+    :param cart_count: {sku_id: count}
+    """
+    sku_ids = sorted(cart_count)
+    hot_sku_ids = [sku_id for sku_id in sku_ids if sku_id in constants.ORDER_INTAKE_HOT_SKUS]
+    if hot_sku_ids:
+        return hot_sku_ids[0] % constants.ORDER_INTAKE_SHARDS
+    return zlib.crc32(','.join(str(sku_id) for sku_id in sku_ids).encode()) % constants.ORDER_INTAKE_SHARDS
+
+
+def queue_name(shard):
+    return '%s_%s' % (constants.ORDER_INTAKE_QUEUE_PREFIX, shard)
+
+
+def enqueue(user, order_id, address, pay_method, cart_count):
+    """
+    记录下单状态并把下单任务放入分片队列
+    :param cart_count: 结算的商品及数量 {sku_id: count}
+    :return: 分片号
+    """
+    redis_conn = get_redis_connection('default')
+    shard = shard_for(cart_count)
+    pl = redis_conn.pipeline()
+    pl.hmset(job_key(order_id), {'user_id': user.id, 'status': JOB_PROCESSING, 'message': ''})
+    pl.expire(job_key(order_id), constants.ORDER_JOB_EXPIRES)
+    pl.sadd(intake_key(shard), order_id)
+    pl.execute()
+
+    try:
+        # json序列化时字典的键会变成字符串, 以列表传递商品与数量
+        app.send_task(
+            'place_order', args=(order_id, user.id, address, pay_method, sorted(cart_count.items()), shard),
+            queue=queue_name(shard))
+    except Exception:
+        pl = redis_conn.pipeline()
+        pl.delete(job_key(order_id))
+        pl.srem(intake_key(shard), order_id)
+        pl.execute()
+        raise
+
+    return shard
+
+
+def dequeue(order_id, shard):
+    """下单任务开始处理, 移出分片队列的等待集合"""
+    get_redis_connection('default').srem(intake_key(shard), order_id)
+
+
+def set_status(order_id, status, message=''):
+    """更新下单状态"""
+    redis_conn = get_redis_connection('default')
+    pl = redis_conn.pipeline()
+    pl.hmset(job_key(order_id), {'status': status, 'message': message})
+    pl.expire(job_key(order_id), constants.ORDER_JOB_EXPIRES)
+    pl.execute()
+
+
+def get_status(order_id):
+    """
+    读取下单状态
+    :return: {'user_id': 用户id, 'status': 状态, 'message': 失败原因}, 不存在或已过期时返回None
+    """
+    job = get_redis_connection('default').hgetall(job_key(order_id))
+    if not job:
+        return None
+    return {
+        'user_id': int(job[b'user_id']),
+        'status': job[b'status'].decode(),
+        'message': job.get(b'message', b'').decode(),
+    }
+
+
+def get_depths():
+    """
+    每个分片队列等待处理的下单任务数
+    :return: {分片号: 数量}
+    """
+    shards = range(constants.ORDER_INTAKE_SHARDS)
+    pl = get_redis_connection('default').pipeline(transaction=False)
+    for shard in shards:
+        pl.scard(intake_key(shard))
+    return dict(zip(shards, pl.execute()))
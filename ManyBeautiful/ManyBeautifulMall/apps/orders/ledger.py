@@ -0,0 +1,317 @@
+"""
+redis库存预占账本
+
+ORDER_STOCK_ENGINE为redis时, 下单不在mysql中扣减库存, 而是由lua脚本在redis中原子地预占库存,
+订单提交后预占转为待同步的扣减量, 由celery任务批量写入tb_sku与tb_goods(库存与销量)
+
+redis中的数据(stock库):
+    stock_<sku_id>: 可售库存, 不存在时由mysql中的库存减去待同步与预占的数量得到
+    stock_reservation_<order_id> hash {sku_id: count}: 订单预占的库存
+    stock_reservation_expiry zset {order_id: 过期时间}: 未确认的预占, 过期后由任务释放或确认
+    stock_reserved hash {sku_id: count}: 所有未确认预占的合计
+    stock_pending hash {sku_id: count}: 已确认, 待写入mysql的扣减量
+    stock_flushing hash {sku_id: count}: 正在写入mysql的扣减量
+    stock_flush_seq: 同步序号, 写入mysql提交后与删除stock_flushing在同一脚本中增加
+
+不变量: mysql库存 = 可售库存 + 预占合计 + 待同步扣减量 + 正在同步的扣减量, 由stock_reconcile命令检查
+
+同步时mysql提交与删除stock_flushing不是原子的, 两者之间读取的mysql库存已扣除正在同步的扣减量,
+加载与检查在读取mysql前记下同步序号, 在redis中计算时同步序号已变化或有同步正在进行则放弃, 重新读取
+"""
+import time
+
+from django.db import transaction
+from django.db.models import Case, When, Value, F, IntegerField
+from django_redis import get_redis_connection
+
+from goods.models import SKU, Goods
+from goods.sku_cache import sku_cache
+from orders import constants
+from orders.models import OrderInfo
+from orders.stock import InsufficientStock, StockConflict
+
+RESERVED_KEY = 'stock_reserved'
+PENDING_KEY = 'stock_pending'
+FLUSHING_KEY = 'stock_flushing'
+FLUSH_SEQ_KEY = 'stock_flush_seq'
+EXPIRY_KEY = 'stock_reservation_expiry'
+
+# 加载mysql库存, 已存在的不覆盖
+# KEYS: stock_<sku_id>, ..., pending, flushing, reserved, flush_seq  ARGV: 读取mysql前的同步序号, sku_id, mysql库存, ...
+# return: 加载的商品数, 读取mysql后有同步进行或完成时为-1
+_LOAD = """
+    local n = #KEYS - 4
+    local pending_key, flushing_key, reserved_key, seq_key = KEYS[n + 1], KEYS[n + 2], KEYS[n + 3], KEYS[n + 4]
+    if redis.call('EXISTS', flushing_key) == 1 or (redis.call('GET', seq_key) or '0') ~= ARGV[1] then
+        return -1
+    end
+    for i = 1, n do
+        local sku_id = ARGV[2 * i]
+        local stock = tonumber(ARGV[2 * i + 1])
+            - tonumber(redis.call('HGET', pending_key, sku_id) or 0)
+            - tonumber(redis.call('HGET', reserved_key, sku_id) or 0)
+        redis.call('SET', KEYS[i], stock, 'NX')
+    end
+    return n
+"""
+
+# 预占库存
+# KEYS: stock_<sku_id>, ..., reserved, reservation, expiry  ARGV: order_id, 过期时间, sku_id, count, ...
+# return: {1} 成功, {0, sku_id, ...} 库存未加载, {-1, sku_id} 库存不足
+_RESERVE = """
+    local n = #KEYS - 3
+    local reserved_key, reservation_key, expiry_key = KEYS[n + 1], KEYS[n + 2], KEYS[n + 3]
+    local missing = {0}
+    for i = 1, n do
+        if redis.call('EXISTS', KEYS[i]) == 0 then
+            missing[#missing + 1] = ARGV[2 * i + 1]
+        end
+    end
+    if #missing > 1 then
+        return missing
+    end
+    for i = 1, n do
+        if tonumber(redis.call('GET', KEYS[i])) < tonumber(ARGV[2 * i + 2]) then
+            return {-1, ARGV[2 * i + 1]}
+        end
+    end
+    for i = 1, n do
+        local sku_id, count = ARGV[2 * i + 1], ARGV[2 * i + 2]
+        redis.call('DECRBY', KEYS[i], count)
+        redis.call('HINCRBY', reserved_key, sku_id, count)
+        redis.call('HSET', reservation_key, sku_id, count)
+    end
+    redis.call('ZADD', expiry_key, ARGV[2], ARGV[1])
+    return {1}
+"""
+
+# 确认预占, 转为待同步的扣减量
+# KEYS: reservation, reserved, pending, expiry  ARGV: order_id
+_CONFIRM = """
+    local items = redis.call('HGETALL', KEYS[1])
+    for i = 1, #items, 2 do
+        redis.call('HINCRBY', KEYS[2], items[i], -items[i + 1])
+        redis.call('HINCRBY', KEYS[3], items[i], items[i + 1])
+    end
+    redis.call('DEL', KEYS[1])
+    redis.call('ZREM', KEYS[4], ARGV[1])
+    return #items / 2
+"""
+
+# 释放预占, 库存加回可售库存
+# KEYS: stock_<sku_id>, ..., reservation, reserved, expiry  ARGV: order_id, sku_id, ...
+# 预占在读取后已被确认或释放时不做任何修改
+_RELEASE = """
+    local n = #KEYS - 3
+    local reservation_key, reserved_key, expiry_key = KEYS[n + 1], KEYS[n + 2], KEYS[n + 3]
+    if redis.call('HLEN', reservation_key) ~= n then
+        redis.call('ZREM', expiry_key, ARGV[1])
+        return 0
+    end
+    for i = 1, n do
+        local sku_id = ARGV[i + 1]
+        local count = redis.call('HGET', reservation_key, sku_id)
+        redis.call('INCRBY', KEYS[i], count)
+        redis.call('HINCRBY', reserved_key, sku_id, -count)
+    end
+    redis.call('DEL', reservation_key)
+    redis.call('ZREM', expiry_key, ARGV[1])
+    return 1
+"""
+
+# 取出待同步的扣减量, 上次同步未完成时返回上次的数据
+# KEYS: pending, flushing
+_TAKE_PENDING = """
+    if redis.call('EXISTS', KEYS[2]) == 0 then
+        if redis.call('EXISTS', KEYS[1]) == 0 then
+            return {}
+        end
+        redis.call('RENAME', KEYS[1], KEYS[2])
+    end
+    return redis.call('HGETALL', KEYS[2])
+"""
+
+# 同步完成: 删除正在同步的扣减量并增加同步序号
+# KEYS: flushing, flush_seq
+_FINISH_FLUSH = """
+    redis.call('DEL', KEYS[1])
+    return redis.call('INCR', KEYS[2])
+"""
+
+_registered_scripts = {}
+
+
+def stock_key(sku_id):
+    return 'stock_%s' % sku_id
+
+
+def reservation_key(order_id):
+    return 'stock_reservation_%s' % order_id
+
+
+class FlushInProgress(Exception):
+    """多次读取mysql库存时都有同步正在进行, 无法得到一致的库存"""
+    pass
+
+
+class StockLedger(object):
+    """redis库存预占账本"""
+
+    def __init__(self):
+        self.redis_conn = get_redis_connection('stock')
+
+    def _call(self, source, keys, args=()):
+        script = _registered_scripts.get(source)
+        if script is None:
+            script = self.redis_conn.register_script(source)
+            _registered_scripts[source] = script
+        return script(keys=keys, args=args)
+
+    def load(self, sku_ids):
+        """
+        加载mysql中的库存到redis, 已加载的商品不覆盖
+        mysql库存加锁读取(当前读), 不使用事务开始时的快照, 同步的更新提交前会等待;
+        读取后有同步进行或完成时立即重新读取, 不在事务中等待
+        :raise FlushInProgress: 重试次数用完
+        """
+        sku_ids = sorted(sku_ids)
+        if not sku_ids:
+            return
+        for attempt in range(constants.ORDER_STOCK_LOAD_RETRIES):
+            seq = self.redis_conn.get(FLUSH_SEQ_KEY) or b'0'
+            stocks = SKU.objects.select_for_update().filter(id__in=sku_ids).order_by('id').values_list('id', 'stock')
+            keys = []
+            args = [seq]
+            for sku_id, stock in stocks:
+                keys.append(stock_key(sku_id))
+                args.extend((sku_id, stock))
+            if self._call(_LOAD, keys + [PENDING_KEY, FLUSHING_KEY, RESERVED_KEY, FLUSH_SEQ_KEY], args) >= 0:
+                return
+        raise FlushInProgress()
+
+    def invalidate(self, *sku_ids):
+        """mysql中的库存被直接修改后删除redis中的可售库存, 下次预占时重新加载"""
+        if sku_ids:
+            self.redis_conn.delete(*[stock_key(sku_id) for sku_id in sku_ids])
+
+    def reserve(self, order_id, skus):
+        """
+        预占订单中所有商品的库存
+        :param skus: SKU对象列表, count属性为购买数量
+        :raise InsufficientStock: 库存不足
+        :raise StockConflict: 加载库存时一直有同步正在进行
+        """
+        keys = [stock_key(sku.id) for sku in skus] + [RESERVED_KEY, reservation_key(order_id), EXPIRY_KEY]
+        args = [order_id, int(time.time()) + constants.ORDER_STOCK_RESERVATION_EXPIRES]
+        for sku in skus:
+            args.extend((sku.id, sku.count))
+
+        result = self._call(_RESERVE, keys, args)
+        if result[0] == 0:
+            # 有商品的库存未加载, 加载后重新预占
+            try:
+                self.load(int(sku_id) for sku_id in result[1:])
+            except FlushInProgress:
+                raise StockConflict()
+            result = self._call(_RESERVE, keys, args)
+
+        if result[0] != 1:
+            sku_id = int(result[1])
+            raise InsufficientStock(next(sku for sku in skus if sku.id == sku_id))
+
+    def confirm(self, order_id):
+        """订单已提交, 预占转为待同步的扣减量"""
+        return self._call(_CONFIRM, [reservation_key(order_id), RESERVED_KEY, PENDING_KEY, EXPIRY_KEY], [order_id])
+
+    def release(self, order_id):
+        """订单未提交, 释放预占的库存"""
+        sku_ids = [int(sku_id) for sku_id in self.redis_conn.hkeys(reservation_key(order_id))]
+        keys = [stock_key(sku_id) for sku_id in sku_ids] + [reservation_key(order_id), RESERVED_KEY, EXPIRY_KEY]
+        return self._call(_RELEASE, keys, [order_id] + sku_ids)
+
+    def expire_reservations(self, limit=None):
+        """
+        处理过期的预占, 订单已保存(确认前进程退出)的确认, 否则释放
+        :return: (确认数, 释放数)
+        """
+        limit = limit or constants.ORDER_STOCK_FLUSH_BATCH
+        order_ids = [order_id.decode() for order_id in self.redis_conn.zrangebyscore(
+            EXPIRY_KEY, '-inf', int(time.time()), start=0, num=limit)]
+        saved = set(OrderInfo.objects.filter(order_id__in=order_ids).values_list('order_id', flat=True))
+        for order_id in order_ids:
+            if order_id in saved:
+                self.confirm(order_id)
+            else:
+                self.release(order_id)
+        return len(saved), len(order_ids) - len(saved)
+
+    def flush(self):
+        """
+        把待同步的扣减量写入mysql, 每批一条库存/销量更新, 每个SPU一条销量更新
+        mysql提交后才删除stock_flushing并增加同步序号, 两者之间进程退出时下次会重复写入, 由stock_reconcile命令发现
+        :return: 写入的商品数
+        """
+        items = self._call(_TAKE_PENDING, [PENDING_KEY, FLUSHING_KEY])
+        deltas = {}
+        for i in range(0, len(items), 2):
+            count = int(items[i + 1])
+            if count:
+                deltas[int(items[i])] = count
+        if not deltas:
+            self.redis_conn.delete(FLUSHING_KEY)
+            return 0
+
+        sku_ids = sorted(deltas)
+        batch_size = constants.ORDER_STOCK_FLUSH_BATCH
+        with transaction.atomic():
+            for start in range(0, len(sku_ids), batch_size):
+                batch = sku_ids[start:start + batch_size]
+                cases = Case(*[When(id=sku_id, then=Value(deltas[sku_id])) for sku_id in batch],
+                             output_field=IntegerField())
+                SKU.objects.filter(id__in=batch).update(stock=F('stock') - cases, sales=F('sales') + cases)
+            sku_cache.invalidate_on_commit(*sku_ids)
+
+            goods_sales = {}
+            for sku_id, goods_id in SKU.objects.filter(id__in=sku_ids).values_list('id', 'goods_id'):
+                goods_sales[goods_id] = goods_sales.get(goods_id, 0) + deltas[sku_id]
+            for goods_id in sorted(goods_sales):
+                Goods.objects.filter(id=goods_id).update(sales=F('sales') + goods_sales[goods_id])
+
+        self._call(_FINISH_FLUSH, [FLUSHING_KEY, FLUSH_SEQ_KEY])
+        return len(deltas)
+
+    def drift(self, sku_ids):
+        """
+        对比redis与mysql的库存, 在事务外调用
+        读取mysql后有同步进行或完成时等待后重新读取
+        :return: [(sku_id, redis可售库存, 按mysql计算的可售库存), ...], 只包括不一致且已加载的商品
+        :raise FlushInProgress: 重试次数用完
+        """
+        for attempt in range(constants.ORDER_STOCK_LOAD_RETRIES):
+            if attempt:
+                time.sleep(constants.ORDER_STOCK_FLUSH_WAIT)
+            seq = self.redis_conn.get(FLUSH_SEQ_KEY) or b'0'
+            stocks = dict(SKU.objects.filter(id__in=sku_ids).values_list('id', 'stock'))
+            sku_ids = sorted(stocks)
+            if not sku_ids:
+                return []
+            pl = self.redis_conn.pipeline(transaction=True)
+            pl.mget([stock_key(sku_id) for sku_id in sku_ids])
+            pl.hmget(PENDING_KEY, sku_ids)
+            pl.hmget(RESERVED_KEY, sku_ids)
+            pl.exists(FLUSHING_KEY)
+            pl.get(FLUSH_SEQ_KEY)
+            available, pending, reserved, flushing, current_seq = pl.execute()
+            if not flushing and (current_seq or b'0') == seq:
+                break
+        else:
+            raise FlushInProgress()
+
+        result = []
+        for i, sku_id in enumerate(sku_ids):
+            if available[i] is None:
+                continue
+            expected = stocks[sku_id] - int(pending[i] or 0) - int(reserved[i] or 0)
+            if int(available[i]) != expected:
+                result.append((sku_id, int(available[i]), expected))
+        return result
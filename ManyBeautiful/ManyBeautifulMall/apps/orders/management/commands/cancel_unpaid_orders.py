@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django_redis import get_redis_connection
+
+from orders import constants
+from orders.cancel import DEADLINE_KEY, cancel_expired_orders
+from orders.models import OrderInfo
+
+
+class Command(BaseCommand):
+    help = '取消超过支付期限的未支付订单; --schedule 把已有的未支付订单加入自动取消队列(上线自动取消前的订单)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--schedule', action='store_true', help='按下单时间把已有的未支付订单加入自动取消队列')
+
+    def handle(self, *args, **options):
+        if options['schedule']:
+            redis_conn = get_redis_connection('default')
+            pl = redis_conn.pipeline(transaction=False)
+            scheduled = 0
+            orders = OrderInfo.objects.filter(status=OrderInfo.ORDER_STATUS_ENUM['UNPAID'])
+            for order_id, create_time in orders.values_list('order_id', 'create_time').iterator():
+                pl.zadd(DEADLINE_KEY, {order_id: create_time.timestamp() + constants.ORDER_PAY_EXPIRES})
+                scheduled += 1
+                if scheduled % 1000 == 0:
+                    pl.execute()
+            pl.execute()
+            self.stdout.write('scheduled=%d' % scheduled)
+
+        self.stdout.write('canceled=%d' % cancel_expired_orders())
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from orders import intake
+
+
+class Command(BaseCommand):
+    help = '查看异步下单每个分片队列等待处理的任务数'
+
+    def handle(self, *args, **options):
+        depths = intake.get_depths()
+        self.stdout.write('%-12s %s' % ('queue', 'depth'))
+        for shard, depth in sorted(depths.items()):
+            self.stdout.write('%-12s %d' % (intake.queue_name(shard), depth))
+        self.stdout.write('%-12s %d' % ('total', sum(depths.values())))
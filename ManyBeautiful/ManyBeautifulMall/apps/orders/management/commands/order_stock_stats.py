@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django_redis import get_redis_connection
+
+from orders import constants
+from orders.stock import STATS_KEY, CONFLICT_SKUS_KEY
+
+EVENTS = ('conflicts', 'retries', 'resolved', 'exhausted', 'deadline', 'insufficient')
+
+
+class Command(BaseCommand):
+    help = '查看下单扣减库存的冲突与重试统计, 以及冲突最多的商品'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=10, help='显示冲突最多的商品数量')
+        parser.add_argument('--reset', action='store_true', help='显示后清空统计')
+
+    def handle(self, *args, **options):
+        redis_conn = get_redis_connection('default')
+        stats = redis_conn.hgetall(STATS_KEY)
+        for event in EVENTS:
+            self.stdout.write('%-12s %s' % (event, int(stats.get(event.encode(), 0))))
+
+        # hot: 已配置为下单分片的热门商品(ORDER_INTAKE_HOT_SKUS)
+        self.stdout.write('%-12s %-10s %s' % ('sku_id', 'conflicts', 'hot'))
+        for sku_id, count in redis_conn.zrevrange(CONFLICT_SKUS_KEY, 0, options['top'] - 1, withscores=True):
+            hot = '*' if int(sku_id) in constants.ORDER_INTAKE_HOT_SKUS else ''
+            self.stdout.write('%-12s %-10d %s' % (sku_id.decode(), count, hot))
+
+        if options['reset']:
+            redis_conn.delete(STATS_KEY, CONFLICT_SKUS_KEY)
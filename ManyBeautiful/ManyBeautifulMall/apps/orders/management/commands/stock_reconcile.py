@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from goods.models import SKU
+from orders.ledger import StockLedger, FlushInProgress
+
+# 每批检查的商品数量
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = '检查redis库存账本与tb_sku的库存是否一致'
+
+    def add_arguments(self, parser):
+        parser.add_argument('sku_ids', nargs='*', type=int, help='只检查指定的商品')
+        parser.add_argument('--fix', action='store_true', help='删除不一致的可售库存, 下次预占时按mysql的库存重新加载')
+
+    def handle(self, *args, **options):
+        ledger = StockLedger()
+        sku_ids = options['sku_ids'] or list(SKU.objects.order_by('id').values_list('id', flat=True))
+
+        drifted = 0
+        for start in range(0, len(sku_ids), BATCH_SIZE):
+            try:
+                drift = ledger.drift(sku_ids[start:start + BATCH_SIZE])
+            except FlushInProgress:
+                raise CommandError('库存同步一直在进行, 请稍后重新检查')
+            for sku_id, available, expected in drift:
+                self.stdout.write('sku_id=%s redis=%s expected=%s diff=%s' % (
+                    sku_id, available, expected, available - expected))
+            if drift and options['fix']:
+                # 不直接写入计算的值, 检查后可能已有新的预占; 删除后由加载脚本原子地重新计算
+                ledger.invalidate(*[sku_id for sku_id, available, expected in drift])
+            drifted += len(drift)
+
+        self.stdout.write('checked=%s drifted=%s%s' % (len(sku_ids), drifted, ' (fixed)' if options['fix'] else ''))
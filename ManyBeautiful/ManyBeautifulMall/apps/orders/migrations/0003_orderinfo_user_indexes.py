@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.11 on 2026-10-18 10:30
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0002_freightrule'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='orderinfo',
+            index=models.Index(fields=['user', 'create_time', 'order_id'], name='order_user_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orderinfo',
+            index=models.Index(fields=['user', 'status', 'create_time', 'order_id'], name='order_user_status_time_idx'),
+        ),
+    ]
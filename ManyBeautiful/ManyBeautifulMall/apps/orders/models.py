@@ -24,7 +24,8 @@ class OrderInfo(BaseModel):
         "UNSEND": 2,
         "UNRECEIVED": 3,
         "UNCOMMENT": 4,
-        "FINISHED": 5
+        "FINISHED": 5,
+        "CANCELED": 6
     }
 
     ORDER_STATUS_CHOICES = (  # 货运状态
@@ -49,6 +50,11 @@ class OrderInfo(BaseModel):
         db_table = "tb_order_info"
         verbose_name = '订单基本信息'
         verbose_name_plural = verbose_name
+        indexes = [
+            # 用户订单列表按(下单时间, 订单号)游标分页, 可按状态过滤
+            models.Index(fields=['user', 'create_time', 'order_id'], name='order_user_time_idx'),
+            models.Index(fields=['user', 'status', 'create_time', 'order_id'], name='order_user_status_time_idx'),
+        ]
 
 
 class OrderGoods(BaseModel):
@@ -76,3 +82,22 @@ class OrderGoods(BaseModel):
         db_table = "tb_order_goods"
         verbose_name = '订单商品'
         verbose_name_plural = verbose_name
+
+
+class FreightRule(BaseModel):
+    """
+    运费规则
+    按收货地址的区, 市, 省依次匹配, 都没有时使用未设置地区的全国默认规则
+    运费 = 首件运费 + 续件运费 * (商品总数 - 1), 商品总金额达到包邮金额时免运费
+    """
+    area = models.ForeignKey('areas.Area', null=True, blank=True, on_delete=models.CASCADE,
+                             related_name='freight_rules', verbose_name="地区")
+    first_fee = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="首件运费")
+    extra_fee = models.DecimalField(max_digits=10, decimal_places=2, default=0, verbose_name="续件运费")
+    free_amount = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True,
+                                      verbose_name="包邮金额")
+
+    class Meta:
+        db_table = "tb_freight_rule"
+        verbose_name = '运费规则'
+        verbose_name_plural = verbose_name
@@ -0,0 +1,24 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from goods.models import SKU
+from orders import constants
+from orders.freight import get_freight_calculator
+from orders.ledger import StockLedger
+from orders.models import FreightRule
+
+
+@receiver(post_save, sender=SKU)
+@receiver(post_delete, sender=SKU)
+def invalidate_stock_ledger(sender, instance, **kwargs):
+    """使用redis库存账本时, SKU新增/修改/删除后删除redis中的可售库存, 下次预占时按mysql重新加载"""
+    if constants.ORDER_STOCK_ENGINE == 'redis':
+        StockLedger().invalidate(instance.id)
+
+
+@receiver(post_save, sender=FreightRule)
+@receiver(post_delete, sender=FreightRule)
+def invalidate_freight_rules(sender, instance, **kwargs):
+    """运费规则新增/修改/删除, 事务提交后清除运费规则缓存, 避免其他进程在提交前重新缓存旧规则"""
+    transaction.on_commit(get_freight_calculator().invalidate)
@@ -0,0 +1,159 @@
+"""
+下单时扣减库存
+
+所有商品在一条UPDATE中扣减库存并增加销量, 更新的条目数少于商品数时回滚到保存点,
+加锁读取(SELECT ... FOR UPDATE)最新的库存后立即重试, 重试次数与总时间有上限.
+回滚到保存点不释放UPDATE加的行锁, 加锁读取后其他事务也不能再修改这些商品,
+在事务中等待只会让其他订单排队等锁, 因此重试前不等待
+检查方式由constants.ORDER_STOCK_CHECK指定:
+    exact: 条件为库存等于读取时的值(乐观锁)
+    gte: 条件为库存不少于购买数量, 并发下单不会互相冲突
+
+冲突, 重试等事件的次数记录在redis中, 由order_stock_stats命令查看, 一次成功的下单不访问redis
+"""
+import time
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Case, When, Value, F, IntegerField
+from django_redis import get_redis_connection
+
+from goods import counters
+from goods.models import SKU
+from goods.sku_cache import sku_cache
+from orders import constants
+
+CHECKS = ('exact', 'gte')
+
+# 统计 hash {事件: 次数}
+# conflicts: 扣减失败次数, retries: 重试次数, resolved: 重试后成功的订单数,
+# exhausted: 重试次数用完的订单数, deadline: 超时的订单数, insufficient: 库存不足的订单数
+STATS_KEY = 'order_stock_stats'
+# 发生冲突的商品 zset {sku_id: 冲突次数}
+CONFLICT_SKUS_KEY = 'order_stock_conflict_skus'
+
+
+class InsufficientStock(Exception):
+    """库存不足"""
+
+    def __init__(self, sku):
+        super().__init__(sku.id)
+        self.sku = sku
+
+
+class StockConflict(Exception):
+    """重试次数用完或超时仍未扣减成功"""
+    pass
+
+
+def _update(skus, check):
+    """
+    一条语句扣减所有商品的库存, 增加销量
+    :return: 更新的条目数
+    """
+    count_cases = [When(id=sku.id, then=Value(sku.count)) for sku in skus]
+    if check == 'gte':
+        condition = {'stock__gte': Case(*count_cases, output_field=IntegerField())}
+    else:
+        stock_cases = [When(id=sku.id, then=Value(sku.stock)) for sku in skus]
+        condition = {'stock': Case(*stock_cases, output_field=IntegerField())}
+    return SKU.objects.filter(id__in=[sku.id for sku in skus], **condition).update(
+        stock=F('stock') - Case(*count_cases, output_field=IntegerField()),
+        sales=F('sales') + Case(*count_cases, output_field=IntegerField())
+    )
+
+
+def _record(stats, conflict_skus):
+    """一次往返写入统计"""
+    if not stats:
+        return
+    pl = get_redis_connection('default').pipeline(transaction=False)
+    for event, count in stats.items():
+        pl.hincrby(STATS_KEY, event, count)
+    for sku_id, count in conflict_skus.items():
+        pl.zincrby(CONFLICT_SKUS_KEY, count, sku_id)
+    pl.execute()
+
+
+def deduct_stock(skus, deadline=None, check=None, retries=None):
+    """
+    扣减库存, 需要在事务中调用
+    :param skus: 按id排序的SKU对象列表, count属性为购买数量, stock为读取到的库存
+    :param deadline: time.monotonic()的截止时间, 默认现在起ORDER_STOCK_DEADLINE秒
+    :param check: 检查方式, 默认constants.ORDER_STOCK_CHECK
+    :param retries: 最大重试次数, 默认constants.ORDER_STOCK_RETRIES
+    :return: 重试次数
+    :raise InsufficientStock: 库存不足
+    :raise StockConflict: 重试次数用完或超时
+    """
+    check = check or constants.ORDER_STOCK_CHECK
+    if check not in CHECKS:
+        raise ValueError('未知的库存检查方式: %s' % check)
+    retries = constants.ORDER_STOCK_RETRIES if retries is None else retries
+    if deadline is None:
+        deadline = time.monotonic() + constants.ORDER_STOCK_DEADLINE
+
+    stats = Counter()
+    conflict_skus = Counter()
+    try:
+        retry = 0
+        while True:
+            for sku in skus:
+                if sku.count > sku.stock:
+                    stats['insufficient'] += 1
+                    raise InsufficientStock(sku)
+
+            save_id = transaction.savepoint()
+            if _update(skus, check) == len(skus):
+                transaction.savepoint_commit(save_id)
+                # update()不触发信号, 事务提交后清除缓存中的库存
+                sku_cache.invalidate_on_commit(*[sku.id for sku in skus])
+                if retry:
+                    stats['resolved'] += 1
+                return retry
+            transaction.savepoint_rollback(save_id)
+            stats['conflicts'] += 1
+
+            # 重新读取库存, 库存已变化的商品记为冲突
+            # 事务中的普通查询在REPEATABLE READ下仍读到事务开始时的快照, 与第一次读取相同, 条件永远不满足,
+            # 加锁读取(SELECT ... FOR UPDATE)读到已提交的最新值, 按id顺序加锁与扣减时一致
+            stocks = dict(SKU.objects.select_for_update().filter(id__in=[sku.id for sku in skus]).order_by(
+                'id').values_list('id', 'stock'))
+            for sku in skus:
+                stock = stocks.get(sku.id, 0)
+                if stock != sku.stock:
+                    conflict_skus[sku.id] += 1
+                sku.stock = stock
+
+            if retry >= retries:
+                stats['exhausted'] += 1
+                raise StockConflict()
+            if time.monotonic() > deadline:
+                stats['deadline'] += 1
+                raise StockConflict()
+            retry += 1
+            stats['retries'] += 1
+    finally:
+        _record(stats, conflict_skus)
+
+
+def restore_stock(sku_counts):
+    """
+    取消订单时归还库存并减少销量, 在调用方的事务中执行
+    每批商品一条库存/销量更新; SPU销量与下单时一样通过goods.counters在事务提交后累加负的增量,
+    不在取消事务中锁定热点SPU行
+    :param sku_counts: {sku_id: 归还的数量}
+    """
+    sku_ids = sorted(sku_counts)
+    batch_size = constants.ORDER_STOCK_FLUSH_BATCH
+    for start in range(0, len(sku_ids), batch_size):
+        batch = sku_ids[start:start + batch_size]
+        cases = Case(*[When(id=sku_id, then=Value(sku_counts[sku_id])) for sku_id in batch],
+                     output_field=IntegerField())
+        SKU.objects.filter(id__in=batch).update(stock=F('stock') + cases, sales=F('sales') - cases)
+    sku_cache.invalidate_on_commit(*sku_ids)
+
+    goods_sales = Counter()
+    for sku_id, goods_id in SKU.objects.filter(id__in=sku_ids).values_list('id', 'goods_id'):
+        goods_sales[goods_id] += sku_counts[sku_id]
+    counters.incr_on_commit('goods', 'sales', {goods_id: -count for goods_id, count in goods_sales.items()})
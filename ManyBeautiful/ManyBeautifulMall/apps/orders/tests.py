@@ -1,3 +1,53 @@
+from unittest import mock
+
+from django.db import transaction
+from django.db.models import F
 from django.test import TestCase
 
-# Create your tests here.
+from goods.models import GoodsCategory, Brand, Goods, SKU
+from orders import stock
+
+
+class DeductStockTest(TestCase):
+    """扣减库存时的冲突重试"""
+
+    def setUp(self):
+        category = GoodsCategory.objects.create(name='手机')
+        brand = Brand.objects.create(name='华为', logo='logo', first_letter='H')
+        goods = Goods.objects.create(name='华为手机', brand=brand, category1=category, category2=category,
+                                     category3=category)
+        self.sku = SKU.objects.create(name='华为 P10', caption='', goods=goods, category=category, price=10,
+                                      cost_price=5, market_price=20, stock=10)
+
+    def test_retry_after_concurrent_update(self):
+        """读取库存后其他订单扣减了库存, 重试时读到最新的库存并扣减成功"""
+        sku = SKU.objects.get(id=self.sku.id)
+        sku.count = 2
+        update = mock.Mock(side_effect=stock._update)
+
+        with mock.patch.object(stock, '_update', update), mock.patch.object(stock, '_record'):
+            with transaction.atomic():
+                # 读取库存后, 其他订单扣减了库存并已提交
+                SKU.objects.filter(id=sku.id).update(stock=F('stock') - 3)
+                retry = stock.deduct_stock([sku], check='exact', retries=3)
+
+        self.assertEqual(retry, 1)
+        self.assertEqual(update.call_count, 2)
+        self.sku.refresh_from_db()
+        self.assertEqual(self.sku.stock, 5)
+        self.assertEqual(self.sku.sales, 2)
+
+    def test_retry_without_waiting_in_transaction(self):
+        """冲突后加锁读取并立即重试, 不在持有行锁的事务中等待, 其他订单不会因此排队"""
+        sku = SKU.objects.get(id=self.sku.id)
+        sku.count = 2
+
+        with mock.patch.object(stock.time, 'sleep') as sleep, mock.patch.object(stock, '_record'):
+            with transaction.atomic():
+                SKU.objects.filter(id=sku.id).update(stock=F('stock') - 3)
+                retry = stock.deduct_stock([sku], check='exact', retries=3)
+
+        self.assertEqual(retry, 1)
+        sleep.assert_not_called()
+        self.sku.refresh_from_db()
+        self.assertEqual(self.sku.stock, 5)
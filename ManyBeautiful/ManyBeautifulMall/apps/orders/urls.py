@@ -5,6 +5,7 @@ from . import views
 urlpatterns = [
     url(r'^orders/settlement/$', views.OrderSettlementView.as_view()),
     url(r'^orders/$', views.SaveOrderView.as_view()),
+    url(r'^orders/(?P<order_id>\d+)/status/$', views.OrderStatusView.as_view()),
 
     # url(r'^/user/addresses/$', views.OrderSettlementView.as_view()),
 
@@ -0,0 +1,160 @@
+import logging
+import time
+
+from django.db import transaction
+from rest_framework.exceptions import ValidationError
+
+from carts.store import CartStore
+from goods import counters
+from goods.models import SKU
+from orders import constants
+from orders.cancel import schedule_cancel
+from orders.freight import calculate_freight
+from orders.idgen import order_id_generator
+from orders.ledger import StockLedger
+from orders.models import OrderInfo, OrderGoods
+from orders.stock import deduct_stock, InsufficientStock, StockConflict
+from users.models import Address
+
+logger = logging.getLogger('django')
+
+
+def generate_order_id():
+    """
+    生成订单编号  时间+进程编号+序号, 不访问数据库, 按字符串排序即按时间排序
+    :return: 订单编号
+    """
+    return order_id_generator.generate()
+
+
+def get_selected_cart_count(user_id):
+    """
+    获取购物车中被勾选的商品及数量, 一次原子读取数量与勾选状态
+    :param user_id: 用户id
+    :return: {sku_id: count}
+    :raise ValidationError: 没有勾选的商品
+    """
+    cart_dict = CartStore(user_id).snapshot()
+
+    cart_count = {}
+    for sku_id, value in cart_dict.items():
+        if value['selected']:
+            cart_count[sku_id] = value['count']
+
+    if not cart_count:
+        raise ValidationError('没有勾选要结算的商品')
+    return cart_count
+
+
+def place_order(user, order_id, address, pay_method, cart_count):
+    """
+    保存订单并删除购物车中已结算的商品
+    :param cart_count: 结算的商品及数量 {sku_id: count}
+    :return: 订单对象
+    """
+    # 扣减库存的截止时间
+    deadline = time.monotonic() + constants.ORDER_STOCK_DEADLINE
+
+    # 使用redis库存账本时, 库存在redis中预占, 订单提交后确认, 失败时释放
+    ledger = StockLedger() if constants.ORDER_STOCK_ENGINE == 'redis' else None
+    try:
+        order = save_order(user, order_id, address, pay_method, cart_count, deadline, ledger)
+    except Exception:
+        if ledger is not None:
+            ledger.release(order_id)
+        raise
+    if ledger is not None:
+        ledger.confirm(order_id)
+
+    # 未支付的订单超过支付期限后自动取消
+    if order.status == OrderInfo.ORDER_STATUS_ENUM['UNPAID']:
+        schedule_cancel(order_id)
+
+    # 更新redis中保存的购物车数据
+    CartStore(user.id).delete(*cart_count.keys())
+
+    return order
+
+
+def save_order(user, order_id, address, pay_method, cart_count, deadline, ledger):
+    """
+    在事务中保存订单
+    语句数量: 商品, 库存, 地址, 订单, 订单商品各一条, 与购物车条目数无关
+    SKU销量与库存在同一条语句中更新, SPU销量通过goods.counters延迟写入
+    运费与结算页使用同一个计算器
+    使用redis库存账本时不更新tb_sku与tb_goods
+    """
+    with transaction.atomic():
+
+        # 创建保存点
+        save_id = transaction.savepoint()
+
+        # 保存订单信息
+        try:
+            # 一次查询出所有商品, 按id排序, 与库存更新的加锁顺序一致, 避免死锁
+            skus = list(SKU.objects.filter(id__in=cart_count.keys()).order_by('id'))
+            if len(skus) < len(cart_count):
+                transaction.savepoint_rollback(save_id)
+                raise ValidationError('商品不存在')
+
+            for sku in skus:
+                sku.count = cart_count[sku.id]
+
+            try:
+                if ledger is not None:
+                    # 在redis中原子地预占库存, 库存与销量由任务批量写入mysql
+                    ledger.reserve(order_id, skus)
+                else:
+                    # 一条语句减少所有商品的库存, 增加销量, 冲突时有限次重试
+                    deduct_stock(skus, deadline=deadline)
+            except InsufficientStock:
+                # 不足, 回滚到保存点
+                transaction.savepoint_rollback(save_id)
+                raise ValidationError('商品库存不足')
+            except StockConflict:
+                transaction.savepoint_rollback(save_id)
+                raise ValidationError('当前购买人数过多,请稍后重试')
+
+            # 累计所有商品的数量与金额
+            total_count = sum(sku.count for sku in skus)
+            total_amount = sum(sku.price * sku.count for sku in skus)
+
+            # 创建订单信息
+            order = OrderInfo()
+            order.order_id = order_id  # 订单标号
+            order.user = user  # 下单用户
+            order.address = Address.objects.get(pk=address)  # 收获地址
+            order.total_count = total_count  # 商品总数
+            order.freight = calculate_freight(order.address, skus)  # 运费
+            order.total_amount = total_amount + order.freight  # 商品总金额(含运费)
+            order.pay_method = pay_method  # 支付方式
+            order.status = OrderInfo.ORDER_STATUS_ENUM['UNSEND'] \
+                if pay_method == OrderInfo.PAY_METHODS_ENUM['CASH'] \
+                else OrderInfo.ORDER_STATUS_ENUM['UNPAID']  # 订单状态
+            order.save(force_insert=True)
+
+            # 保存订单商品
+            OrderGoods.objects.bulk_create([
+                OrderGoods(order=order, sku=sku, count=sku.count, price=sku.price) for sku in skus
+            ])
+
+            # 累加商品的SPU销量信息, 事务提交后累加到redis计数器, 由任务批量写入, 不在事务中更新热点SPU行
+            # 使用redis库存账本时由库存账本的任务写入
+            if ledger is None:
+                goods_sales = {}
+                for sku in skus:
+                    goods_sales[sku.goods_id] = goods_sales.get(sku.goods_id, 0) + sku.count
+                counters.incr_on_commit('goods', 'sales', goods_sales)
+
+        except ValidationError:
+            raise
+        except Exception as e:
+            logger.error(e)
+            # 回滚到保存点
+            transaction.savepoint_rollback(save_id)
+            raise
+
+        # 提交事务
+        transaction.savepoint_commit(save_id)
+
+    return order
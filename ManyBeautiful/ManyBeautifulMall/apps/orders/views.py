@@ -1,11 +1,21 @@
-from django_redis import get_redis_connection
-from rest_framework.generics import CreateAPIView, ListAPIView
+import time
+
+from django.db.models import Prefetch
+from rest_framework.exceptions import ValidationError
+from rest_framework.generics import ListCreateAPIView
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from decimal import Decimal
+from rest_framework import status
+from carts.store import CartStore
 from goods.models import SKU
-from orders.serializers import OrderSettlementSerializer, SaveOrderSerializer
+from orders import constants, idempotency, intake
+from orders.freight import calculate_freight
+from orders.models import OrderInfo, OrderGoods
+from orders.serializers import OrderSettlementSerializer, SaveOrderSerializer, OrderListSerializer
+from orders.utils import generate_order_id, get_selected_cart_count
+from users.models import Address
+from utils.pagination import OrderListPagination
 
 
 # 订单结算类视图
@@ -17,8 +27,8 @@ class OrderSettlementView(APIView):
     def get(self, request):
         """
         订单结算
-        GET /orders/settlement/
-        :param request: request.user当前用户
+        GET /orders/settlement/?address=收货地址id
+        :param request: request.user当前用户, address 计算运费的收货地址, 不传时使用默认地址
         :return: {
                     "freight":"运费",
                     "skus":[   结算的商品列表
@@ -37,13 +47,10 @@ class OrderSettlementView(APIView):
         # 获取登陆的用户数据
         user = request.user
 
-        # 获取购物车中被勾选的要结算的商品信息
-        redis_conn = get_redis_connection('cart')
-        # redis_cart_id = redis_conn.hkeys('cart_%s' % user.id)  # 拿到当前用户所有购物车商品息
-        redis_cart_selected = redis_conn.smembers('cart_selected_%s' % user.id)
-        redis_cart_selected = [int(sku_id) for sku_id in redis_cart_selected]  # 拿到被勾选的商品sku_id
+        # 获取购物车中被勾选的要结算的商品信息, 一次读取数量与勾选状态
+        cart_dict = CartStore(user.id).snapshot()
 
-        # 拿到商品对应数量
+        # 拿到被勾选商品对应数量
         cart_count = {}
         """
         {
@@ -52,16 +59,23 @@ class OrderSettlementView(APIView):
             ...
         }
         """
-        for sku_id in redis_cart_selected:
-            cart_count[sku_id] = int(redis_conn.hget('cart_%s' % user.id, sku_id))
+        for sku_id, value in cart_dict.items():
+            if value['selected']:
+                cart_count[sku_id] = value['count']
 
         # 查询商品,添加数量属性
-        skus = SKU.objects.filter(pk__in=redis_cart_selected)
+        skus = list(SKU.objects.filter(pk__in=cart_count.keys()))
         for sku in skus:
             sku.count = cart_count[sku.id]
 
-        # 运费
-        freight = Decimal('10.00')
+        # 运费, 按请求指定的收货地址或默认地址计算, 与下单使用同一个计算器
+        address_id = request.query_params.get('address') or user.default_address_id
+        if not str(address_id or 0).isdigit():
+            return Response({'message': '无效的收货地址'}, status=status.HTTP_400_BAD_REQUEST)
+        address = None
+        if address_id:
+            address = Address.objects.filter(id=address_id, user=user, is_deleted=False).first()
+        freight = calculate_freight(address, skus)
 
         # 定义序列化数据格式
         context = {
@@ -73,8 +87,144 @@ class OrderSettlementView(APIView):
         return Response(serializer.data)
 
 
-# 订单保存类视图
-class SaveOrderView(CreateAPIView):
-    """订单保存类视图"""
+# 订单列表与保存类视图
+class SaveOrderView(ListCreateAPIView):
+    """订单列表与保存类视图"""
+    permission_classes = [IsAuthenticated]
+    pagination_class = OrderListPagination
+
+    def get_serializer_class(self):
+        if self.request.method == 'GET':
+            return OrderListSerializer
+        return SaveOrderSerializer
+
+    def get_queryset(self):
+        """
+        当前用户的订单, 一页的订单商品与SKU在一条查询中预取, 每页的查询次数固定
+        ?status=订单状态 过滤
+        """
+        queryset = OrderInfo.objects.filter(user=self.request.user).prefetch_related(
+            Prefetch('skus', queryset=OrderGoods.objects.select_related('sku')))
+
+        order_status = self.request.query_params.get('status')
+        if order_status:
+            if order_status not in [str(value) for value, name in OrderInfo.ORDER_STATUS_CHOICES]:
+                raise ValidationError({'message': '无效的订单状态'})
+            queryset = queryset.filter(status=order_status)
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        """
+        订单列表
+        GET /orders/?status=订单状态&page_size=每页数量&cursor=游标
+        :return: {
+                    "next": 下一页地址, 没有时为null,
+                    "results": [
+                        {
+                            "order_id": 订单号,
+                            "create_time": 下单时间,
+                            "total_count": 商品总数,
+                            "total_amount": 商品总金额(含运费),
+                            "freight": 运费,
+                            "pay_method": 支付方式,
+                            "status": 订单状态,
+                            "skus": [{"sku": {"id", "name", "default_image_url"}, "count": 数量, "price": 单价}, ...]
+                        },
+                        ......
+                    ]
+                }
+        """
+        return super().list(request, *args, **kwargs)
+
+    def create(self, request, *args, **kwargs):
+        """
+        保存订单
+        POST /orders/
+        同步下单返回 201 {"order_id": 订单号}
+        异步下单(ORDER_INTAKE_MODE = 'async')返回 202 {"order_id": 订单号, "status": "processing"},
+        结果通过 GET /orders/<order_id>/status/ 查询
+        请求头 Idempotency-Key: 客户端为一次下单生成的唯一键, 重复提交时返回第一次提交的结果
+        """
+        key = request.META.get('HTTP_IDEMPOTENCY_KEY')
+        if key is None:
+            return self.place_order(request, *args, **kwargs)
+        if not idempotency.is_valid_key(key):
+            return Response({'message': '无效的Idempotency-Key'}, status=status.HTTP_400_BAD_REQUEST)
+
+        user_id = request.user.id
+        request_fingerprint = idempotency.fingerprint(request.data)
+
+        # 第一次提交失败后键被删除, 重复的请求可以重新占用; 只在等待到键被删除时重新占用, 等待超时直接返回,
+        # 多次等待共用一个截止时间
+        deadline = time.monotonic() + constants.ORDER_IDEMPOTENCY_WAIT
+        for i in range(2):
+            acquired, record = idempotency.acquire(user_id, key, request_fingerprint)
+            if acquired:
+                break
+            if record is not None and record['fingerprint'] != request_fingerprint:
+                return Response({'message': 'Idempotency-Key已用于其他下单请求'}, status=status.HTTP_400_BAD_REQUEST)
+            if record is not None and record['state'] == idempotency.STATE_PROCESSING:
+                record = idempotency.wait(user_id, key, deadline)
+            if record is not None:
+                if record['state'] == idempotency.STATE_DONE:
+                    response = Response(record['data'], status=record['status'])
+                    response['Idempotent-Replayed'] = 'true'
+                    return response
+                return Response({'message': '订单正在提交, 请勿重复提交'}, status=status.HTTP_409_CONFLICT)
+        else:
+            return Response({'message': '订单正在提交, 请勿重复提交'}, status=status.HTTP_409_CONFLICT)
+
+        try:
+            response = self.place_order(request, *args, **kwargs)
+        except Exception:
+            idempotency.release(user_id, key)
+            raise
+        if response.status_code < 400:
+            idempotency.complete(user_id, key, request_fingerprint, response.status_code, response.data)
+        else:
+            idempotency.release(user_id, key)
+        return response
+
+    def place_order(self, request, *args, **kwargs):
+        """按ORDER_INTAKE_MODE同步保存订单或放入下单队列"""
+        if constants.ORDER_INTAKE_MODE != 'async':
+            return super().create(request, *args, **kwargs)
+
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        user = request.user
+        order_id = generate_order_id()
+        cart_count = get_selected_cart_count(user.id)
+        intake.enqueue(user, order_id, serializer.validated_data['address'],
+                       serializer.validated_data['pay_method'], cart_count)
+
+        return Response({'order_id': order_id, 'status': intake.JOB_PROCESSING}, status=status.HTTP_202_ACCEPTED)
+
+
+# 下单状态类视图
+class OrderStatusView(APIView):
+    """下单状态类视图"""
+
     permission_classes = [IsAuthenticated]
-    serializer_class = SaveOrderSerializer
+
+    def get(self, request, order_id):
+        """
+        查询下单状态
+        GET /orders/<order_id>/status/
+        :return: {
+                    "order_id": 订单号,
+                    "status": processing 处理中 / success 成功 / failed 失败,
+                    "message": 失败原因
+                }
+        """
+        job = intake.get_status(order_id)
+        if job is not None:
+            if job['user_id'] != request.user.id:
+                return Response({'message': '订单不存在'}, status=status.HTTP_404_NOT_FOUND)
+            return Response({'order_id': order_id, 'status': job['status'], 'message': job['message']})
+
+        # 同步提交或下单状态已过期的订单
+        if OrderInfo.objects.filter(order_id=order_id, user=request.user).exists():
+            return Response({'order_id': order_id, 'status': intake.JOB_SUCCESS, 'message': ''})
+        return Response({'message': '订单不存在'}, status=status.HTTP_404_NOT_FOUND)
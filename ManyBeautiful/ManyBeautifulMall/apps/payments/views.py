@@ -1,13 +1,18 @@
+import logging
 import os
 from alipay import AliPay
 from django.conf import settings
+from django.db import transaction
 from rest_framework import status
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from orders.cancel import unschedule_cancel
 from orders.models import OrderInfo
 from payments.models import Payment
 
+logger = logging.getLogger('django')
+
 
 # 支付宝支付视图类
 class PaymentView(APIView):
@@ -105,16 +110,23 @@ class PaymentStatusView(APIView):
             # 获取支付宝支付流水号
             trade_id = data.get('trade_no')  # trade_no 该交易在支付宝中的流水号
 
-            Payment.objects.create(
-                order_id=order_id,
-                trade_id=trade_id
-            )
-
-            # 修改订单状态
-            try:
-                OrderInfo.objects.filter(order_id=order_id, status=OrderInfo.ORDER_STATUS_ENUM['UNPAID']).update(status = OrderInfo.ORDER_STATUS_ENUM["UNCOMMENT"])
-            except Exception as e:
-                raise
+            with transaction.atomic():
+                # 支付宝可能重复回调, 同一流水号只记录一次
+                Payment.objects.get_or_create(trade_id=trade_id, defaults={'order_id': order_id})
+
+                # 修改订单状态, 只修改仍为待支付的订单, 与自动取消订单(orders.cancel)互斥
+                updated = OrderInfo.objects.filter(
+                    order_id=order_id, status=OrderInfo.ORDER_STATUS_ENUM['UNPAID']
+                ).update(status=OrderInfo.ORDER_STATUS_ENUM["UNCOMMENT"])
+
+            if updated:
+                # 已支付的订单不再自动取消
+                unschedule_cancel(order_id)
+            elif OrderInfo.objects.filter(
+                    order_id=order_id, status=OrderInfo.ORDER_STATUS_ENUM['CANCELED']).exists():
+                # 超过支付期限已自动取消的订单, 保留支付记录用于退款
+                logger.error('已取消的订单收到支付 order_id=%s trade_id=%s, 需要退款' % (order_id, trade_id))
+                return Response({'message': '订单已超时取消, 支付款项将退回'}, status=status.HTTP_400_BAD_REQUEST)
 
             return Response({'trade_id': trade_id})
 
@@ -0,0 +1,38 @@
+"""
+离线压测使用的配置, 由scripts/bench_checkout.py加载
+mysql换成SQLite内存数据库, redis换成进程内的fakeredis, 其余配置与dev相同
+依赖: fakeredis[lua]
+"""
+import fakeredis
+
+from .dev import *  # noqa
+
+ALLOWED_HOSTS = ['*']
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+    }
+}
+
+# 所有缓存别名共用一个fakeredis服务器, 各自使用LOCATION中的库号
+# connection_class可由压测脚本替换为统计往返次数的子类
+FAKE_REDIS_SERVER = fakeredis.FakeServer()
+for _alias in CACHES:
+    CACHES[_alias]['OPTIONS']['CONNECTION_POOL_KWARGS'] = {
+        'connection_class': fakeredis.FakeConnection,
+        'server': FAKE_REDIS_SERVER,
+    }
+
+# 不连接Elasticsearch
+HAYSTACK_CONNECTIONS = {
+    'default': {
+        'ENGINE': 'haystack.backends.simple_backend.SimpleEngine',
+    },
+}
+HAYSTACK_SIGNAL_PROCESSOR = 'haystack.signals.BaseSignalProcessor'
+
+# 压测时只输出警告以上的日志
+LOGGING['handlers']['console']['level'] = 'WARNING'
+LOGGING['handlers']['file']['level'] = 'WARNING'
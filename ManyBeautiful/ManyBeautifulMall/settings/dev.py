@@ -187,7 +187,29 @@ CACHES = {
             "CLIENT_CLASS": "django_redis.client.DefaultClient",
         }
     },
+    "sku": {  # 商品SKU摘要缓存
+        "BACKEND": "django_redis.cache.RedisCache",
+        "LOCATION": "redis://127.0.0.1:6379/5",
+        "OPTIONS": {
+            "CLIENT_CLASS": "django_redis.client.DefaultClient",
+        }
+    },
+    "stock": {  # 库存预占账本
+        "BACKEND": "django_redis.cache.RedisCache",
+        "LOCATION": "redis://127.0.0.1:6379/6",
+        "OPTIONS": {
+            "CLIENT_CLASS": "django_redis.client.DefaultClient",
+        }
+    },
 }
+# 登录用户购物车在redis中的存储结构
+# split: cart_<user_id> hash保存数量 + cart_selected_<user_id> set保存勾选状态
+# packed: cart_items_<user_id> 一个hash同时保存数量与勾选状态
+CART_REDIS_LAYOUT = 'split'
+
+# 购物车redis库的内存预算(字节), 超出时归档任务继续按最后访问时间从旧到新归档购物车, None表示不限制
+CART_REDIS_MAX_MEMORY = 512 * 1024 * 1024
+
 # 设置session的保存方案
 # 指定session使用缓存进行保存,缓存保存在redis中
 SESSION_ENGINE = "django.contrib.sessions.backends.cache"
@@ -323,6 +345,8 @@ CRONJOBS_URL = os.path.join(os.path.dirname(BASE_DIR), 'logs/crontab.log')
 CRONJOBS = [
     # 每1分钟执行一次生成主页静态文件
     ('*/1 * * * *', 'contents.crons.generate_index_html', '>> ' + CRONJOBS_URL),
+    # 每天凌晨3点归档长期未访问的购物车
+    ('0 3 * * *', 'carts.crons.archive_idle_carts', '>> ' + CRONJOBS_URL),
 ]
 # 解决crontab中文问题
 CRONTAB_COMMAND_PREFIX = 'LANG_ALL=zh_cn.UTF-8'
@@ -337,6 +361,13 @@ HAYSTACK_CONNECTIONS = {
         'INDEX_NAME': 'md_mall',
     },
 }
+# 不部署Elasticsearch时可以使用进程内的搜索引擎, 索引保存在本地目录, 各进程共用
+# HAYSTACK_CONNECTIONS = {
+#     'default': {
+#         'ENGINE': 'utils.embedded_search.backend.EmbeddedSearchEngine',
+#         'PATH': os.path.join(os.path.dirname(BASE_DIR), 'search_index'),
+#     },
+# }
 # 当添加、修改、删除数据时，自动生成索引  es自动重建索引
 # 保证了在Django运行起来后，有新的数据产生时，haystack仍然可以让Elasticsearch实时生成新数据的索引
 HAYSTACK_SIGNAL_PROCESSOR = 'haystack.signals.RealtimeSignalProcessor'
@@ -0,0 +1,9 @@
+"""
+进程内的搜索引擎(haystack后端), Elasticsearch不可用时或开发/测试环境使用
+
+tokenizer  中文二元组分词
+store      文档库(sqlite)
+segment    只读的倒排索引文件, mmap打开, 各进程共享
+index      索引目录: 热替换索引文件, 内存中的补充索引, 查询
+backend    haystack的Engine/Backend/Query
+"""
@@ -0,0 +1,149 @@
+"""
+haystack的进程内搜索引擎, 不需要Elasticsearch
+
+配置:
+    HAYSTACK_CONNECTIONS = {
+        'default': {
+            'ENGINE': 'utils.embedded_search.backend.EmbeddedSearchEngine',
+            'PATH': 索引目录, 所有进程使用同一个目录,
+            'REFRESH_INTERVAL': 检查新索引文件的间隔(秒), 默认1,
+        },
+    }
+python manage.py rebuild_index / update_index 写入文档, 保存模型时由HAYSTACK_SIGNAL_PROCESSOR实时写入,
+写入的文档先由各进程补充到内存索引, 索引文件由定时任务build_search_index(celery beat)重新建立,
+批量导入后可以执行 python manage.py build_search_index 立即建立
+查询的多个词都要匹配, 按BM25分数排序
+"""
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from haystack import connections
+from haystack.backends import BaseEngine, BaseSearchBackend, BaseSearchQuery, SearchNode, log_query
+from haystack.constants import DJANGO_CT, DJANGO_ID, ID
+from haystack.exceptions import SkipDocument
+from haystack.inputs import PythonData
+from haystack.models import SearchResult
+from haystack.utils import get_identifier, get_model_ct
+
+from .index import get_index, REFRESH_INTERVAL
+
+
+class EmbeddedSearchBackend(BaseSearchBackend):
+    """进程内的搜索引擎, 索引保存在PATH目录中"""
+
+    def __init__(self, connection_alias, **connection_options):
+        super().__init__(connection_alias, **connection_options)
+        if 'PATH' not in connection_options:
+            raise ImproperlyConfigured("You must specify a 'PATH' in your settings for connection '%s'."
+                                       % connection_alias)
+        self.path = connection_options['PATH']
+        self.refresh_interval = connection_options.get('REFRESH_INTERVAL', REFRESH_INTERVAL)
+
+    @property
+    def index(self):
+        content_field = connections[self.connection_alias].get_unified_index().document_field
+        return get_index(self.path, content_field, self.refresh_interval)
+
+    def update(self, indexer, iterable, commit=True):
+        documents = []
+        for obj in iterable:
+            try:
+                documents.append(indexer.full_prepare(obj))
+            except SkipDocument:
+                pass
+        if documents:
+            self.index.update(documents)
+
+    def remove(self, obj_or_string, commit=True):
+        self.index.remove([get_identifier(obj_or_string)])
+
+    def clear(self, models=None, commit=True):
+        self.index.clear([get_model_ct(model) for model in models] if models else None)
+
+    @log_query
+    def search(self, query_string, start_offset=0, end_offset=None, models=None, result_class=None, **kwargs):
+        if not query_string:
+            return {'results': [], 'hits': 0}
+
+        django_cts = None
+        if models:
+            django_cts = set(get_model_ct(model) for model in models)
+        elif kwargs.get('limit_to_registered_models',
+                        getattr(settings, 'HAYSTACK_LIMIT_TO_REGISTERED_MODELS', True)):
+            django_cts = set(get_model_ct(model) for model in
+                             connections[self.connection_alias].get_unified_index().get_indexed_models())
+
+        index = self.index
+        if query_string == '*':
+            hits, matches = index.match_all(django_cts, start_offset, end_offset)
+        else:
+            hits, matches = index.search(query_string, django_cts, start_offset, end_offset)
+
+        # 结果的字段从文档库读取
+        documents = index.store.get_many([doc_id for doc_id, score in matches])
+        result_class = result_class or SearchResult
+        results = []
+        for doc_id, score in matches:
+            data = documents.get(doc_id)
+            if data is None:
+                continue
+            app_label, model_name = data[DJANGO_CT].split('.')
+            stored = {key: value for key, value in data.items() if key not in (ID, DJANGO_CT, DJANGO_ID)}
+            results.append(result_class(app_label, model_name, data[DJANGO_ID], score, **stored))
+
+        return {
+            'results': results,
+            'hits': hits,
+            'facets': {},
+            'spelling_suggestion': None,
+        }
+
+    def more_like_this(self, model_instance, additional_query_string=None, start_offset=0, end_offset=None,
+                       limit_to_registered_models=None, result_class=None, **kwargs):
+        return {'results': [], 'hits': 0}
+
+    def prep_value(self, db_field, value):
+        return value
+
+
+def build_search_indexes(force=False):
+    """
+    重新建立所有使用EmbeddedSearchEngine的连接的索引文件
+    :param force: 是否不论变化多少都建立
+    :return: {连接名: 是否建立}
+    """
+    result = {}
+    for alias in connections.connections_info:
+        backend = connections[alias].get_backend()
+        if isinstance(backend, EmbeddedSearchBackend):
+            result[alias] = backend.index.build() if force else backend.index.maybe_build()
+    return result
+
+
+class EmbeddedSearchQuery(BaseSearchQuery):
+    """查询条件中的所有值拼接为查询文本, 由分词器切分"""
+
+    def build_query(self):
+        if not self.query_filter:
+            return '*'
+        return self._build_sub_query(self.query_filter)
+
+    def _build_sub_query(self, search_node):
+        term_list = []
+        for child in search_node.children:
+            if isinstance(child, SearchNode):
+                term_list.append(self._build_sub_query(child))
+            else:
+                value = child[1]
+                if not hasattr(value, 'input_type_name'):
+                    value = PythonData(value)
+                term_list.append(value.prepare(self))
+        return ' '.join(str(term) for term in term_list)
+
+    def clean(self, query_fragment):
+        """不需要转义, 分词时忽略标点"""
+        return query_fragment
+
+
+class EmbeddedSearchEngine(BaseEngine):
+    backend = EmbeddedSearchBackend
+    query = EmbeddedSearchQuery
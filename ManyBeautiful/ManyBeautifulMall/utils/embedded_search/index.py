@@ -0,0 +1,374 @@
+"""
+索引目录
+
+目录中的文件:
+    documents.sqlite3    文档库(store.DocumentStore)
+    segment_<序号>.mbsi  索引文件(segment), 建立后不再修改
+    CURRENT              当前使用的索引文件名, 建立新的索引文件后原子替换
+
+各进程每隔REFRESH_INTERVAL秒检查CURRENT, 变化时打开新的索引文件(热替换, 不需要重启),
+再读取文档库中序号大于索引文件序号的变化, 在内存中建立补充索引(Delta), 查询时合并两者的结果
+
+文档库中未进入索引文件的变化超过 max(DELTA_MIN, 索引文档数 * DELTA_RATIO) 时重新建立索引文件,
+批量导入时重建的次数按比例增长, 总的建立代价与文档数成正比.
+建立需要读取全部文档, 不在写入文档的请求中进行, 由定时任务(celery_tasks.search.tasks.build_search_index)
+或 python manage.py build_search_index 检查并建立
+"""
+import fcntl
+import heapq
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from itertools import compress, repeat
+from operator import add
+
+from . import tokenizer
+from .segment import Segment, write_segment, bm25, idf, find_position
+from .store import DocumentStore
+
+CURRENT = 'CURRENT'
+LOCK = 'build.lock'
+
+DELTA_MIN = 1000
+DELTA_RATIO = 0.25
+REFRESH_INTERVAL = 1
+
+
+class Delta(object):
+    """内存中的补充索引, 保存索引文件建立后新增/修改的文档, 以及需要从索引文件中排除的文档"""
+
+    def __init__(self, segment):
+        self.seq = segment.seq
+        self.removed = set()  # 已修改或删除的索引文件中的文档下标
+        self.docs = {}  # {doc_id: (django_ct, 词数, Counter)}
+        self.inverted = {}  # {词: {doc_id: 词频}}
+
+    def apply(self, segment, changes, content_field):
+        for doc_id, django_ct, data, seq in changes:
+            position = segment.find_doc(doc_id)
+            if position >= 0:
+                self.removed.add(position)
+            old = self.docs.pop(doc_id, None)
+            if old is not None:
+                for term in old[2]:
+                    postings = self.inverted[term]
+                    del postings[doc_id]
+                    if not postings:
+                        del self.inverted[term]
+            if data is not None:
+                terms, length = tokenizer.index_terms(data.get(content_field) or '')
+                self.docs[doc_id] = (django_ct, length, terms)
+                for term, tf in terms.items():
+                    self.inverted.setdefault(term, {})[doc_id] = tf
+            self.seq = seq
+
+    def search(self, segment, groups, django_cts=None):
+        """
+        :param groups: tokenizer.query_terms的结果, 所有词都要匹配
+        :return: {doc_id: 分数}
+        """
+        if not self.docs:
+            return {}
+        doc_count = segment.doc_count - len(self.removed) + len(self.docs)
+        average_length = segment.average_length if segment.doc_count else (
+            sum(doc[1] for doc in self.docs.values()) / len(self.docs) or 1.0)
+
+        result = None
+        for term, prefix in groups:
+            if prefix:
+                terms = [t for t in self.inverted if t.startswith(term)]
+            else:
+                terms = [term] if term in self.inverted else []
+            scores = {}
+            for t in terms:
+                postings = self.inverted[t]
+                index = segment.find_term(t)
+                df = len(postings) + (segment.term_starts[index + 1] - segment.term_starts[index] if index >= 0 else 0)
+                idf_value = idf(doc_count, df)
+                for doc_id, tf in postings.items():
+                    score = bm25(idf_value, tf, self.docs[doc_id][1], average_length)
+                    if score > scores.get(doc_id, 0):
+                        scores[doc_id] = score
+            if result is None:
+                result = scores
+            else:
+                result = {doc_id: score + scores[doc_id] for doc_id, score in result.items() if doc_id in scores}
+            if not result:
+                return {}
+
+        if django_cts is not None:
+            result = {doc_id: score for doc_id, score in result.items() if self.docs[doc_id][0] in django_cts}
+        return result
+
+
+def _top_by_threshold(postings, matched, limit):
+    """
+    多个词都很常见时求前limit个(threshold algorithm), 不计算所有匹配文档的分数:
+    依次读取每个词分数第1, 2, ...高的文档, 二分查找其他词的分数得到总分,
+    未读到的文档总分不超过 各词当前位置的分数之和(threshold) 时结束.
+    最高分的下标中分数相同的按文档下标从小到大, 总分等于threshold的未读到文档,
+    下标一定大于各词当前位置的文档下标, 排在分数相同的已读文档之后
+    :param postings: [(文档下标, 分数, 最高分的下标)]
+    :param matched: 匹配所有词且未排除的文档下标集合
+    :return: [(总分, 文档下标)], 读完保存的最高分仍不能确定时返回None
+    """
+    seen = set()
+    best = []  # 最高的limit个 (总分, -文档下标), 最小堆, best[0]为其中排名最后的
+    for depth in range(min(len(top) for docs, scores, top in postings)):
+        threshold = 0
+        last_position = 0
+        for docs, scores, top in postings:
+            i = top[depth]
+            position = docs[i]
+            threshold += scores[i]
+            last_position = max(last_position, position)
+            if position in seen or position not in matched:
+                continue
+            seen.add(position)
+            item = (sum(other_scores[bisect_left(other_docs, position)] for other_docs, other_scores, other_top
+                        in postings), -position)
+            if len(best) < limit:
+                heapq.heappush(best, item)
+            elif item > best[0]:
+                heapq.heapreplace(best, item)
+        if len(best) == limit and (best[0][0] > threshold or
+                                   (best[0][0] == threshold and -best[0][1] <= last_position)):
+            return [(total, -negative) for total, negative in sorted(best, reverse=True)]
+    return None
+
+
+def _union(segment, indexes):
+    """前缀匹配的多个词, 合并为 (文档下标, 分数), 每个文档取最高分"""
+    merged = {}
+    for index in indexes:
+        docs, scores = segment.postings(index)
+        for position, score in zip(docs, scores):
+            if score > merged.get(position, 0):
+                merged[position] = score
+    positions = sorted(merged)
+    return array('I', positions), array('H', [merged[position] for position in positions]), None
+
+
+def search_segment(segment, groups, removed, allowed_cts=None, limit=None):
+    """
+    在索引文件中查询, 所有词都要匹配, 分数为各词分数之和
+    :param removed: 排除的文档下标
+    :param allowed_cts: 允许的模型下标, None为不限
+    :param limit: 返回分数最高的数量, None为全部
+    :return: (匹配的文档数, [(分数, 文档下标)] 按分数从高到低, 分数相同时文档下标小的在前)
+    """
+    postings = []  # [(文档下标, 分数, 最高分的下标或None)], 都按文档下标排序
+    for term, prefix in groups:
+        indexes = segment.prefix_terms(term) if prefix else [segment.find_term(term)]
+        if not indexes or indexes[0] < 0:
+            return 0, []
+        if len(indexes) == 1:
+            postings.append(segment.postings(indexes[0]) + (segment.top(indexes[0]),))
+        else:
+            postings.append(_union(segment, indexes))
+    postings.sort(key=lambda item: len(item[0]))
+    scale = segment.scale
+
+    # 只有一个词时使用建立时排好的最高分
+    if len(postings) == 1 and allowed_cts is None and limit is not None:
+        docs, scores, top = postings[0]
+        if top is not None and limit + len(removed) <= len(top):
+            results = []
+            for i in top:
+                if docs[i] not in removed:
+                    results.append((scores[i] * scale, docs[i]))
+                    if len(results) == limit:
+                        break
+            hits = len(docs) - sum(1 for position in removed if find_position(docs, position) >= 0)
+            return hits, results
+
+    # memoryview逐个读取较慢, 先转为list
+    postings = [(docs.tolist(), scores.tolist(), top) for docs, scores, top in postings]
+
+    # 匹配的文档: 集合求交集
+    matched = set(postings[0][0])
+    for docs, scores, top in postings[1:]:
+        matched.intersection_update(docs)
+    matched -= removed
+    if allowed_cts is not None:
+        doc_cts = segment.doc_cts
+        matched = set(position for position in matched if doc_cts[position] in allowed_cts)
+    if not matched:
+        return 0, []
+    hits = len(matched)
+
+    if (len(postings) > 1 and limit is not None and hits > limit * 16 and
+            all(top is not None for docs, scores, top in postings)):
+        results = _top_by_threshold(postings, matched, limit)
+        if results is not None:
+            return hits, [(total * scale, position) for total, position in results]
+
+    # 计算所有匹配文档的总分, 匹配的少时二分查找, 多时转为字典; 逐个文档的循环都在map中完成
+    positions = sorted(matched)
+    totals = repeat(0)
+    for docs, scores, top in postings:
+        if len(positions) * 16 < len(docs):
+            term_scores = map(scores.__getitem__, map(bisect_left, repeat(docs), positions))
+        else:
+            term_scores = map(dict(zip(docs, scores)).__getitem__, positions)
+        totals = list(map(add, totals, term_scores))
+
+    # 只对不低于第limit高的总分的文档排序, 分数相同时文档下标小的在前
+    if limit is not None and limit < len(totals):
+        lowest = sorted(totals, reverse=True)[limit - 1]
+        results = sorted(compress(zip(totals, positions), map(lowest.__le__, totals)),
+                         key=lambda item: (-item[0], item[1]))[:limit]
+    else:
+        results = sorted(zip(totals, positions), key=lambda item: (-item[0], item[1]))
+    return hits, [(total * scale, position) for total, position in results]
+
+
+class SearchIndex(object):
+    """一个索引目录, 同一进程中的所有线程共用"""
+
+    def __init__(self, path, content_field='text', refresh_interval=REFRESH_INTERVAL):
+        self.path = path
+        self.content_field = content_field
+        self.refresh_interval = refresh_interval
+        self.store = DocumentStore(path)
+        self._lock = threading.Lock()
+        self._segment = None
+        self._segment_name = None
+        self._delta = None
+        self._checked = 0
+
+    def _current_name(self):
+        try:
+            with open(os.path.join(self.path, CURRENT)) as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def refresh(self, force=False):
+        """
+        检查是否有新的索引文件与文档变化
+        :return: (Segment, Delta)
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._segment is not None and not force and now - self._checked < self.refresh_interval:
+                return self._segment, self._delta
+            self._checked = now
+
+            name = self._current_name()
+            if name is None:
+                self.build()
+                name = self._current_name()
+            if name != self._segment_name:
+                # 旧的索引文件在不再被引用后由mmap释放
+                self._segment = Segment(os.path.join(self.path, name))
+                self._segment_name = name
+                self._delta = Delta(self._segment)
+
+            if self.store.max_seq() > self._delta.seq:
+                self._delta.apply(self._segment, self.store.changes_since(self._delta.seq), self.content_field)
+            return self._segment, self._delta
+
+    def build(self, wait=True):
+        """
+        由文档库的全部文档建立新的索引文件并替换CURRENT
+        :param wait: 其他进程正在建立时是否等待, 不等待时直接返回False
+        :return: 是否建立
+        """
+        with open(os.path.join(self.path, LOCK), 'w') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | (0 if wait else fcntl.LOCK_NB))
+            except BlockingIOError:
+                return False
+            old_name = self._current_name()
+            with self.store.snapshot() as (seq, documents):
+                name = 'segment_%d_%d.mbsi' % (seq, int(time.time() * 1000))
+                write_segment(os.path.join(self.path, name), seq, documents, self.content_field)
+
+            tmp_filename = os.path.join(self.path, CURRENT + '.tmp')
+            with open(tmp_filename, 'w') as f:
+                f.write(name)
+            os.replace(tmp_filename, os.path.join(self.path, CURRENT))
+
+            # 保留上一个索引文件, 其他进程在下次检查前仍可能使用; 更早的墓碑已不再需要
+            for filename in os.listdir(self.path):
+                if filename.startswith('segment_') and filename not in (name, old_name):
+                    os.remove(os.path.join(self.path, filename))
+            if old_name is not None:
+                self.store.purge(int(old_name.split('_')[1]))
+        return True
+
+    def maybe_build(self):
+        """
+        未进入索引文件的变化过多时重新建立, 由定时任务调用
+        :return: 是否建立
+        """
+        segment, delta = self.refresh(force=True)
+        if self.store.count_since(segment.seq) > max(DELTA_MIN, segment.doc_count * DELTA_RATIO):
+            return self.build(wait=False)
+        return False
+
+    def update(self, documents):
+        """写入文档库, 各进程下次检查时补充到内存索引"""
+        self.store.put(documents)
+
+    def remove(self, doc_ids):
+        self.store.delete(doc_ids)
+
+    def clear(self, django_cts=None):
+        self.store.clear(django_cts)
+        self.build()
+
+    def search(self, query_string, django_cts=None, start=0, end=None):
+        """
+        :param django_cts: 只返回这些模型的文档, None为不限
+        :return: (匹配的文档数, [(doc_id, 分数)] 第start到end条)
+        """
+        groups = tokenizer.query_terms(query_string)
+        if not groups:
+            return 0, []
+        segment, delta = self.refresh()
+
+        allowed_cts = None
+        if django_cts is not None:
+            allowed_cts = set(i for i, ct in enumerate(segment.cts) if ct in django_cts)
+            if len(allowed_cts) == len(segment.cts):
+                allowed_cts = None
+
+        delta_scores = delta.search(segment, groups, django_cts)
+        base_hits, base_top = search_segment(segment, groups, delta.removed, allowed_cts, end)
+
+        results = [(score, segment.doc_id(position)) for score, position in base_top]
+        results.extend((score, doc_id) for doc_id, score in delta_scores.items())
+        results.sort(key=lambda item: (-item[0], item[1]))
+        return base_hits + len(delta_scores), [(doc_id, score) for score, doc_id in results[start:end]]
+
+    def match_all(self, django_cts=None, start=0, end=None):
+        """
+        不带查询词时按doc_id顺序返回所有文档
+        :return: (文档数, [(doc_id, 0)])
+        """
+        segment, delta = self.refresh()
+        positions = [position for position in range(segment.doc_count) if position not in delta.removed and (
+            django_cts is None or segment.cts[segment.doc_cts[position]] in django_cts)]
+        doc_ids = [doc_id for doc_id, doc in sorted(delta.docs.items()) if django_cts is None or doc[0] in django_cts]
+        hits = len(positions) + len(doc_ids)
+        page = [segment.doc_id(position) for position in positions[start:end]]
+        if end is None or end > len(positions):
+            page.extend(doc_ids[max(start - len(positions), 0):None if end is None else end - len(positions)])
+        return hits, [(doc_id, 0) for doc_id in page]
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(path, content_field='text', refresh_interval=REFRESH_INTERVAL):
+    """同一进程中同一目录只打开一次"""
+    with _indexes_lock:
+        index = _indexes.get(path)
+        if index is None:
+            index = _indexes[path] = SearchIndex(path, content_field, refresh_interval)
+        return index
@@ -0,0 +1,271 @@
+"""
+索引文件
+
+建立后不再修改的倒排索引, 各进程以只读mmap打开, 同一个文件的内存页由所有进程共享
+文件结构(小端):
+    b'MBSI' + 头部长度(uint32) + 头部json: 文档数, 词数, 平均文档长度, 分数的比例, 建立时文档库的序号, 模型列表, 各段的偏移
+    doc_offsets   uint32[文档数 + 1]  文档id(utf-8, 按字节排序)在doc_ids中的起止位置
+    doc_ids       bytes
+    doc_cts       uint16[文档数]      文档的模型在模型列表中的下标
+    doc_lengths   uint32[文档数]      文档的词数
+    term_offsets  uint32[词数 + 1]    词(utf-8, 按字节排序)在terms中的起止位置
+    terms         bytes
+    term_starts   uint32[词数 + 1]    词的倒排列表在post_docs中的起止位置
+    top_starts    uint32[词数 + 1]    词的前TOP_SIZE个最高分在tops中的起止位置, 只有文档数超过TOP_SIZE的词有
+    tops          uint32[]           按分数从高到低排列的倒排列表下标
+    post_docs     uint32[]           每个词的倒排列表: 包含该词的文档下标, 从小到大
+    post_scores   uint16[]           与post_docs对应的BM25分数, 乘以头部的scale为实际分数
+BM25分数只与词频, 文档长度和词的文档数有关, 建立时计算好, 查询时只需要相加
+"""
+import json
+import math
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+
+from . import tokenizer
+
+MAGIC = b'MBSI'
+VERSION = 1
+
+# BM25参数
+K1 = 1.2
+B = 0.75
+
+# 文档数超过该值的词保存分数最高的文档, 单个词的查询不用对整个倒排列表排序
+TOP_SIZE = 256
+
+# 各段的顺序与类型
+SECTIONS = (
+    ('doc_offsets', 'I'),
+    ('doc_ids', 'B'),
+    ('doc_cts', 'H'),
+    ('doc_lengths', 'I'),
+    ('term_offsets', 'I'),
+    ('terms', 'B'),
+    ('term_starts', 'I'),
+    ('top_starts', 'I'),
+    ('tops', 'I'),
+    ('post_docs', 'I'),
+    ('post_scores', 'H'),
+)
+
+
+def idf(doc_count, df):
+    return math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+
+
+def bm25(idf_value, tf, length, average_length):
+    return idf_value * tf * (K1 + 1) / (tf + K1 * (1 - B + B * length / average_length))
+
+
+def _to_bytes(values):
+    """array转为小端字节"""
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def write_segment(filename, seq, documents, content_field):
+    """
+    建立索引文件
+    :param seq: 文档库的序号
+    :param documents: 按doc_id排序的 (doc_id, django_ct, data) 迭代器
+    :param content_field: data中被搜索的文本字段
+    :return: 文档数
+    """
+    doc_ids = []
+    doc_cts = array('H')
+    doc_lengths = array('I')
+    cts = []
+    ct_index = {}
+    # {词: (文档下标 array, 词频 array)}
+    inverted = {}
+
+    for position, (doc_id, django_ct, data) in enumerate(documents):
+        doc_ids.append(doc_id.encode())
+        if django_ct not in ct_index:
+            ct_index[django_ct] = len(cts)
+            cts.append(django_ct)
+        doc_cts.append(ct_index[django_ct])
+        terms, length = tokenizer.index_terms(data.get(content_field) or '')
+        doc_lengths.append(length)
+        for term, tf in terms.items():
+            item = inverted.get(term)
+            if item is None:
+                item = inverted[term] = (array('I'), array('H'))
+            item[0].append(position)
+            item[1].append(min(tf, 65535))
+
+    doc_count = len(doc_ids)
+    average_length = (sum(doc_lengths) / doc_count) if doc_count else 1.0
+    average_length = average_length or 1.0
+
+    # 计算分数, 按最高分量化为uint16
+    terms = sorted(inverted, key=lambda term: term.encode())
+    term_scores = []
+    max_score = 0.0
+    for term in terms:
+        positions, tfs = inverted[term]
+        idf_value = idf(doc_count, len(positions))
+        scores = [bm25(idf_value, tf, doc_lengths[position], average_length) for position, tf in zip(positions, tfs)]
+        term_scores.append(scores)
+        max_score = max(max_score, max(scores))
+    scale = (max_score / 65535) or 1.0
+
+    sections = {name: array(typecode) for name, typecode in SECTIONS}
+    sections['doc_offsets'].append(0)
+    for doc_id in doc_ids:
+        sections['doc_ids'].frombytes(doc_id)
+        sections['doc_offsets'].append(len(sections['doc_ids']))
+    sections['doc_cts'] = doc_cts
+    sections['doc_lengths'] = doc_lengths
+
+    sections['term_offsets'].append(0)
+    sections['term_starts'].append(0)
+    sections['top_starts'].append(0)
+    for term, scores in zip(terms, term_scores):
+        sections['terms'].frombytes(term.encode())
+        sections['term_offsets'].append(len(sections['terms']))
+        quantized = [max(1, int(round(score / scale))) for score in scores]
+        sections['post_docs'].extend(inverted.pop(term)[0])
+        sections['post_scores'].extend(quantized)
+        sections['term_starts'].append(len(sections['post_docs']))
+        if len(quantized) > TOP_SIZE:
+            top = sorted(range(len(quantized)), key=lambda i: -quantized[i])[:TOP_SIZE]
+            sections['tops'].extend(top)
+        sections['top_starts'].append(len(sections['tops']))
+
+    header = {
+        'version': VERSION,
+        'doc_count': doc_count,
+        'term_count': len(terms),
+        'average_length': average_length,
+        'scale': scale,
+        'seq': seq,
+        'cts': cts,
+        'sections': {},
+    }
+    # 头部长度固定后计算各段的偏移, 每段按8字节对齐
+    payloads = [(name, _to_bytes(sections[name])) for name, typecode in SECTIONS]
+    header_size = 4096
+    while True:
+        offset = header_size
+        for name, payload in payloads:
+            header['sections'][name] = [offset, len(payload)]
+            offset += (len(payload) + 7) // 8 * 8
+        header_bytes = json.dumps(header).encode()
+        if len(MAGIC) + 4 + len(header_bytes) <= header_size:
+            break
+        header_size *= 2
+
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'wb') as f:
+        f.write(MAGIC + struct.pack('<I', len(header_bytes)) + header_bytes)
+        for name, payload in payloads:
+            f.seek(header['sections'][name][0])
+            f.write(payload)
+        f.truncate(offset)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_filename, filename)
+    return doc_count
+
+
+class Segment(object):
+    """只读打开的索引文件"""
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:4] != MAGIC:
+            raise ValueError('不是索引文件: %s' % filename)
+        header_length = struct.unpack('<I', self._mm[4:8])[0]
+        header = json.loads(self._mm[8:8 + header_length].decode())
+        if header['version'] != VERSION:
+            raise ValueError('索引文件版本不支持: %s' % filename)
+
+        self.doc_count = header['doc_count']
+        self.term_count = header['term_count']
+        self.average_length = header['average_length']
+        self.scale = header['scale']
+        self.seq = header['seq']
+        self.cts = header['cts']
+
+        view = memoryview(self._mm)
+        for name, typecode in SECTIONS:
+            offset, size = header['sections'][name]
+            section = view[offset:offset + size]
+            setattr(self, name, section if typecode == 'B' else section.cast(typecode))
+
+    def doc_id(self, position):
+        return bytes(self.doc_ids[self.doc_offsets[position]:self.doc_offsets[position + 1]]).decode()
+
+    def _term(self, index):
+        return bytes(self.terms[self.term_offsets[index]:self.term_offsets[index + 1]])
+
+    def _lower_bound(self, key, count, get):
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            if get(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def find_doc(self, doc_id):
+        """
+        :return: 文档下标, 不存在时为-1
+        """
+        key = doc_id.encode()
+        get = lambda i: bytes(self.doc_ids[self.doc_offsets[i]:self.doc_offsets[i + 1]])  # noqa: E731
+        position = self._lower_bound(key, self.doc_count, get)
+        return position if position < self.doc_count and get(position) == key else -1
+
+    def find_term(self, term):
+        """
+        :return: 词的下标, 不存在时为-1
+        """
+        key = term.encode()
+        index = self._lower_bound(key, self.term_count, self._term)
+        return index if index < self.term_count and self._term(index) == key else -1
+
+    def prefix_terms(self, prefix):
+        """
+        :return: 以prefix开头的词的下标范围 range
+        """
+        key = prefix.encode()
+        start = self._lower_bound(key, self.term_count, self._term)
+        end = start
+        while end < self.term_count and self._term(end).startswith(key):
+            end += 1
+        return range(start, end)
+
+    def postings(self, index):
+        """
+        :return: (文档下标, 分数), 按文档下标从小到大
+        """
+        start, end = self.term_starts[index], self.term_starts[index + 1]
+        return self.post_docs[start:end], self.post_scores[start:end]
+
+    def top(self, index):
+        """
+        :return: 分数最高的TOP_SIZE个文档在倒排列表中的下标, 文档数不超过TOP_SIZE时为None
+        """
+        start, end = self.top_starts[index], self.top_starts[index + 1]
+        return self.tops[start:end] if end > start else None
+
+
+def find_position(docs, position):
+    """
+    :param docs: 按文档下标排序的倒排列表
+    :return: 文档position在docs中的下标, 不存在时为-1
+    """
+    i = bisect_left(docs, position)
+    return i if i < len(docs) and docs[i] == position else -1
@@ -0,0 +1,147 @@
+"""
+文档库
+
+haystack写入的文档(full_prepare的结果)保存在索引目录的 documents.sqlite3 中, 是建立索引文件的数据来源,
+也用于读取搜索结果的字段, 多个进程通过sqlite的锁同时读写
+
+每次写入/删除分配递增的序号seq, 删除的文档保留data为NULL的记录(墓碑), 用于从旧的索引文件中排除,
+索引文件记录建立时的序号, 序号更大的文档由各进程在内存中补充(index.Delta)
+"""
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS documents (
+        doc_id TEXT PRIMARY KEY,
+        django_ct TEXT NOT NULL,
+        data TEXT,
+        seq INTEGER NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS documents_seq ON documents (seq);
+    CREATE TABLE IF NOT EXISTS meta (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    );
+    INSERT OR IGNORE INTO meta (name, value) VALUES ('seq', 0);
+"""
+
+# 一条语句中IN的参数个数, 不超过sqlite的限制
+IN_BATCH_SIZE = 500
+
+
+class DocumentStore(object):
+    """索引目录中的文档库, 每个线程使用自己的sqlite连接"""
+
+    def __init__(self, path, timeout=30):
+        self.filename = os.path.join(path, 'documents.sqlite3')
+        self.timeout = timeout
+        self._local = threading.local()
+        os.makedirs(path, exist_ok=True)
+        self.connection.executescript(SCHEMA)
+
+    @property
+    def connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            # isolation_level=None: 自行控制事务
+            connection = sqlite3.connect(self.filename, timeout=self.timeout, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def _write(self, rows):
+        """
+        :param rows: [(doc_id, django_ct, data或None)]
+        :return: 写入后的序号
+        """
+        connection = self.connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            seq = connection.execute("SELECT value FROM meta WHERE name = 'seq'").fetchone()[0]
+            for doc_id, django_ct, data in rows:
+                seq += 1
+                connection.execute(
+                    'INSERT OR REPLACE INTO documents (doc_id, django_ct, data, seq) VALUES (?, ?, ?, ?)',
+                    (doc_id, django_ct, data, seq))
+            connection.execute("UPDATE meta SET value = ? WHERE name = 'seq'", (seq,))
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return seq
+
+    def put(self, documents):
+        """
+        写入文档
+        :param documents: full_prepare的结果列表, 包含id, django_ct
+        """
+        return self._write([(doc['id'], doc['django_ct'], json.dumps(doc, ensure_ascii=False, default=str))
+                            for doc in documents])
+
+    def _select_in(self, sql, values):
+        values = list(values)
+        rows = []
+        for start in range(0, len(values), IN_BATCH_SIZE):
+            batch = values[start:start + IN_BATCH_SIZE]
+            rows.extend(self.connection.execute(sql % ','.join('?' * len(batch)), batch))
+        return rows
+
+    def delete(self, doc_ids):
+        rows = self._select_in('SELECT doc_id, django_ct FROM documents WHERE data IS NOT NULL AND doc_id IN (%s)',
+                               doc_ids)
+        return self._write([(doc_id, django_ct, None) for doc_id, django_ct in rows])
+
+    def clear(self, django_cts=None):
+        """删除全部文档或指定模型的文档"""
+        if django_cts is None:
+            rows = self.connection.execute('SELECT doc_id, django_ct FROM documents WHERE data IS NOT NULL').fetchall()
+        else:
+            rows = self._select_in(
+                'SELECT doc_id, django_ct FROM documents WHERE data IS NOT NULL AND django_ct IN (%s)', django_cts)
+        return self._write([(doc_id, django_ct, None) for doc_id, django_ct in rows])
+
+    def max_seq(self):
+        return self.connection.execute("SELECT value FROM meta WHERE name = 'seq'").fetchone()[0]
+
+    def count_since(self, seq):
+        return self.connection.execute('SELECT COUNT(*) FROM documents WHERE seq > ?', (seq,)).fetchone()[0]
+
+    def changes_since(self, seq):
+        """
+        :return: 序号大于seq的文档 [(doc_id, django_ct, data或None, seq)], 按序号排序
+        """
+        rows = self.connection.execute(
+            'SELECT doc_id, django_ct, data, seq FROM documents WHERE seq > ? ORDER BY seq', (seq,))
+        return [(doc_id, django_ct, json.loads(data) if data is not None else None, doc_seq)
+                for doc_id, django_ct, data, doc_seq in rows]
+
+    @contextmanager
+    def snapshot(self):
+        """
+        在一个读事务中逐条读取所有文档, 读取期间其他进程的写入不可见
+        :return: (序号, 迭代器 (doc_id, django_ct, data)), 按doc_id排序
+        """
+        connection = self.connection
+        connection.execute('BEGIN')
+        try:
+            seq = self.max_seq()
+            rows = connection.execute(
+                'SELECT doc_id, django_ct, data FROM documents WHERE data IS NOT NULL ORDER BY doc_id')
+            yield seq, ((doc_id, django_ct, json.loads(data)) for doc_id, django_ct, data in rows)
+        finally:
+            connection.execute('COMMIT')
+
+    def get_many(self, doc_ids):
+        """
+        :return: {doc_id: data}, 不存在或已删除的文档不返回
+        """
+        rows = self._select_in('SELECT doc_id, data FROM documents WHERE data IS NOT NULL AND doc_id IN (%s)', doc_ids)
+        return {doc_id: json.loads(data) for doc_id, data in rows}
+
+    def purge(self, seq):
+        """删除序号不大于seq的墓碑, 所有进程使用的索引文件都已不包含这些文档"""
+        self.connection.execute('DELETE FROM documents WHERE data IS NULL AND seq <= ?', (seq,))
@@ -0,0 +1,54 @@
+"""
+分词
+
+文本先做NFKC规范化(全角转半角)并转为小写, 然后切分为:
+    连续的汉字: 相邻两个字组成一个词(二元组), 最后一个字单独作为一个词
+        "双卡双待" -> 双卡, 卡双, 双待, 待
+    连续的字母数字: 一个词
+        "6GB+64GB" -> 6gb, 64gb
+查询时多个汉字按二元组匹配, 只有一个汉字时匹配所有以该字开头的词(前缀), 包括单独的字
+"""
+import re
+import unicodedata
+from collections import Counter
+
+TOKEN_PATTERN = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+|[a-z0-9]+')
+
+
+def _is_cjk(token):
+    return token[0] > '\x7f'
+
+
+def _runs(text):
+    return TOKEN_PATTERN.findall(unicodedata.normalize('NFKC', text).lower())
+
+
+def index_terms(text):
+    """
+    :return: (Counter {词: 出现次数}, 词的总数)
+    """
+    terms = Counter()
+    for run in _runs(text):
+        if _is_cjk(run):
+            for i in range(len(run) - 1):
+                terms[run[i:i + 2]] += 1
+            terms[run[-1]] += 1
+        else:
+            terms[run] += 1
+    return terms, sum(terms.values())
+
+
+def query_terms(text):
+    """
+    :return: [(词, 是否按前缀匹配)], 去重并保持顺序
+    """
+    terms = []
+    for run in _runs(text):
+        if _is_cjk(run) and len(run) == 1:
+            terms.append((run, True))
+        elif _is_cjk(run):
+            terms.extend((run[i:i + 2], False) for i in range(len(run) - 1))
+        else:
+            terms.append((run, False))
+    seen = set()
+    return [term for term in terms if not (term in seen or seen.add(term))]
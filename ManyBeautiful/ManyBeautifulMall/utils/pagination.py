@@ -1,4 +1,17 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import datetime
+import decimal
+import hashlib
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django_redis import get_redis_connection
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 
 # 分页配置
@@ -6,5 +19,168 @@ class SKUListPagination(PageNumberPagination):
     """分页配置类"""
     page_size = 5
     page_size_query_param = 'page_size'
-    # max_page_size = 3
+    max_page_size = 20
+
+
+# 游标(keyset)分页
+class KeysetPagination(BasePagination):
+    """
+    按排序字段的值翻页的游标分页, 查询条件为 (字段1, 字段2, ...) < 上一页最后一条的值, 不使用OFFSET与COUNT,
+    翻到第几页查询代价都相同, 需要排序字段上的联合索引
+    返回 {"next": 下一页地址, 没有时为null, "results": [...]}
+    设置count_query_param后, 请求中 count=1 时返回 "count": 总数, 总数在redis中缓存count_cache_expires秒, 是近似值
+    """
+    # 排序字段, 最后一个字段必须唯一
+    ordering = ('-create_time', '-pk')
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 50
+    cursor_query_param = 'cursor'
+    count_query_param = None
+    count_cache_expires = 60
+    invalid_cursor_message = '无效的游标'
+
+    def get_ordering(self, request, view=None):
+        return self.ordering
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def decode_cursor(self, request):
+        """
+        :return: 上一页最后一条记录的排序字段值列表, 第一页为None
+        """
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        except (TypeError, ValueError, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+        # 游标只能用于生成它的排序
+        if not isinstance(data, dict) or data.get('o') != ','.join(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        values = data.get('v')
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return values
+
+    def encode_cursor(self, instance):
+        values = []
+        for field in self.ordering:
+            value = getattr(instance, field.lstrip('-'))
+            if isinstance(value, datetime.datetime):
+                value = value.isoformat()
+            elif isinstance(value, decimal.Decimal):
+                value = str(value)
+            values.append(value)
+        data = {'o': ','.join(self.ordering), 'v': values}
+        return base64.urlsafe_b64encode(json.dumps(data, separators=(',', ':')).encode()).decode()
+
+    def keyset_filter(self, values):
+        """
+        (字段1, 字段2, ...) < (值1, 值2, ...) 展开为
+        字段1 < 值1 or (字段1 = 值1 and 字段2 < 值2) or ...
+        升序的字段使用 >
+        """
+        condition = Q()
+        equal = {}
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip('-')
+            lookup = '%s__lt' % name if field.startswith('-') else '%s__gt' % name
+            condition |= Q(**equal) & Q(**{lookup: value})
+            equal[name] = value
+        return condition
+
+    def get_count(self, queryset):
+        """
+        近似总数, 同一查询的COUNT结果在redis中缓存, 缓存期间的增减不反映在总数中
+        """
+        queryset = queryset.order_by()
+        key = 'pagination_count_%s' % hashlib.md5(str(queryset.query).encode()).hexdigest()
+        redis_conn = get_redis_connection('default')
+        count = redis_conn.get(key)
+        if count is not None:
+            return int(count)
+        count = queryset.count()
+        redis_conn.setex(key, self.count_cache_expires, count)
+        return count
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = tuple(self.get_ordering(request, view))
+        page_size = self.get_page_size(request)
+
+        self.count = None
+        if self.count_query_param and request.query_params.get(self.count_query_param) in ('1', 'true'):
+            self.count = self.get_count(queryset)
+
+        queryset = queryset.order_by(*self.ordering)
+        values = self.decode_cursor(request)
+        if values is not None:
+            try:
+                queryset = queryset.filter(self.keyset_filter(values))
+            except (TypeError, ValueError, ValidationError, decimal.InvalidOperation):
+                raise NotFound(self.invalid_cursor_message)
+
+        # 多取一条判断是否有下一页
+        page = list(queryset[:page_size + 1])
+        self.next_cursor = self.encode_cursor(page[page_size - 1]) if len(page) > page_size else None
+        return page[:page_size]
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        items = [('next', self.get_next_link()), ('results', data)]
+        if self.count is not None:
+            items.insert(0, ('count', self.count))
+        return Response(OrderedDict(items))
+
+
+# 订单列表分页配置
+class OrderListPagination(KeysetPagination):
+    """订单列表按(下单时间, 订单号)倒序翻页, 对应tb_order_info的(user_id, create_time, order_id)联合索引"""
+    ordering = ('-create_time', '-order_id')
+    page_size = 5
+
+
+# 类别SKU列表分页配置
+class SKUCursorPagination(KeysetPagination):
+    """
+    类别SKU列表按 (排序字段, id) 翻页, ?ordering= create_time / price / sales, 前加 - 为降序, 默认 -create_time
+    请求中有 page 参数时使用原来的页码分页(SKUListPagination), 返回 {"count", "next", "previous", "results"}
+    """
+    orderings = ('create_time', 'price', 'sales')
+    default_ordering = '-create_time'
+    ordering_param = 'ordering'
+    page_size = 5
+    max_page_size = 20
+    count_query_param = 'count'
+    page_query_param = 'page'
+
+    def get_ordering(self, request, view=None):
+        ordering = request.query_params.get(self.ordering_param) or self.default_ordering
+        if ordering.lstrip('-') not in self.orderings:
+            ordering = self.default_ordering
+        # id保证排序唯一, 与排序字段同方向, 可以使用同一个联合索引
+        return ordering, '-id' if ordering.startswith('-') else 'id'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.page_query_param in request.query_params:
+            self.page_paginator = SKUListPagination()
+            return self.page_paginator.paginate_queryset(queryset, request, view)
+        self.page_paginator = None
+        return super().paginate_queryset(queryset, request, view)
 
+    def get_paginated_response(self, data):
+        if self.page_paginator is not None:
+            return self.page_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -1,6 +1,38 @@
 # 指定代理人
 broker_url = 'redis://127.0.0.1:6379/15'
 
+# 异步下单(ORDER_INTAKE_MODE = 'async')的任务放入分片队列orders_0 ~ orders_<ORDER_INTAKE_SHARDS - 1>,
+# 每个分片队列由一个单并发的worker消费, 例如:
+#     celery -A celery_tasks.main worker -Q orders_0 -c 1 -n orders_0@%h
+
+# 定时任务, 使用celery beat启动
+beat_schedule = {
+    # redis库存账本(ORDER_STOCK_ENGINE = 'redis')
+    'flush-stock-ledger': {
+        'task': 'flush_stock_ledger',
+        'schedule': 5.0,
+    },
+    'expire-stock-reservations': {
+        'task': 'expire_stock_reservations',
+        'schedule': 30.0,
+    },
+    # SPU销量的延迟写入
+    'flush-counters': {
+        'task': 'flush_counters',
+        'schedule': 10.0,
+    },
+    # 自动取消超时未支付的订单
+    'cancel-expired-orders': {
+        'task': 'cancel_expired_orders',
+        'schedule': 10.0,
+    },
+    # 进程内搜索引擎(EmbeddedSearchEngine)的索引文件重建
+    'build-search-index': {
+        'task': 'build_search_index',
+        'schedule': 60.0,
+    },
+}
+
 
 
 
@@ -0,0 +1,12 @@
+# 商品计数器的定时任务
+from celery_tasks.main import app
+from goods import counters
+
+
+@app.task(name='flush_counters')
+def flush_counters():
+    """
+    把redis中累加的SPU销量增量批量写入mysql
+    :return: {'表.字段': 更新的条目数}
+    """
+    return counters.flush()
@@ -18,6 +18,10 @@ app.config_from_object('celery_tasks.config')
 app.autodiscover_tasks([
     'celery_tasks.sms',
     'celery_tasks.email',
+    'celery_tasks.stock',
+    'celery_tasks.orders',
+    'celery_tasks.counters',
+    'celery_tasks.search',
 ])
 
 
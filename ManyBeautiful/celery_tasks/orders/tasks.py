@@ -0,0 +1,49 @@
+# 异步下单任务
+import logging
+
+from rest_framework.exceptions import ValidationError
+
+from celery_tasks.main import app
+from orders import intake
+from orders.cancel import cancel_expired_orders as cancel_due_orders
+from orders.models import OrderInfo
+from orders.utils import place_order as save_user_order
+from users.models import User
+
+logger = logging.getLogger('django')
+
+
+@app.task(name='place_order')
+def place_order(order_id, user_id, address, pay_method, cart_items, shard):
+    """
+    保存异步提交的订单, 结果写入下单状态
+    :param cart_items: 结算的商品及数量 [(sku_id, count), ...]
+    :param shard: 分片号
+    """
+    intake.dequeue(order_id, shard)
+
+    # 任务重复投递时订单已保存
+    if OrderInfo.objects.filter(order_id=order_id).exists():
+        intake.set_status(order_id, intake.JOB_SUCCESS)
+        return
+
+    try:
+        user = User.objects.get(id=user_id)
+        save_user_order(user, order_id, address, pay_method, {int(sku_id): count for sku_id, count in cart_items})
+    except ValidationError as e:
+        detail = e.detail[0] if isinstance(e.detail, list) else e.detail
+        intake.set_status(order_id, intake.JOB_FAILED, str(detail))
+    except Exception as e:
+        logger.error(e)
+        intake.set_status(order_id, intake.JOB_FAILED, '下单失败')
+    else:
+        intake.set_status(order_id, intake.JOB_SUCCESS)
+
+
+@app.task(name='cancel_expired_orders')
+def cancel_expired_orders():
+    """
+    取消超过支付期限的未支付订单, 归还库存
+    :return: 取消的订单数
+    """
+    return cancel_due_orders()
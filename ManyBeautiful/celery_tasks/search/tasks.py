@@ -0,0 +1,12 @@
+# 进程内搜索引擎的定时任务
+from celery_tasks.main import app
+from utils.embedded_search.backend import build_search_indexes
+
+
+@app.task(name='build_search_index')
+def build_search_index():
+    """
+    文档变化过多时重新建立进程内搜索引擎的索引文件, 不使用该引擎时不做任何事
+    :return: {连接名: 是否建立}
+    """
+    return build_search_indexes()
@@ -0,0 +1,21 @@
+# redis库存账本的定时任务
+from celery_tasks.main import app
+from orders.ledger import StockLedger
+
+
+@app.task(name='flush_stock_ledger')
+def flush_stock_ledger():
+    """
+    把redis中已确认的库存扣减批量写入mysql
+    :return: 写入的商品数
+    """
+    return StockLedger().flush()
+
+
+@app.task(name='expire_stock_reservations')
+def expire_stock_reservations():
+    """
+    处理过期未确认的库存预占
+    :return: (确认数, 释放数)
+    """
+    return StockLedger().expire_reservations()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+"""
+功能：对比购物车cookie新旧编解码(carts.codec / utils.myjson)的耗时与cookie长度
+使用方法:
+    ./bench_cart_cookie.py [重复次数]
+"""
+import os
+import sys
+import timeit
+
+# 设置导包路径
+BASE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'ManyBeautifulMall')
+sys.path.insert(0, os.path.join(BASE_DIR, 'apps'))
+sys.path.insert(0, BASE_DIR)
+
+from django.conf import settings
+
+settings.configure(SECRET_KEY='bench-cart-cookie')
+
+from carts import codec
+from utils import myjson
+
+SIZES = (1, 5, 10, 20, 50, 100, 200)
+
+
+def make_cart(size):
+    """生成size条商品的购物车字典"""
+    return {
+        sku_id: {'count': sku_id % 9 + 1, 'selected': sku_id % 3 != 0}
+        for sku_id in range(10001, 10001 + size)
+    }
+
+
+def bench(number):
+    print('%5s | %12s %12s | %12s %12s | %8s %8s' % (
+        'items', 'pickle enc', 'codec enc', 'pickle dec', 'codec dec', 'pickle B', 'codec B'))
+
+    for size in SIZES:
+        cart = make_cart(size)
+        legacy_str = myjson.dumps(cart)
+        codec_str = codec.dumps(cart)
+        assert dict(codec.loads(codec_str)) == cart
+        assert dict(codec.loads(legacy_str)) == cart
+
+        row = []
+        for func, arg in ((myjson.dumps, cart), (codec.dumps, cart), (myjson.loads, legacy_str),
+                          (codec.loads, codec_str)):
+            # 单次耗时, 微秒
+            row.append(min(timeit.repeat(lambda: func(arg), number=number, repeat=3)) / number * 1e6)
+
+        print('%5d | %10.1fus %10.1fus | %10.1fus %10.1fus | %8d %8d' % (
+            size, row[0], row[1], row[2], row[3], len(legacy_str), len(codec_str)))
+
+
+if __name__ == '__main__':
+    bench(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+"""
+功能：离线压测购物车与下单接口
+    使用SQLite内存数据库与fakeredis(settings/bench.py), 直接调用CartView, CartSelectAllView,
+    OrderSettlementView, SaveOrderView, 统计每个接口的延迟分位数,
+    以及每次请求的数据库查询次数, redis往返次数与命令数
+依赖: fakeredis[lua]
+使用方法:
+    ./bench_checkout.py [--skus 1000] [--lines 20] [--requests 200] [--layout split] [--cold-cache]
+    ./bench_checkout.py --save-baseline bench_checkout_baseline.json  保存每个接口的查询/往返次数
+    ./bench_checkout.py --check bench_checkout_baseline.json          任一接口的查询/往返次数超过基线时以状态码1退出
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+# 设置导包路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ManyBeautifulMall.settings.bench')
+
+import django
+import fakeredis
+from django.conf import settings
+
+
+class CountingConnection(fakeredis.FakeConnection):
+    """统计redis往返次数(一次send_packed_command, 管道也只算一次)与命令数"""
+    round_trips = 0
+    commands = 0
+
+    def send_packed_command(self, command, *args, **kwargs):
+        CountingConnection.round_trips += 1
+        return super().send_packed_command(command, *args, **kwargs)
+
+    def pack_command(self, *args):
+        CountingConnection.commands += 1
+        return super().pack_command(*args)
+
+
+for _alias in settings.CACHES:
+    settings.CACHES[_alias]['OPTIONS']['CONNECTION_POOL_KWARGS']['connection_class'] = CountingConnection
+django.setup()
+
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django_redis import get_redis_connection
+from rest_framework.test import APIRequestFactory
+from rest_framework_jwt.settings import api_settings
+
+from areas.models import Area
+from carts import codec
+from carts.store import CartStore
+from carts.views import CartView, CartSelectAllView
+from goods.models import GoodsCategory, Brand, Goods, SKU
+from goods.sku_cache import sku_cache
+from orders.views import OrderSettlementView, SaveOrderView
+from users.models import User, Address
+
+# 统计指标, 回归检查时比较每个接口单次请求的最大值
+METRICS = ('db_queries', 'redis_round_trips')
+
+
+def seed(sku_count, user_count):
+    """
+    建表并生成商品与用户数据
+    :return: (sku_id列表, [(user, address, jwt token), ...])
+    """
+    call_command('migrate', verbosity=0)
+
+    province = Area.objects.create(name='省')
+    city = Area.objects.create(name='市', parent=province)
+    district = Area.objects.create(name='区', parent=city)
+
+    category = GoodsCategory.objects.create(name='类别')
+    brand = Brand.objects.create(name='品牌', logo='', first_letter='P')
+    goods_list = Goods.objects.bulk_create([
+        Goods(name='商品%d' % i, brand=brand, category1=category, category2=category, category3=category)
+        for i in range(max(sku_count // 10, 1))
+    ])
+    goods_list = list(Goods.objects.all())
+    SKU.objects.bulk_create([
+        SKU(name='SKU%d' % i, caption='', goods=goods_list[i % len(goods_list)], category=category,
+            price=10 + i % 500, cost_price=1, market_price=1000, stock=10 ** 7)
+        for i in range(sku_count)
+    ], batch_size=500)
+    sku_ids = list(SKU.objects.values_list('id', flat=True))
+
+    User.objects.bulk_create([
+        User(username='bench%d' % i, mobile='1%010d' % i) for i in range(user_count)
+    ])
+    users = list(User.objects.order_by('id'))
+    Address.objects.bulk_create([
+        Address(user=user, title='家', receiver='bench', province=province, city=city, district=district,
+                place='地址', mobile=user.mobile) for user in users
+    ])
+    addresses = {address.user_id: address for address in Address.objects.all()}
+
+    jwt_payload_handler = api_settings.JWT_PAYLOAD_HANDLER
+    jwt_encode_handler = api_settings.JWT_ENCODE_HANDLER
+    return sku_ids, [(user, addresses[user.id], jwt_encode_handler(jwt_payload_handler(user))) for user in users]
+
+
+def fill_cart(user_id, cart_sku_ids):
+    """把商品全部勾选加入登录用户的购物车"""
+    CartStore(user_id).batch([
+        {'action': 'add', 'sku_id': sku_id, 'count': 1, 'selected': True} for sku_id in cart_sku_ids
+    ])
+
+
+def percentile(values, percent):
+    """最近秩法计算分位数"""
+    values = sorted(values)
+    index = max(int(round(percent / 100.0 * len(values))) - 1, 0)
+    return values[index]
+
+
+class Bench(object):
+    """压测执行器"""
+
+    def __init__(self, options):
+        self.options = options
+        self.factory = APIRequestFactory()
+        self.results = {}
+
+        # 每次下单使用不同的用户, 下单后购物车中已结算的商品被删除
+        user_count = options.requests + options.warmup + 1
+        self.sku_ids, self.users = seed(options.skus, user_count)
+        random.seed(0)
+        self.cart_sku_ids = random.sample(self.sku_ids, min(options.lines, len(self.sku_ids)))
+        for user, address, token in self.users:
+            fill_cart(user.id, self.cart_sku_ids)
+        self.cookie_cart = codec.dumps({
+            sku_id: {'count': 1, 'selected': True} for sku_id in self.cart_sku_ids
+        })
+
+    def request(self, method, path, token=None, data=None, cookie=None):
+        extra = {}
+        if token is not None:
+            extra['HTTP_AUTHORIZATION'] = 'JWT ' + token
+        request = getattr(self.factory, method)(path, data, format='json', **extra)
+        if cookie is not None:
+            request.COOKIES['cart'] = cookie
+        return request
+
+    def scenarios(self):
+        """
+        压测场景 {名称: 每次调用返回(视图, 请求)的函数}
+        请求在计时之外构造, 下单场景每次使用一个新用户
+        """
+        user, address, token = self.users[0]
+        order_users = iter(self.users[1:])
+        cart_view = CartView.as_view()
+
+        def save_order():
+            order_user, order_address, order_token = next(order_users)
+            return SaveOrderView.as_view(), self.request(
+                'post', '/orders/', order_token, {'address': order_address.id, 'pay_method': 2})
+
+        return {
+            'cart_get': lambda: (cart_view, self.request('get', '/cart/', token)),
+            'cart_get_guest': lambda: (cart_view, self.request('get', '/cart/', cookie=self.cookie_cart)),
+            'cart_add': lambda: (cart_view, self.request(
+                'post', '/cart/', token, {'sku_id': random.choice(self.cart_sku_ids), 'count': 1})),
+            'cart_select_all': lambda: (CartSelectAllView.as_view(), self.request(
+                'put', '/cart/selection/', token, {'selected': True})),
+            'settlement': lambda: (OrderSettlementView.as_view(), self.request('get', '/orders/settlement/', token)),
+            'save_order': save_order,
+        }
+
+    def clear_cache(self):
+        """清空SKU摘要缓存, 测量缓存未命中时的查询次数"""
+        sku_cache.clear_local()
+        get_redis_connection('sku').flushdb()
+
+    def run_one(self, name, make_request, record):
+        view, request = make_request()
+        if self.options.cold_cache:
+            self.clear_cache()
+
+        round_trips, commands = CountingConnection.round_trips, CountingConnection.commands
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = view(request)
+            response.render()
+            elapsed = time.perf_counter() - start
+
+        if response.status_code >= 400:
+            raise RuntimeError('%s 请求失败: %s %s' % (name, response.status_code, response.data))
+        if record:
+            result = self.results.setdefault(name, {
+                'latency': [], 'db_queries': [], 'redis_round_trips': [], 'redis_commands': []})
+            result['latency'].append(elapsed * 1000)
+            result['db_queries'].append(len(queries))
+            result['redis_round_trips'].append(CountingConnection.round_trips - round_trips)
+            result['redis_commands'].append(CountingConnection.commands - commands)
+
+    def run(self):
+        for name, make_request in self.scenarios().items():
+            for i in range(self.options.warmup):
+                self.run_one(name, make_request, record=False)
+            for i in range(self.options.requests):
+                self.run_one(name, make_request, record=True)
+        return self.results
+
+    def report(self):
+        print('skus=%s lines=%s requests=%s layout=%s cold_cache=%s' % (
+            self.options.skus, self.options.lines, self.options.requests, self.options.layout,
+            self.options.cold_cache))
+        print('%-16s | %8s %8s %8s %8s | %6s %9s %9s' % (
+            'endpoint', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms', 'db', 'redis rt', 'redis cmd'))
+        for name, result in self.results.items():
+            latency = result['latency']
+            print('%-16s | %8.2f %8.2f %8.2f %8.2f | %6d %9d %9d' % (
+                name, percentile(latency, 50), percentile(latency, 90), percentile(latency, 99), max(latency),
+                max(result['db_queries']), max(result['redis_round_trips']), max(result['redis_commands'])))
+
+    def baseline(self):
+        return {
+            'params': {'lines': self.options.lines, 'layout': self.options.layout,
+                       'cold_cache': self.options.cold_cache},
+            'endpoints': {
+                name: {metric: max(result[metric]) for metric in METRICS}
+                for name, result in self.results.items()
+            },
+        }
+
+
+def check(current, baseline):
+    """
+    对比基线, 任一接口的查询/往返次数增加即为回归
+    :return: 回归说明列表
+    """
+    regressions = []
+    for name, metrics in baseline['endpoints'].items():
+        for metric, value in metrics.items():
+            now = current['endpoints'].get(name, {}).get(metric)
+            if now is not None and now > value:
+                regressions.append('%s %s: %s -> %s' % (name, metric, value, now))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='购物车与下单接口离线压测')
+    parser.add_argument('--skus', type=int, default=1000, help='商品SKU数量')
+    parser.add_argument('--lines', type=int, default=20, help='购物车商品条目数')
+    parser.add_argument('--requests', type=int, default=200, help='每个接口的请求次数')
+    parser.add_argument('--warmup', type=int, default=5, help='每个接口不计入统计的预热请求次数')
+    parser.add_argument('--layout', choices=('split', 'packed'), default=settings.CART_REDIS_LAYOUT,
+                        help='redis购物车存储结构')
+    parser.add_argument('--cold-cache', action='store_true', help='每次请求前清空SKU摘要缓存')
+    parser.add_argument('--save-baseline', metavar='FILE', help='保存查询/往返次数基线')
+    parser.add_argument('--check', metavar='FILE', help='与基线对比, 有回归时以状态码1退出')
+    options = parser.parse_args()
+
+    baseline = None
+    if options.check:
+        with open(options.check) as f:
+            baseline = json.load(f)
+        # 次数与购物车条目数, 存储结构有关, 使用基线的参数
+        options.lines = baseline['params']['lines']
+        options.layout = baseline['params']['layout']
+        options.cold_cache = baseline['params']['cold_cache']
+    settings.CART_REDIS_LAYOUT = options.layout
+
+    bench = Bench(options)
+    bench.run()
+    bench.report()
+    current = bench.baseline()
+
+    if options.save_baseline:
+        with open(options.save_baseline, 'w') as f:
+            json.dump(current, f, indent=4, sort_keys=True)
+        print('基线已保存: %s' % options.save_baseline)
+
+    if baseline is not None:
+        regressions = check(current, baseline)
+        if regressions:
+            print('查询/往返次数回归:')
+            for regression in regressions:
+                print('    ' + regression)
+            sys.exit(1)
+        print('未发现查询/往返次数回归')
+
+
+if __name__ == '__main__':
+    main()
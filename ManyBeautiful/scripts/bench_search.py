@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+"""
+功能：压测进程内搜索引擎(utils.embedded_search)
+    生成随机的商品标题写入临时索引目录, 建立索引文件, 统计查询延迟的分位数,
+    以及写入少量修改(补充索引)后的查询延迟
+不需要Django与数据库
+使用方法:
+    ./bench_search.py [--docs 300000] [--queries 2000] [--delta 500] [--path /tmp/bench_search]
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import time
+
+# 设置导包路径
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'ManyBeautifulMall'))
+
+from utils.embedded_search.index import SearchIndex
+
+BRANDS = ['华为 HUAWEI', '小米', 'Apple', 'OPPO', 'vivo', '荣耀', '联想', '戴尔 DELL', '三星 Samsung', '魅族', '索尼 SONY',
+          '海尔', '美的', '格力', '惠普 HP', '华硕 ASUS', '一加', '中兴', '努比亚', 'realme']
+PRODUCTS = ['手机', '笔记本电脑', '平板电脑', '蓝牙耳机', '智能手表', '液晶电视', '冰箱', '空调', '洗衣机', '显示器',
+            '路由器', '移动电源', '游戏本', '台式机', '充电器', '键盘', '鼠标', '音箱', '相机', '投影仪']
+COLOURS = ['黑色', '白色', '金色', '银色', '玫瑰金', '深空灰', '星河银', '亮黑色', '极光蓝', '宝石红', '钻雕金', '幻夜黑']
+SPECS = ['4GB+64GB', '6GB+128GB', '8GB+256GB', '12GB+512GB', '13.3英寸', '15.6英寸', '55英寸', '65英寸', '1.5匹',
+         '变频', '全网通', '双卡双待', '4G', '5G', 'i5', 'i7', '512G固态', '1TB']
+CAPTIONS = ['限时特惠', '新品上市', '赠送原装耳机', '分期免息', '官方正品', '全国联保', '超长续航', '快充', '徕卡双摄',
+            '高清屏幕', '轻薄便携', '游戏性能强劲', '一级能效', '静音节能', '支持以旧换新']
+
+
+def random_document(i):
+    text = '%s %s%d %s %s %s\n%s %s' % (
+        random.choice(BRANDS), random.choice(['', 'Pro ', 'Plus ', 'Max ']), random.randint(1, 30),
+        random.choice(SPECS), random.choice(COLOURS), random.choice(PRODUCTS),
+        random.choice(CAPTIONS), random.choice(CAPTIONS))
+    return {'id': 'goods.sku.%d' % i, 'django_ct': 'goods.sku', 'django_id': str(i), 'text': text}
+
+
+def random_query():
+    kind = random.random()
+    if kind < 0.4:
+        return random.choice(PRODUCTS)
+    if kind < 0.7:
+        return '%s %s' % (random.choice(BRANDS).split()[0], random.choice(PRODUCTS))
+    if kind < 0.9:
+        return '%s %s %s' % (random.choice(BRANDS).split()[0], random.choice(COLOURS), random.choice(PRODUCTS))
+    return random.choice(SPECS)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def run_queries(index, count, page_size=6):
+    timings = []
+    hits = []
+    for i in range(count):
+        query = random_query()
+        start = random.choice([0, 0, 0, page_size, page_size * 4])
+        begin = time.perf_counter()
+        hit_count, results = index.search(query, {'goods.sku'}, start, start + page_size)
+        timings.append((time.perf_counter() - begin) * 1000)
+        hits.append(hit_count)
+    return timings, hits
+
+
+def report(name, timings, hits):
+    print('%-14s | p50 %6.2fms  p90 %6.2fms  p99 %6.2fms  max %6.2fms | 平均命中 %d' % (
+        name, percentile(timings, 50), percentile(timings, 90), percentile(timings, 99), max(timings),
+        sum(hits) // len(hits)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='进程内搜索引擎压测')
+    parser.add_argument('--docs', type=int, default=300000, help='文档数')
+    parser.add_argument('--queries', type=int, default=2000, help='查询次数')
+    parser.add_argument('--delta', type=int, default=500, help='建立索引文件后修改的文档数')
+    parser.add_argument('--path', default='/tmp/bench_search', help='临时索引目录, 会被清空')
+    args = parser.parse_args()
+
+    random.seed(1)
+    shutil.rmtree(args.path, ignore_errors=True)
+    index = SearchIndex(args.path, refresh_interval=0)
+
+    begin = time.perf_counter()
+    batch = []
+    for i in range(1, args.docs + 1):
+        batch.append(random_document(i))
+        if len(batch) == 10000:
+            index.store.put(batch)
+            batch = []
+    if batch:
+        index.store.put(batch)
+    print('写入文档库 %d 条: %.1fs' % (args.docs, time.perf_counter() - begin))
+
+    begin = time.perf_counter()
+    index.build()
+    segment, delta = index.refresh(force=True)
+    print('建立索引文件: %.1fs, %.1fMB, %d 个词' % (
+        time.perf_counter() - begin, os.path.getsize(segment.filename) / 1024 / 1024, segment.term_count))
+
+    # 预热
+    run_queries(index, 100)
+    report('索引文件', *run_queries(index, args.queries))
+
+    index.store.put([random_document(random.randint(1, args.docs)) for i in range(args.delta)])
+    index.refresh(force=True)
+    report('含补充索引', *run_queries(index, args.queries))
+
+    shutil.rmtree(args.path, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
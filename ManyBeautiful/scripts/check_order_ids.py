@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""
+功能：多进程多线程并发生成订单号, 检查没有重复, 每个线程生成的订单号按字符串排序递增且长度相同
+    进程编号由父进程从redis租用(orders.idgen.allocate_worker_id)后传给子进程,
+    子进程运行期间模拟其他进程的多次启动退出(租用后释放), 次数超过进程编号总数时会循环,
+    检查不会分配到子进程仍持有的编号
+使用方法:
+    ./check_order_ids.py [--processes 4] [--threads 2] [--count 500000] [--restarts 20000]
+    --count为每个线程生成的订单号数量, 默认共生成400万个
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import uuid
+
+# 设置导包路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ManyBeautifulMall.settings.dev')
+
+import django
+
+django.setup()
+
+from orders.idgen import OrderIdGenerator, WORKER_ID_COUNT, allocate_worker_id, release_worker_id
+
+
+def generate(args):
+    """
+    子进程: 多个线程共用一个生成器生成订单号
+    :return: (订单号列表, 错误说明列表)
+    """
+    worker_id, threads, count = args
+    generator = OrderIdGenerator(worker_id)
+    results = [None] * threads
+    errors = []
+
+    def run(index):
+        ids = [generator.generate() for i in range(count)]
+        for previous, current in zip(ids, ids[1:]):
+            if not previous < current or len(previous) != len(current):
+                errors.append('进程编号%s 线程%s: %s -> %s' % (worker_id, index, previous, current))
+                break
+        results[index] = ids
+
+    workers = [threading.Thread(target=run, args=(index,)) for index in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return [order_id for ids in results for order_id in ids], errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description='订单号并发唯一性检查')
+    parser.add_argument('--processes', type=int, default=4, help='进程数')
+    parser.add_argument('--threads', type=int, default=2, help='每个进程的线程数')
+    parser.add_argument('--count', type=int, default=500000, help='每个线程生成的订单号数量')
+    parser.add_argument('--restarts', type=int, default=WORKER_ID_COUNT * 2, help='模拟其他进程启动退出的次数')
+    options = parser.parse_args()
+
+    leases = []
+    for i in range(options.processes):
+        token = uuid.uuid4().hex
+        leases.append((allocate_worker_id(token), token))
+    held = set(worker_id for worker_id, token in leases)
+    jobs = [(worker_id, options.threads, options.count) for worker_id, token in leases]
+
+    start = time.perf_counter()
+    try:
+        with multiprocessing.Pool(options.processes) as pool:
+            result = pool.map_async(generate, jobs)
+            reused = 0
+            for i in range(options.restarts):
+                token = uuid.uuid4().hex
+                worker_id = allocate_worker_id(token)
+                if worker_id in held:
+                    reused += 1
+                release_worker_id(worker_id, token)
+            results = result.get()
+    finally:
+        for worker_id, token in leases:
+            release_worker_id(worker_id, token)
+    elapsed = time.perf_counter() - start
+
+    all_ids = []
+    errors = []
+    for ids, process_errors in results:
+        all_ids.extend(ids)
+        errors.extend(process_errors)
+
+    all_ids.sort()
+    duplicates = sum(1 for previous, current in zip(all_ids, all_ids[1:]) if previous == current)
+
+    print('生成订单号 %d 个, 耗时 %.2fs, %.0f 个/秒' % (len(all_ids), elapsed, len(all_ids) / elapsed))
+    print('最小 %s 最大 %s' % (all_ids[0], all_ids[-1]))
+    print('重复 %d 个' % duplicates)
+    print('模拟启动 %d 次, 分配到仍被持有的进程编号 %d 次' % (options.restarts, reused))
+    for error in errors:
+        print('顺序错误 ' + error)
+
+    if duplicates or errors or reused:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()